@@ -0,0 +1,123 @@
+'''
+Fast loader of driving_log.csv files recorded by the dbw_node (RECORD_CSV = True).
+
+The csv is parsed with np.genfromtxt into one float64 array per column, empty cells are NaN.
+The columns are cached as .npy files in a directory next to the log (<log>.columns/), keyed by
+the size and mtime of the csv. Loading a cached log memory-maps the columns, so only the columns that are
+used are read from disk.
+
+    from log_loader import load_log
+    log = load_log('records/driving_log.csv')
+    log['v'], log['v_des'], log.columns
+'''
+
+import json
+import os
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+
+class DrivingLog(OrderedDict):
+    """ column name -> array, in the order of the csv header """
+    def __init__(self, columns=(), path=None):
+        OrderedDict.__init__(self, columns)
+        self.path = path
+
+    @property
+    def columns(self):
+        return list(self.keys())
+
+    def __len__(self):
+        return len(next(iter(self.values()))) if OrderedDict.__len__(self) else 0
+
+    def time(self):
+        """ time since the start of the log [s], sample index if the log has no time column """
+        if 'time' in self:
+            return self['time'] - self['time'][0]
+        return np.arange(len(self), dtype=np.float64)
+
+
+def parse_log(path):
+    """ parse a csv with a header line and numeric values, empty cells become NaN """
+    with open(path) as fid:
+        header = fid.readline().strip().split(',')
+
+    with warnings.catch_warnings():
+        # incomplete rows, e.g. the last row of a log of a crashed node, are dropped
+        warnings.simplefilter('ignore')
+        values = np.genfromtxt(path, dtype=np.float64, delimiter=',', skip_header=1, invalid_raise=False)
+    values = values.reshape(-1, len(header))
+    return DrivingLog(((name, np.ascontiguousarray(values[:, i])) for i, name in enumerate(header)), path)
+
+
+def cache_dir(path):
+    return path + '.columns'
+
+
+def source_key(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def read_cache(path):
+    directory = cache_dir(path)
+    try:
+        with open(os.path.join(directory, 'columns.json')) as fid:
+            meta = json.load(fid)
+        if meta['source'] != source_key(path):
+            return None
+        return DrivingLog(((name, np.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+                           for name in meta['columns']), path)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def write_cache(log):
+    directory = cache_dir(log.path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for name, column in log.items():
+        np.save(os.path.join(directory, name + '.npy'), column)
+    # the meta file is written last, an interrupted write leaves no valid cache
+    with open(os.path.join(directory, 'columns.json'), 'w') as fid:
+        json.dump({'source': source_key(log.path), 'columns': log.columns}, fid)
+
+
+def load_log(path, cache=True):
+    """ load a driving log, from the columnar cache if it is up to date """
+    if cache:
+        log = read_cache(path)
+        if log is not None:
+            return log
+
+    log = parse_log(path)
+    if cache:
+        try:
+            write_cache(log)
+        except (IOError, OSError):
+            pass
+    return log
+
+
+def minmax_decimate(x, y, buckets):
+    """ reduce a line to the minimum and maximum of y in each of `buckets` equally sized index ranges
+
+    The decimated line looks the same as the full line when every bucket is at most one pixel
+    wide, x has to be sorted.
+    """
+    n = len(y)
+    if n <= 2 * buckets:
+        return np.asarray(x), np.asarray(y)
+
+    size = n // buckets
+    m = size * buckets
+    blocks = np.asarray(y[:m]).reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    i_min = offsets + np.argmin(blocks, axis=1)
+    i_max = offsets + np.argmax(blocks, axis=1)
+
+    # keep the order of minimum and maximum within each bucket, and the tail of the line
+    index = np.sort(np.concatenate((i_min, i_max, np.arange(m, n))))
+    return np.asarray(x)[index], np.asarray(y)[index]
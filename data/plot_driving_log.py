@@ -1,52 +1,73 @@
+'''
+Plot a driving_log.csv of the dbw_node.
+
+The log is loaded with log_loader (vectorized, cached as columns) and every line is drawn with
+min/max decimation of the visible range, re-decimated on zoom and pan, so multi-hour logs stay
+interactive.
+
+    python plot_driving_log.py [records/driving_log.csv] [--width 2000]
+'''
+
+import argparse
+
 import matplotlib.pyplot as plt
-import csv
-
-with open('./records/driving_log.csv', 'rb') as csvfile:
-    reader = csv.reader(csvfile, delimiter=',')
-    count = 0
-    for row in reader:
-        if count == 0:
-            variables = row
-            for variable in variables:
-                exec(variable + " = []")
-            count += 1
-        else:
-            for i in range(len(row)):
-                exec(variables[i] + ".append(" + row[i] + ")")
-            count += 1
-
-plt.subplot(511)
-plt.plot(throttle, label='throttle')
-plt.hold
-plt.plot(throttle_des, label='throttle_des')
-plt.grid(True)
-plt.legend()
-
-plt.subplot(512)
-plt.plot(brake, label='brake')
-plt.hold
-plt.plot(brake_des, label='brake_des')
-plt.legend()
-plt.grid(True)
-
-
-plt.subplot(513)
-plt.plot(torque, label='torque')
-plt.grid(True)
-plt.legend()
-
-plt.subplot(514)
-plt.plot(v, label='v')
-plt.hold
-plt.plot(v_des, label='v_des')
-plt.grid(True)
-plt.legend()
-
-plt.subplot(515)
-plt.plot(v_d, label='v_d')
-plt.hold
-plt.plot(v_d_des, label='v_d_des')
-plt.grid(True)
-plt.legend()
-
-plt.show()
\ No newline at end of file
+import numpy as np
+
+from log_loader import load_log, minmax_decimate
+
+# panels of the plot, each with the columns drawn in it (missing columns are skipped)
+PANELS = [['throttle', 'throttle_des'],
+          ['brake', 'brake_des'],
+          ['torque'],
+          ['v', 'v_des'],
+          ['v_d', 'v_d_des']]
+
+
+class DecimatedLine(object):
+    """ line showing the min/max decimation of the visible x range of the full data """
+    def __init__(self, ax, x, y, buckets, **kwargs):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.buckets = buckets
+        self.line, = ax.plot(*minmax_decimate(self.x, self.y, buckets), **kwargs)
+
+    def update(self, lo, hi):
+        # one sample beyond the visible range on each side, the line leaves the axes
+        start = max(np.searchsorted(self.x, lo) - 1, 0)
+        stop = min(np.searchsorted(self.x, hi) + 1, len(self.x))
+        self.line.set_data(*minmax_decimate(self.x[start:stop], self.y[start:stop], self.buckets))
+
+
+def plot_log(log, buckets=2000):
+    t = log.time()
+    panels = [[name for name in names if name in log] for names in PANELS]
+    panels = [names for names in panels if names]
+
+    fig, axes = plt.subplots(len(panels), 1, sharex=True, squeeze=False)
+    lines = []
+    for ax, names in zip(axes[:, 0], panels):
+        for name in names:
+            lines.append(DecimatedLine(ax, t, log[name], buckets, label=name))
+        ax.grid(True)
+        ax.legend()
+
+    def update(ax):
+        # shared axes do not emit xlim_changed themselves, update the lines of all panels
+        for line in lines:
+            line.update(*ax.get_xlim())
+    for ax in axes[:, 0]:
+        ax.callbacks.connect('xlim_changed', update)
+    axes[-1, 0].set_xlabel('time [s]' if 'time' in log else 'sample')
+    fig.suptitle(log.path)
+    return fig, lines
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='plot a driving log of the dbw_node')
+    parser.add_argument('log', nargs='?', default='./records/driving_log.csv')
+    parser.add_argument('--width', type=int, default=2000, help='min/max buckets per line, about the plot width in pixels')
+    parser.add_argument('--no-cache', action='store_true', help='do not read or write the columnar cache')
+    args = parser.parse_args()
+
+    fig, lines = plot_log(load_log(args.log, cache=not args.no_cache), args.width)
+    plt.show()
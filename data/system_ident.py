@@ -0,0 +1,166 @@
+'''
+System identification of the longitudinal vehicle model of the dbw_node from driving logs.
+
+The model of dbw_node.py
+    m * dv/dt = P_THROTTLE / r * throttle - P_BRAKE / r * brake - D_RESIST * v
+is fitted in its integrated form, as in MATLAB/HM_SystemIdent.m:
+    v[k] = v0 + alpha * sum(v * dt) + beta * sum(throttle * dt) + gamma * sum(brake * dt)
+with the sums over all samples before k, so that the noisy acceleration is never differentiated.
+Then D_RESIST = -alpha * m, P_THROTTLE = beta * r * m and P_BRAKE = -gamma * r * m.
+
+Each log gets its own initial velocity v0, the coefficients are shared. Logs are loaded and
+integrated in a process pool, the equations of all logs are stacked into one least squares
+problem. Fit quality (RMSE and R^2 of the velocity and of the predicted acceleration) is
+reported per log. The parameters are written as yaml that the dbw_node loads:
+
+    python system_ident.py records/*.csv --mass 1080 --wheel-radius 0.335 --output vehicle_model.yaml
+    roslaunch twist_controller dbw_sim.launch vehicle_model:=/path/to/vehicle_model.yaml
+'''
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import yaml
+
+from log_loader import load_log
+
+MASS = 1080.  # total vehicle mass of dbw_sim.launch [kg]
+WHEEL_RADIUS = 0.335  # [m]
+
+
+def prepare(job):
+    """ regressors and velocity of one log, runs in a worker process
+
+    Returns:
+        dict: name, integrated regressors H (n, 3), velocity v (n), instantaneous regressors H_d (n, 3)
+            and the acceleration (n) of the selected samples
+
+    """
+    path, start, stop, flatten_brake = job
+    log = load_log(path)
+    # unfiltered velocity, older logs only have the filtered one
+    velocity = 'v_raw' if 'v_raw' in log else 'v'
+    missing = [name for name in ('time', velocity, 'throttle', 'brake') if name not in log]
+    if missing:
+        raise ValueError("{} has no column {}".format(path, ', '.join(missing)))
+
+    t = np.asarray(log['time'][start:stop])
+    v = np.asarray(log[velocity][start:stop])
+    throttle = np.asarray(log['throttle'][start:stop])
+    brake = np.array(log['brake'][start:stop])
+
+    if flatten_brake and np.any(brake > 0):
+        # the recorded brake torque is ramped up/down, the recorded velocities suggest otherwise
+        brake[brake > 0] = brake.max()
+
+    dt = np.diff(t)
+    v, throttle, brake = v[:-1], throttle[:-1], brake[:-1]
+    acc = np.diff(np.asarray(log[velocity][start:stop])) / dt
+    h_d = np.column_stack((v, throttle, brake))
+
+    # integrals over the samples before k
+    h = np.zeros_like(h_d)
+    np.cumsum(h_d[:-1] * dt[:-1, None], axis=0, out=h[1:])
+
+    return {'name': os.path.basename(path), 'H': h, 'v': v, 'H_d': h_d, 'acc': acc}
+
+
+def fit(logs, intercept=True):
+    """ least squares over all logs, one initial velocity per log and shared coefficients
+
+    Returns:
+        (np.ndarray, np.ndarray): alpha, beta, gamma and the initial velocity of each log
+
+    """
+    num = len(logs)
+    rows = sum(len(log['v']) for log in logs)
+    columns = 3 + (num if intercept else 0)
+    a = np.zeros((rows, columns))
+    b = np.zeros(rows)
+
+    row = 0
+    for i, log in enumerate(logs):
+        n = len(log['v'])
+        a[row:row + n, :3] = log['H']
+        if intercept:
+            a[row:row + n, 3 + i] = 1.
+        b[row:row + n] = log['v']
+        row += n
+
+    solution = np.linalg.lstsq(a, b, rcond=-1)[0]
+    return solution[:3], solution[3:] if intercept else np.zeros(num)
+
+
+def r_squared(measured, predicted):
+    residual = np.sum((measured - predicted) ** 2)
+    total = np.sum((measured - np.mean(measured)) ** 2)
+    return 1. - residual / total if total > 0 else float('nan')
+
+
+def quality(log, params, v0):
+    """ fit quality of one log """
+    v_pred = v0 + log['H'].dot(params)
+    acc_pred = log['H_d'].dot(params)
+    return {'samples': len(log['v']),
+            'v_rmse': float(np.sqrt(np.mean((log['v'] - v_pred) ** 2))),
+            'v_r2': float(r_squared(log['v'], v_pred)),
+            'acc_rmse': float(np.sqrt(np.mean((log['acc'] - acc_pred) ** 2))),
+            'acc_r2': float(r_squared(log['acc'], acc_pred))}
+
+
+def vehicle_parameters(params, mass, wheel_radius):
+    alpha, beta, gamma = params
+    return {'d_resist': float(-alpha * mass),
+            'p_throttle': float(beta * wheel_radius * mass),
+            'p_brake': float(-gamma * wheel_radius * mass)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='fit P_THROTTLE, D_RESIST and P_BRAKE of the dbw_node to logs')
+    parser.add_argument('logs', nargs='+', help='driving_log.csv files with time, v_raw (or v), throttle and brake')
+    parser.add_argument('--mass', type=float, default=MASS, help='total vehicle mass [kg]')
+    parser.add_argument('--wheel-radius', type=float, default=WHEEL_RADIUS, help='[m]')
+    parser.add_argument('--start', type=int, default=0, help='first sample of each log')
+    parser.add_argument('--stop', type=int, default=None, help='end sample of each log')
+    parser.add_argument('--no-flatten-brake', action='store_true', help='use the recorded brake ramps')
+    parser.add_argument('--no-intercept', action='store_true', help='assume every log starts at v = 0')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--output', help='yaml file with the parameters for the dbw_node')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    jobs = [(path, args.start, args.stop, not args.no_flatten_brake) for path in args.logs]
+    if args.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(jobs)))
+        try:
+            logs = pool.map(prepare, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        logs = [prepare(job) for job in jobs]
+
+    params, v0 = fit(logs, intercept=not args.no_intercept)
+    vehicle = vehicle_parameters(params, args.mass, args.wheel_radius)
+    elapsed = time.time() - start_time
+
+    print("alpha = {:12.7f} --> d_resist   = {:12.4f}".format(params[0], vehicle['d_resist']))
+    print("beta  = {:12.7f} --> p_throttle = {:12.4f}".format(params[1], vehicle['p_throttle']))
+    print("gamma = {:12.7f} --> p_brake    = {:12.4f}".format(params[2], vehicle['p_brake']))
+    print("{} logs, {} samples in {:.2f}s".format(len(logs), sum(len(log['v']) for log in logs), elapsed))
+
+    fit_quality = {}
+    for log, log_v0 in zip(logs, v0):
+        fit_quality[log['name']] = quality(log, params, log_v0)
+        print("  {name:40s} n={samples:6d} v: rmse={v_rmse:.3f}m/s r2={v_r2:.4f}  "
+              "acc: rmse={acc_rmse:.3f}m/s^2 r2={acc_r2:.4f}".format(name=log['name'], **fit_quality[log['name']]))
+
+    if args.output:
+        with open(args.output, 'w') as fid:
+            fid.write("# identified with system_ident.py from {}\n".format(', '.join(args.logs)))
+            yaml.safe_dump(vehicle, fid, default_flow_style=False)
+            yaml.safe_dump({'identification': {'mass': args.mass, 'wheel_radius': args.wheel_radius,
+                                               'fit_quality': fit_quality}}, fid, default_flow_style=False)
@@ -2,17 +2,16 @@
 import rospy
 
 import tf
-from geometry_msgs.msg import PoseStamped, Quaternion, TwistStamped
+from geometry_msgs.msg import PoseStamped, PoseArray, Pose, Quaternion, TwistStamped
 from dbw_mkz_msgs.msg import SteeringReport, ThrottleCmd, BrakeCmd, SteeringCmd
 from std_msgs.msg import Float32 as Float
 from std_msgs.msg import Bool
 from sensor_msgs.msg import PointCloud2
 from sensor_msgs.msg import Image
-import sensor_msgs.point_cloud2 as pcl2
 from std_msgs.msg import Header
 from cv_bridge import CvBridge, CvBridgeError
 
-from styx_msgs.msg import TrafficLight, TrafficLightArray, Lane
+from styx_msgs.msg import TrafficLight, TrafficLightArray, Lane, Trajectory, FrameSlot
 import numpy as np
 from PIL import Image as PIL_Image
 from io import BytesIO
@@ -20,10 +19,15 @@ import base64
 
 import math
 
+from frame_ring import FrameRing
+from pointcloud import create_cloud_xyz32, points_from_columns, voxel_downsample
+from metrics import TimedPublisher, timed_callback
+
 TYPE = {
     'bool': Bool,
     'float': Float,
     'pose': PoseStamped,
+    'pose_array': PoseArray,
     'pcl': PointCloud2,
     'twist': TwistStamped,
     'steer': SteeringReport,
@@ -32,14 +36,17 @@ TYPE = {
     'brake_cmd': BrakeCmd,
     'throttle_cmd': ThrottleCmd,
     'path_draw': Lane,
-    'image':Image
+    'trajectory': Trajectory,
+    'image':Image,
+    'frame_slot': FrameSlot
 }
 
 
 class Bridge(object):
-    def __init__(self, conf, server):
+    def __init__(self, conf, server, metrics=None):
         rospy.init_node('styx_server')
         self.server = server
+        self.metrics = metrics
         self.vel = 0.
         self.yaw = None
         self.angular_vel = 0.
@@ -49,15 +56,32 @@ class Bridge(object):
             '/vehicle/steering_cmd': self.callback_steering,
             '/vehicle/throttle_cmd': self.callback_throttle,
             '/vehicle/brake_cmd': self.callback_brake,
-        '/final_waypoints': self.callback_path
+        '/final_trajectory': self.callback_path
         }
 
+        # optional per-topic rate and latency measurement
+        if metrics is not None:
+            self.callbacks = {topic: timed_callback(topic, callback, metrics)
+                              for topic, callback in self.callbacks.items()}
+
         self.subscribers = [rospy.Subscriber(e.topic, TYPE[e.type], self.callbacks[e.topic])
                             for e in conf.subscribers]
 
         self.publishers = {e.name: rospy.Publisher(e.topic, TYPE[e.type], queue_size=1)
                            for e in conf.publishers}
 
+        if metrics is not None:
+            self.publishers = {name: TimedPublisher(pub, metrics) for name, pub in self.publishers.items()}
+
+        # optional voxel-grid downsampling of point clouds, edge length (0 = disabled) of the ~voxel_size
+        # param, a 'voxel_size' of a publisher in conf.py overrides it
+        voxel_size = rospy.get_param('~voxel_size', 0.)
+        self.voxel_sizes = {e.name: e.get('voxel_size', voxel_size) for e in conf.publishers}
+
+        # camera frames are written to shared memory (see frame_ring.py), the image_slot topic only
+        # carries the slot, the image topic is only published if someone subscribes to it
+        self.frame_ring = FrameRing.create() if rospy.get_param('~frame_ring', True) else None
+
     def create_light(self, x, y, z, yaw, state):
         light = TrafficLight()
 
@@ -112,11 +136,12 @@ class Bridge(object):
         self.prev_time = rospy.get_time()
         return angular_vel
 
-    def create_point_cloud_message(self, pts):
+    def create_point_cloud_message(self, name, pts):
         header = Header()
         header.stamp = rospy.Time.now()
         header.frame_id = '/world'
-        cloud_message = pcl2.create_cloud_xyz32(header, pts)
+        pts = voxel_downsample(pts, self.voxel_sizes[name])
+        cloud_message = create_cloud_xyz32(header, pts)
         return cloud_message
 
     def broadcast_transform(self, name, position, orientation):
@@ -147,17 +172,31 @@ class Bridge(object):
         self.publishers['brake_report'].publish(self.create_float(brake))
 
     def publish_obstacles(self, data):
-        for obs in data['obstacles']:
-            pose = self.create_pose(obs[0], obs[1], obs[2])
-            self.publishers['obstacle'].publish(pose)
-        header = Header()
-        header.stamp = rospy.Time.now()
-        header.frame_id = '/world'
-        cloud = pcl2.create_cloud_xyz32(header, data['obstacles'])
-        self.publishers['obstacle_points'].publish(cloud)
+        obstacles = np.asarray(data['obstacles'], dtype=np.float64).reshape(-1, 3)
+
+        # all obstacles in a single message, orientation is not provided by the simulator
+        poses = PoseArray()
+        poses.header.stamp = rospy.Time.now()
+        poses.header.frame_id = '/world'
+        for x, y, z in obstacles:
+            pose = Pose()
+            pose.position.x = x
+            pose.position.y = y
+            pose.position.z = z
+            pose.orientation.w = 1.
+            poses.poses.append(pose)
+        self.publishers['obstacles'].publish(poses)
+
+        # legacy topic with one PoseStamped per obstacle, only published if someone subscribes to it
+        if self.publishers['obstacle'].get_num_connections() > 0:
+            for x, y, z in obstacles:
+                self.publishers['obstacle'].publish(self.create_pose(x, y, z))
+
+        self.publishers['obstacle_points'].publish(self.create_point_cloud_message('obstacle_points', obstacles))
 
     def publish_lidar(self, data):
-        self.publishers['lidar'].publish(self.create_point_cloud_message(zip(data['lidar_x'], data['lidar_y'], data['lidar_z'])))
+        pts = points_from_columns(data['lidar_x'], data['lidar_y'], data['lidar_z'])
+        self.publishers['lidar'].publish(self.create_point_cloud_message('lidar', pts))
 
     def publish_traffic(self, data):
         x, y, z = data['light_pos_x'], data['light_pos_y'], data['light_pos_z'],
@@ -174,12 +213,33 @@ class Bridge(object):
     def publish_dbw_status(self, data):
         self.publishers['dbw_status'].publish(Bool(data))
 
+    def create_frame_slot(self, slot, sequence, image_array, stamp):
+        msg = FrameSlot()
+        msg.header.stamp = stamp
+        msg.header.frame_id = '/camera'
+        msg.ring = self.frame_ring.path
+        msg.slot = slot
+        msg.sequence = sequence
+        msg.height, msg.width = image_array.shape[:2]
+        msg.encoding = 'rgb8'
+        return msg
+
     def publish_camera(self, data):
         imgString = data["image"]
         image = PIL_Image.open(BytesIO(base64.b64decode(imgString)))
         image_array = np.asarray(image)
+        # origin of the latency traces of the tl_detector, see latency_trace.py
+        stamp = rospy.Time.now()
+
+        if self.frame_ring is not None and self.frame_ring.fits(image_array):
+            slot, sequence = self.frame_ring.write(image_array, stamp.to_sec())
+            self.publishers['image_slot'].publish(self.create_frame_slot(slot, sequence, image_array, stamp))
+            if self.publishers['image'].get_num_connections() == 0:
+                return
 
         image_message = self.bridge.cv2_to_imgmsg(image_array, encoding="rgb8")
+        image_message.header.stamp = stamp
+        image_message.header.frame_id = '/camera'
         self.publishers['image'].publish(image_message)
 
     def callback_steering(self, data):
@@ -192,15 +252,9 @@ class Bridge(object):
         self.server('brake', data={'brake': str(data.pedal_cmd)})
 
     def callback_path(self, data):
-        x_values = []
-        y_values = []
-        z_values = []
-        for waypoint in data.waypoints:
-            x = waypoint.pose.pose.position.x
-            y = waypoint.pose.pose.position.y
-            z = waypoint.pose.pose.position.z+0.5
-            x_values.append(x)
-            y_values.append(y)
-            z_values.append(z)
+        # compact styx_msgs/Trajectory of the waypoint_updater (see waypoint_updater/trajectory.py)
+        x_values = list(data.x)
+        y_values = list(data.y)
+        z_values = [z + 0.5 for z in data.z]
 
         self.server('drawline', data={'next_x': x_values, 'next_y': y_values, 'next_z': z_values})
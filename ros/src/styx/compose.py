@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+'''
+Composed mode: the styx bridge, waypoint_updater, tl_detector and dbw_node in one process.
+
+The nodes run unchanged, each in its own thread, on the in-process bus of inproc.py. Messages
+between them are handed over as object references instead of being serialized over TCPROS,
+e.g. the camera images of the bridge and the trajectories of the waypoint_updater.
+
+With a ROS master the process is one ROS node: all topics are also published to ROS and the
+topics of the nodes outside of the process (EXTERNAL_TOPICS, e.g. /twist_cmd of pure_pursuit,
+which is C++ and stays a separate node) are subscribed from ROS:
+
+    roslaunch styx compose.launch
+
+Without a ROS master the process is a local stand-in, the parameters are read from yaml files
+(launch/compose_params.yaml by default, $(find pkg) is resolved) and the waypoint_loader runs
+in the process as well. Everything that the nodes in the process do not publish themselves,
+like /twist_cmd, is missing then:
+
+    rosrun styx compose.py --master no --nodes waypoint_loader,waypoint_updater,tl_detector
+
+The socket.io server of server.py runs in the main thread, the simulator (or kinematic_sim.py)
+connects to it as usual.
+'''
+
+import argparse
+import importlib
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+
+import rosgraph
+import rospkg
+import rospy
+import yaml
+
+import inproc
+
+# node name -> package, module and class of the node
+NODES = OrderedDict([('waypoint_loader', ('waypoint_loader', 'waypoint_loader', 'WaypointLoader')),
+                     ('waypoint_updater', ('waypoint_updater', 'waypoint_updater', 'WaypointUpdater')),
+                     ('tl_detector', ('tl_detector', 'tl_detector', 'TLDetector')),
+                     ('dbw_node', ('twist_controller', 'dbw_node', 'DBWNode'))])
+
+# topics published by nodes outside of the process, subscribed from ROS
+# (/tf and /tf_static for transforms of other nodes, those of the bridge go over the bus)
+EXTERNAL_TOPICS = ['/twist_cmd', '/base_track', '/base_waypoints', '/obstacle_waypoint', '/tf', '/tf_static']
+
+PARAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'launch', 'compose_params.yaml')
+
+
+def load_params(paths, light_config):
+    """ parameter tree of yaml files and the traffic light config """
+    rospack = rospkg.RosPack()
+    params = {}
+    for path in paths:
+        with open(path) as fid:
+            text = re.sub(r'\$\(find ([\w-]+)\)', lambda match: rospack.get_path(match.group(1)), fid.read())
+        for namespace, values in (yaml.safe_load(text) or {}).items():
+            params.setdefault(namespace, {}).update(values)
+    with open(light_config) as fid:
+        params['traffic_light_config'] = fid.read()
+    return params
+
+
+def start_node(name):
+    """ import and run a node in a thread, the constructor of every node spins until shutdown """
+    package, module_name, class_name = NODES[name]
+    sys.path.append(rospkg.RosPack().get_path(package))
+    node_class = getattr(importlib.import_module(module_name), class_name)
+
+    thread = threading.Thread(target=node_class, name=name)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description='run the bridge and nodes in one process')
+    parser.add_argument('--master', choices=['auto', 'yes', 'no'], default='auto',
+                        help='connect to a ROS master, auto = if one is running')
+    parser.add_argument('--nodes', help='comma separated nodes, default: waypoint_updater, tl_detector, '
+                                        'dbw_node and without a master also the waypoint_loader')
+    parser.add_argument('--params', nargs='*', default=[PARAMS], help='yaml files, only without a master')
+    parser.add_argument('--light-config', help='traffic light config, only without a master',
+                        default=os.path.join(rospkg.RosPack().get_path('tl_detector'), 'sim_traffic_light_config.yaml'))
+    parser.add_argument('--port', type=int, default=4567)
+    args = parser.parse_args(rospy.myargv()[1:])
+
+    ros = args.master == 'yes' or (args.master == 'auto' and rosgraph.is_master_online())
+    if args.nodes:
+        nodes = args.nodes.split(',')
+    else:
+        nodes = [name for name in NODES if not ros or name != 'waypoint_loader']
+    unknown = [name for name in nodes if name not in NODES]
+    if unknown:
+        parser.error("unknown nodes {}, available are {}".format(', '.join(unknown), ', '.join(NODES)))
+
+    bus = inproc.Bus(None if ros else load_params(args.params, args.light_config), ros=ros,
+                     external=[topic for topic in EXTERNAL_TOPICS
+                               if not (topic.startswith('/base_') and 'waypoint_loader' in nodes)])
+    # from here on every `import rospy` of the nodes gets the bus
+    sys.modules['rospy'] = inproc.make_rospy(bus)
+
+    # the bridge and its socket.io server are created on import
+    import eventlet.wsgi
+    import socketio
+    import server
+
+    for name in nodes:
+        start_node(name)
+    rospy.loginfo("composed {} with the bridge, {}".format(
+        ', '.join(nodes), 'connected to the ROS master' if ros else 'without a ROS master'))
+
+    try:
+        eventlet.wsgi.server(eventlet.listen(('', args.port)), socketio.Middleware(server.sio, server.app))
+    finally:
+        bus.shutdown('compose.py terminated')
+
+
+if __name__ == '__main__':
+    main()
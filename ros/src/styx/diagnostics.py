@@ -0,0 +1,39 @@
+'''
+diagnostic_msgs of the monitors of all packages, published on /diagnostics.
+
+    pub = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size=1)
+    pub.publish(diagnostic_array([diagnostic_status('dbw_node: control loop', 'dbw_node', summary)]))
+
+Other packages import this module with
+
+    sys.path.append(rospkg.RosPack().get_path('styx'))
+    from diagnostics import diagnostic_array, diagnostic_status
+'''
+
+import rospy
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+
+
+def diagnostic_status(name, hardware_id, values, level=DiagnosticStatus.OK, message=''):
+    """ status with one KeyValue per value
+
+    Args:
+        values (dict or list): a dict is sorted by key, a list of (key, value) pairs keeps its order,
+            list values (e.g. histogram buckets) are left out
+
+    """
+    status = DiagnosticStatus()
+    status.level = level
+    status.name = name
+    status.hardware_id = hardware_id
+    status.message = message
+    items = sorted(values.items()) if isinstance(values, dict) else values
+    status.values = [KeyValue(key, str(value)) for key, value in items if not isinstance(value, list)]
+    return status
+
+
+def diagnostic_array(statuses):
+    array = DiagnosticArray()
+    array.header.stamp = rospy.Time.now()
+    array.status = list(statuses)
+    return array
@@ -0,0 +1,143 @@
+'''
+Shared-memory ring of camera frames between the styx bridge and the tl_detector.
+
+The bridge writes every decoded camera frame into the next of a fixed number of preallocated
+slots of a memory-mapped file (in /dev/shm if available) and only publishes a small
+styx_msgs/FrameSlot with the ring path, slot and sequence number. The tl_detector maps the file
+read-only and classifies a numpy view of the slot without any copy.
+
+The sequence number of a slot is the lock: the writer sets it to 0 before it touches the frame
+and to the new (unique, increasing) sequence number when the frame is complete. A frame is
+only valid while its slot still holds its sequence number, readers check it before and after
+they use the view:
+
+    frame = ring.view(msg.slot, msg.sequence)  # None if already overwritten
+    state = classify(frame)
+    if not ring.valid(msg.slot, msg.sequence):
+        pass  # overwritten while in use, the result is discarded
+
+Other packages import this module with
+
+    sys.path.append(rospkg.RosPack().get_path('styx'))
+    from frame_ring import FrameRing
+'''
+
+import errno
+import glob
+import itertools
+import mmap
+import os
+
+import numpy as np
+
+from storage import atomic_write, shared_memory_dir
+
+MAGIC = b'STYXRING'
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('slots', '<u4'), ('height', '<u4'), ('width', '<u4'),
+                         ('channels', '<u4')])
+SLOT_DTYPE = np.dtype([('sequence', '<u8'), ('stamp', '<f8'), ('height', '<u4'), ('width', '<u4')])
+PAGE = 4096
+SLOTS = 8
+FRAME_SHAPE = (600, 800, 3)  # camera of the simulator
+RING_DIR = shared_memory_dir('styx_frames')
+
+
+_rings = itertools.count()
+
+
+def _aligned(size):
+    return (size + PAGE - 1) // PAGE * PAGE
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class FrameRing(object):
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.writable = writable
+        with open(path, 'r+b' if writable else 'rb') as fid:
+            self.mmap = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+
+        header = np.frombuffer(self.mmap, HEADER_DTYPE, 1)[0]
+        if header['magic'] != MAGIC:
+            raise ValueError("{} is not a frame ring".format(path))
+        self.slots = int(header['slots'])
+        self.shape = (int(header['height']), int(header['width']), int(header['channels']))
+
+        table_offset = _aligned(HEADER_DTYPE.itemsize)
+        frames_offset = table_offset + _aligned(self.slots * SLOT_DTYPE.itemsize)
+        self.table = np.frombuffer(self.mmap, SLOT_DTYPE, self.slots, table_offset)
+        self.frames = np.frombuffer(self.mmap, np.uint8, self.slots * int(np.prod(self.shape)),
+                                    frames_offset).reshape((self.slots,) + self.shape)
+        self.sequence = int(self.table['sequence'].max())
+
+    @classmethod
+    def create(cls, name='camera', slots=SLOTS, shape=FRAME_SHAPE, directory=RING_DIR):
+        """ new ring file of the writing process, older rings of the same name are removed
+
+        Only rings of this process and of processes that are gone are removed, other live writers
+        (a second bridge or classifier) keep theirs. Readers that still map an old ring keep their
+        pages until they switch to the new path.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for old in glob.glob(os.path.join(directory, "{}.*.ring".format(name))):
+            pid = os.path.basename(old)[len(name) + 1:].split('.')[0]
+            if pid.isdigit() and (int(pid) == os.getpid() or not _alive(int(pid))):
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass  # removed by another writer at the same time
+
+        # unique path, readers reopen a ring when the path of the descriptor changes
+        path = os.path.join(directory, "{}.{}.{}.ring".format(name, os.getpid(), next(_rings)))
+        table_offset = _aligned(HEADER_DTYPE.itemsize)
+        size = table_offset + _aligned(slots * SLOT_DTYPE.itemsize) + _aligned(slots * int(np.prod(shape)))
+        header = np.zeros(1, HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['slots'] = slots
+        header['height'], header['width'], header['channels'] = shape
+
+        def write(fid):
+            fid.truncate(size)
+            fid.write(header.tobytes())
+        atomic_write(path, write)
+        return cls(path, writable=True)
+
+    def fits(self, frame):
+        return frame.dtype == np.uint8 and frame.ndim == 3 and frame.shape[2] == self.shape[2] and \
+            frame.shape[0] <= self.shape[0] and frame.shape[1] <= self.shape[1]
+
+    def write(self, frame, stamp=0.):
+        """ copy a frame into the next slot, returns slot and sequence number """
+        if not self.fits(frame):
+            raise ValueError("frame of shape {} does not fit into slots of {}".format(frame.shape, self.shape))
+        self.sequence += 1
+        slot = self.sequence % self.slots
+        height, width = frame.shape[:2]
+
+        self.table['sequence'][slot] = 0
+        self.frames[slot, :height, :width] = frame
+        self.table['stamp'][slot] = stamp
+        self.table['height'][slot] = height
+        self.table['width'][slot] = width
+        self.table['sequence'][slot] = self.sequence
+        return slot, self.sequence
+
+    def valid(self, slot, sequence):
+        return self.table['sequence'][slot] == sequence
+
+    def view(self, slot, sequence):
+        """ read-only view of the frame in a slot, None if the slot does not hold the sequence (anymore)
+
+        The view is not a copy, the caller checks valid() again after it used the frame.
+        """
+        if not self.valid(slot, sequence):
+            return None
+        return self.frames[slot, :self.table['height'][slot], :self.table['width'][slot]]
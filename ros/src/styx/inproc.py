@@ -0,0 +1,340 @@
+'''
+In-process publish/subscribe bus with the publisher/subscriber API of rospy.
+
+make_rospy(bus) returns a module that stands in for rospy. Publisher, Subscriber, Service,
+ServiceProxy, init_node, the parameter functions, spin, is_shutdown, on_shutdown and
+signal_shutdown work on the bus. Everything else (Time, Duration, Rate, Timer, logging,
+exceptions) is the real rospy. Installed as sys.modules['rospy'] before the nodes are imported,
+several nodes run unchanged in one process (see compose.py):
+
+- publish() hands the message object to the subscribers, nothing is serialized or copied.
+  Subscribers must not modify received messages, all of them share the same object.
+- every subscriber has its own thread and a queue of queue_size messages (the oldest message is
+  dropped), as with rospy. header.seq is set on publish and latched publishers pass their last
+  message to late subscribers.
+- private names (~name) resolve to the node that called init_node in the current thread, the
+  callbacks run in the namespace of their subscriber.
+
+With a ROS master (ros=True) the bus is also one ROS node. Every publisher is mirrored to ROS,
+rospy serializes a message only when a remote node subscribes to the topic. The topics in
+`external` are subscribed from ROS for the nodes outside of the process, e.g. /twist_cmd of
+pure_pursuit. Parameters are those of the parameter server. Without a master the bus is a local
+stand-in and the parameters are a dict of namespaces, like the parameter server.
+
+tf works on the bus as long as tf is first imported after make_rospy(bus) is installed: the
+TransformBroadcaster of the bridge and the TransformListener of the tl_detector then publish and
+subscribe /tf through the stand-in. Transforms of nodes outside of the process only arrive if
+/tf (and /tf_static) are in `external`, compose.py does so with a ROS master.
+
+Modules that are imported by the nodes keep the working directory of the composed process,
+files have to be located relative to __file__ (like the model of the TLClassifier).
+'''
+
+import collections
+import logging
+import threading
+import traceback
+import types
+
+import rospy
+
+_unspecified = object()
+
+
+class Bus(object):
+    def __init__(self, params=None, ros=False, external=(), name='styx_compose'):
+        self.ros = ros
+        self.external = set(external)
+        self.params = params if params is not None else {}
+        self.name = name
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.subscribers = collections.defaultdict(list)
+        self.latched = {}
+        self.services = {}
+        self.ros_subscribers = {}
+        self.shutdown_event = threading.Event()
+        self.shutdown_hooks = []
+
+        if ros:
+            # signals are handled by the process that owns the bus
+            rospy.init_node(name, disable_signals=True)
+            rospy.on_shutdown(self.shutdown)
+        else:
+            rospy.rostime.set_rostime_initialized(True)
+            logger = logging.getLogger('rosout')
+            if not logger.handlers:
+                handler = logging.StreamHandler()
+                handler.setFormatter(logging.Formatter('[%(levelname)s] [%(threadName)s] %(message)s'))
+                logger.addHandler(handler)
+                logger.setLevel(logging.INFO)
+
+    # names and parameters
+
+    def init_node(self, name, *args, **kwargs):
+        self.local.node = name.lstrip('/')
+
+    def node(self):
+        return getattr(self.local, 'node', self.name)
+
+    def resolve(self, name, node=None):
+        if name.startswith('/'):
+            return name
+        if name.startswith('~'):
+            return '/{}/{}'.format(node or self.node(), name[1:].lstrip('/'))
+        return '/' + name
+
+    def get_param(self, name, default=_unspecified):
+        key = self.resolve(name)
+        if self.ros:
+            return rospy.get_param(key) if default is _unspecified else rospy.get_param(key, default)
+        value = self.params
+        for part in key.strip('/').split('/'):
+            if not isinstance(value, dict) or part not in value:
+                if default is _unspecified:
+                    raise KeyError(key)
+                return default
+            value = value[part]
+        return value
+
+    def has_param(self, name):
+        if self.ros:
+            return rospy.has_param(self.resolve(name))
+        try:
+            self.get_param(name)
+            return True
+        except KeyError:
+            return False
+
+    def set_param(self, name, value):
+        key = self.resolve(name)
+        if self.ros:
+            rospy.set_param(key, value)
+            return
+        parts = key.strip('/').split('/')
+        with self.lock:
+            tree = self.params
+            for part in parts[:-1]:
+                tree = tree.setdefault(part, {})
+            tree[parts[-1]] = value
+
+    # topics
+
+    def subscribe(self, subscriber):
+        with self.lock:
+            self.subscribers[subscriber.name].append(subscriber)
+            latched = self.latched.get(subscriber.name)
+            if self.ros and subscriber.name in self.external and subscriber.name not in self.ros_subscribers:
+                self.ros_subscribers[subscriber.name] = rospy.Subscriber(
+                    subscriber.name, subscriber.data_class, self.deliver_external, callback_args=subscriber.name)
+        if latched is not None:
+            subscriber.put(latched)
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers[subscriber.name]:
+                self.subscribers[subscriber.name].remove(subscriber)
+
+    def deliver(self, topic, msg, latch=False):
+        with self.lock:
+            if latch:
+                self.latched[topic] = msg
+            subscribers = list(self.subscribers[topic])
+        for subscriber in subscribers:
+            subscriber.put(msg)
+
+    def deliver_external(self, msg, topic):
+        # messages of the publishers of this process already went over the bus
+        header = getattr(msg, '_connection_header', None) or {}
+        if header.get('callerid') != rospy.get_name():
+            self.deliver(topic, msg)
+
+    def num_subscribers(self, topic):
+        with self.lock:
+            return len(self.subscribers[topic])
+
+    # life cycle
+
+    def spin(self):
+        while not self.is_shutdown():
+            self.shutdown_event.wait(1.0)
+
+    def is_shutdown(self):
+        return self.shutdown_event.is_set()
+
+    def on_shutdown(self, hook):
+        self.shutdown_hooks.append(hook)
+
+    def shutdown(self, reason=''):
+        with self.lock:
+            if self.shutdown_event.is_set():
+                return
+            self.shutdown_event.set()
+            subscribers = [s for topic_subscribers in self.subscribers.values() for s in topic_subscribers]
+        for hook in self.shutdown_hooks:
+            try:
+                hook()
+            except Exception:
+                rospy.logerr("shutdown hook failed:\n%s", traceback.format_exc())
+        for subscriber in subscribers:
+            subscriber.close()
+        if self.ros and not rospy.is_shutdown():
+            rospy.signal_shutdown(reason)
+
+
+class Publisher(object):
+    bus = None  # set by make_rospy
+
+    def __init__(self, name, data_class, subscriber_listener=None, tcp_nodelay=False, latch=False,
+                 headers=None, queue_size=None):
+        self.name = self.bus.resolve(name)
+        self.resolved_name = self.name
+        self.data_class = data_class
+        self.type = data_class._type
+        self.latch = latch
+        self.seq = 0
+        self.ros_publisher = None
+        if self.bus.ros:
+            self.ros_publisher = rospy.Publisher(self.name, data_class, latch=latch, queue_size=queue_size)
+
+    def publish(self, *args, **kwargs):
+        if len(args) == 1 and not kwargs and isinstance(args[0], self.data_class):
+            msg = args[0]
+        else:
+            msg = self.data_class(*args, **kwargs)
+        self.seq += 1
+        if msg._has_header:
+            msg.header.seq = self.seq
+        self.bus.deliver(self.name, msg, self.latch)
+        if self.ros_publisher is not None:
+            self.ros_publisher.publish(msg)
+
+    def get_num_connections(self):
+        remote = self.ros_publisher.get_num_connections() if self.ros_publisher is not None else 0
+        return self.bus.num_subscribers(self.name) + remote
+
+    def unregister(self):
+        if self.ros_publisher is not None:
+            self.ros_publisher.unregister()
+
+
+class Subscriber(object):
+    bus = None  # set by make_rospy
+
+    def __init__(self, name, data_class, callback=None, callback_args=None, queue_size=None, buff_size=65536,
+                 tcp_nodelay=False):
+        self.name = self.bus.resolve(name)
+        self.resolved_name = self.name
+        self.data_class = data_class
+        self.callback = callback
+        self.callback_args = callback_args
+        self.node = self.bus.node()
+        self.queue = collections.deque(maxlen=queue_size or None)
+        self.condition = threading.Condition()
+        self.closed = False
+
+        thread = threading.Thread(target=self.run, name="{} {}".format(self.node, self.name))
+        thread.daemon = True
+        thread.start()
+        self.bus.subscribe(self)
+
+    def put(self, msg):
+        with self.condition:
+            self.queue.append(msg)
+            self.condition.notify()
+
+    def run(self):
+        self.bus.local.node = self.node
+        while True:
+            with self.condition:
+                # no timeout, python 2 polls conditions with a timeout
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                msg = self.queue.popleft()
+            if self.callback is None:
+                continue
+            try:
+                if self.callback_args is None:
+                    self.callback(msg)
+                else:
+                    self.callback(msg, self.callback_args)
+            except Exception:
+                rospy.logerr("bad callback of %s in %s:\n%s", self.name, self.node, traceback.format_exc())
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def unregister(self):
+        self.bus.unsubscribe(self)
+        self.close()
+
+    def get_num_connections(self):
+        return 1
+
+
+class Service(object):
+    bus = None  # set by make_rospy
+
+    def __init__(self, name, service_class, handler, buff_size=65536, error_handler=None):
+        self.resolved_name = self.bus.resolve(name)
+        self.service_class = service_class
+        self.handler = handler
+        self.bus.services[self.resolved_name] = self
+        self.ros_service = None
+        if self.bus.ros:
+            self.ros_service = rospy.Service(self.resolved_name, service_class, handler)
+
+    def shutdown(self, reason=''):
+        self.bus.services.pop(self.resolved_name, None)
+        if self.ros_service is not None:
+            self.ros_service.shutdown(reason)
+
+
+class ServiceProxy(object):
+    bus = None  # set by make_rospy
+
+    def __init__(self, name, service_class, persistent=False, headers=None):
+        self.resolved_name = self.bus.resolve(name)
+        self.service_class = service_class
+        self.ros_proxy = rospy.ServiceProxy(self.resolved_name, service_class) if self.bus.ros else None
+
+    def __call__(self, *args, **kwargs):
+        return self.call(*args, **kwargs)
+
+    def call(self, *args, **kwargs):
+        service = self.bus.services.get(self.resolved_name)
+        if service is None:
+            if self.ros_proxy is None:
+                raise rospy.ServiceException("service {} is not available".format(self.resolved_name))
+            return self.ros_proxy(*args, **kwargs)
+        request_class = self.service_class._request_class
+        if len(args) == 1 and not kwargs and isinstance(args[0], request_class):
+            request = args[0]
+        else:
+            request = request_class(*args, **kwargs)
+        return service.handler(request)
+
+
+def make_rospy(bus):
+    """ module with the API of rospy on the bus """
+    module = types.ModuleType('rospy', rospy.__doc__)
+    module.__dict__.update((key, value) for key, value in vars(rospy).items() if key not in ('__name__', '__doc__'))
+
+    for cls in (Publisher, Subscriber, Service, ServiceProxy):
+        setattr(module, cls.__name__, type(cls.__name__, (cls,), {'bus': bus}))
+
+    module.init_node = bus.init_node
+    module.get_name = lambda: '/' + bus.node()
+    module.get_param = bus.get_param
+    module.has_param = bus.has_param
+    module.set_param = bus.set_param
+    module.search_param = lambda name: bus.resolve(name) if bus.has_param(name) else None
+    module.spin = bus.spin
+    module.is_shutdown = bus.is_shutdown
+    module.on_shutdown = bus.on_shutdown
+    module.signal_shutdown = bus.shutdown
+    return module
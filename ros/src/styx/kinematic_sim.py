@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+'''
+Headless stand-in for the Unity simulator, speaking the same socket.io protocol as the
+simulator does with server.py.
+
+The car is a kinematic bicycle model with the longitudinal model of dbw_node.py:
+    m * a = (P_THROTTLE * throttle - P_BRAKE * brake) / r - D_RESIST * v
+It is driven by the steer/throttle/brake commands of the bridge. The traffic lights at the
+stop-lines of the light config cycle through green, yellow and red. Telemetry, traffic-lights
+and (optionally) synthetic camera frames are sent at configurable rates of simulated time.
+
+With --speedup > 1 simulated time runs faster than real time (0 = as fast as possible). Keep in
+mind that the ROS nodes still run on wall-clock time, their rates do not scale with the speedup.
+
+At the end the tool reports the lap time (simulated time to the end of the track), the CPU load
+of the ROS nodes and the latency between a telemetry message and the next command.
+
+    roslaunch styx server.launch headless:=true
+    rosrun styx kinematic_sim.py --speedup 2 --image-rate 10
+'''
+
+import argparse
+import base64
+import math
+import os
+import time
+from io import BytesIO
+
+import numpy as np
+import yaml
+from PIL import Image, ImageDraw
+from socketIO_client import SocketIO
+
+from replay_session import percentile
+
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WAYPOINTS = os.path.join(BASE_PATH, '..', '..', '..', 'data', 'sim_waypoints.csv')
+DEFAULT_LIGHTS = os.path.join(BASE_PATH, '..', 'tl_detector', 'sim_traffic_light_config.yaml')
+
+# vehicle parameters of dbw_sim.launch and dbw_node.py
+VEHICLE_MASS = 1080.
+WHEEL_RADIUS = 0.335
+WHEEL_BASE = 3.
+STEER_RATIO = 14.8
+P_THROTTLE = 2000.
+P_BRAKE = 1.0
+D_RESIST = 110.
+ONE_MPH = 0.44704
+
+# styx_msgs/TrafficLight states and the cycle of the simulated lights [s]
+RED, YELLOW, GREEN = 0, 1, 2
+LIGHT_CYCLE = [(GREEN, 8.0), (YELLOW, 2.0), (RED, 8.0)]
+LIGHT_COLORS = {RED: (255, 0, 0), YELLOW: (255, 255, 0), GREEN: (0, 255, 0)}
+
+# ROS node processes whose CPU usage is reported
+NODES = ['server.py', 'server_async.py', 'waypoint_loader.py', 'waypoint_updater.py', 'pure_pursuit',
+         'dbw_node.py', 'tl_detector.py', 'inference_server.py']
+
+
+def load_track(path):
+    """ x, y, z columns of a waypoint csv, rows without yaw are accepted """
+    track = np.genfromtxt(path, delimiter=',', usecols=(0, 1, 2), invalid_raise=False)
+    return track[:, 0], track[:, 1], track[:, 2]
+
+
+def cpu_times():
+    """ accumulated user+system cpu seconds of all ROS node processes, keyed by node """
+    ticks = float(os.sysconf('SC_CLK_TCK'))
+    times = {}
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(os.path.join('/proc', pid, 'cmdline'), 'rb') as fid:
+                cmdline = fid.read().decode('utf-8', 'ignore')
+            with open(os.path.join('/proc', pid, 'stat')) as fid:
+                stat = fid.read()
+        except (IOError, OSError):
+            continue
+        # the executable or script of a node, a substring would count inference_server.py as server.py
+        scripts = set(os.path.basename(arg) for arg in cmdline.split('\0'))
+        for node in NODES:
+            if node in scripts:
+                # fields after the command name, utime and stime are field 14 and 15 of stat
+                fields = stat[stat.rfind(')') + 2:].split()
+                times[node] = times.get(node, 0.) + (int(fields[11]) + int(fields[12])) / ticks
+                break
+    return times
+
+
+def synthetic_frames(width, height):
+    """ one base64 encoded jpeg per light state, a colored disc on a dark background """
+    frames = {}
+    for state, color in LIGHT_COLORS.items():
+        image = Image.new('RGB', (width, height), (40, 40, 40))
+        draw = ImageDraw.Draw(image)
+        cx, cy, radius = width // 2, height // 3, height // 20
+        draw.rectangle([cx - 2 * radius, cy - 5 * radius, cx + 2 * radius, cy + 5 * radius], fill=(10, 10, 10))
+        draw.ellipse([cx - radius, cy - radius, cx + radius, cy + radius], fill=color)
+        buf = BytesIO()
+        image.save(buf, format='JPEG')
+        frames[state] = base64.b64encode(buf.getvalue()).decode('ascii')
+    return frames
+
+
+class KinematicSimulator(object):
+    def __init__(self, args):
+        self.args = args
+        self.wp_x, self.wp_y, self.wp_z = load_track(args.waypoints)
+        self.track_length = np.sum(np.hypot(np.diff(self.wp_x), np.diff(self.wp_y)))
+
+        with open(args.lights) as fid:
+            stop_lines = np.array(yaml.safe_load(fid)['stop_line_positions'], dtype=np.float64)
+        self.light_x = stop_lines[:, 0]
+        self.light_y = stop_lines[:, 1]
+        # lights face the approaching car: direction of the track at the closest waypoint
+        self.light_dx, self.light_dy = [], []
+        for x, y in stop_lines:
+            i = int(np.argmin((self.wp_x - x) ** 2 + (self.wp_y - y) ** 2))
+            i = min(i, len(self.wp_x) - 2)
+            self.light_dx.append(float(self.wp_x[i + 1] - self.wp_x[i]))
+            self.light_dy.append(float(self.wp_y[i + 1] - self.wp_y[i]))
+
+        self.frames = synthetic_frames(800, 600) if args.image_rate > 0 else None
+
+        # vehicle state
+        self.x, self.y = float(self.wp_x[0]), float(self.wp_y[0])
+        self.yaw = math.atan2(self.wp_y[1] - self.wp_y[0], self.wp_x[1] - self.wp_x[0])
+        self.v = 0.
+        self.distance = 0.
+        self.closest = 0
+
+        # latest commands of the bridge
+        self.steer = 0.
+        self.throttle = 0.
+        self.brake = 0.
+
+        # command latency measurement
+        self.telemetry_sent = None
+        self.latencies = []
+
+        self.io = SocketIO(args.host, args.port)
+        self.io.on('steer', self.steer_cb)
+        self.io.on('throttle', self.throttle_cb)
+        self.io.on('brake', self.brake_cb)
+
+    def command_received(self):
+        if self.telemetry_sent is not None:
+            self.latencies.append(time.time() - self.telemetry_sent)
+            self.telemetry_sent = None
+
+    def steer_cb(self, data):
+        self.steer = float(data['steering_angle'])
+        self.command_received()
+
+    def throttle_cb(self, data):
+        self.throttle = float(data['throttle'])
+        self.command_received()
+
+    def brake_cb(self, data):
+        self.brake = float(data['brake'])
+        self.command_received()
+
+    def light_states(self, t):
+        period = sum(duration for _, duration in LIGHT_CYCLE)
+        states = []
+        for i in range(len(self.light_x)):
+            # stagger the lights so that they do not switch all at once
+            phase = (t + 3.0 * i) % period
+            for state, duration in LIGHT_CYCLE:
+                if phase < duration:
+                    break
+                phase -= duration
+            states.append(state)
+        return states
+
+    def step(self, dt):
+        force = (P_THROTTLE * self.throttle - P_BRAKE * self.brake) / WHEEL_RADIUS - D_RESIST * self.v
+        self.v = max(0., self.v + force / VEHICLE_MASS * dt)
+
+        wheel_angle = self.steer / STEER_RATIO
+        self.yaw += self.v * math.tan(wheel_angle) / WHEEL_BASE * dt
+        self.x += self.v * math.cos(self.yaw) * dt
+        self.y += self.v * math.sin(self.yaw) * dt
+        self.distance += self.v * dt
+
+        # local search of the closest waypoint to detect the end of the track
+        lo = self.closest
+        hi = min(len(self.wp_x), lo + 200)
+        self.closest = lo + int(np.argmin((self.wp_x[lo:hi] - self.x) ** 2 + (self.wp_y[lo:hi] - self.y) ** 2))
+
+    def emit_telemetry(self):
+        yaw_deg = math.degrees(self.yaw)
+        self.io.emit('telemetry', {'x': self.x, 'y': self.y, 'z': float(self.wp_z[self.closest]), 'yaw': yaw_deg,
+                                   'velocity': self.v / ONE_MPH, 'dbw_enable': True})
+        self.io.emit('control', {'steering_angle': math.degrees(self.steer), 'throttle': self.throttle,
+                                 'brake': self.brake})
+        if self.telemetry_sent is None:
+            self.telemetry_sent = time.time()
+
+    def emit_lights(self, t):
+        self.io.emit('trafficlights', {'light_pos_x': self.light_x.tolist(), 'light_pos_y': self.light_y.tolist(),
+                                       'light_pos_z': [0.] * len(self.light_x),
+                                       'light_pos_dx': self.light_dx, 'light_pos_dy': self.light_dy,
+                                       'light_state': self.light_states(t)})
+
+    def emit_image(self, t):
+        # the frame shows the state of the next light ahead of the car
+        ahead = [i for i in range(len(self.light_x))
+                 if (self.light_x[i] - self.x) * math.cos(self.yaw) + (self.light_y[i] - self.y) * math.sin(self.yaw) > 0]
+        state = self.light_states(t)[ahead[0]] if ahead else GREEN
+        self.io.emit('image', {'image': self.frames[state]})
+
+    def end_of_track(self):
+        return self.closest >= len(self.wp_x) - 2 or self.distance >= self.track_length
+
+    def run(self):
+        args = self.args
+        dt = args.dt
+        t = 0.
+        next_telemetry = next_lights = next_image = 0.
+
+        cpu_start = cpu_times()
+        wall_start = time.time()
+
+        while t < args.duration and not self.end_of_track():
+            self.step(dt)
+            t += dt
+
+            if t >= next_telemetry:
+                self.emit_telemetry()
+                next_telemetry += 1.0 / args.telemetry_rate
+            if t >= next_lights:
+                self.emit_lights(t)
+                next_lights += 1.0 / args.lights_rate
+            if self.frames is not None and t >= next_image:
+                self.emit_image(t)
+                next_image += 1.0 / args.image_rate
+
+            if args.speedup > 0:
+                remaining = wall_start + t / args.speedup - time.time()
+                if remaining > 0:
+                    self.io.wait(seconds=remaining)
+            else:
+                self.io.wait(seconds=0.0001)
+
+        wall_time = time.time() - wall_start
+        cpu_end = cpu_times()
+        return t, wall_time, cpu_start, cpu_end
+
+    def report(self, sim_time, wall_time, cpu_start, cpu_end):
+        if self.end_of_track():
+            print("lap time: {:.1f}s simulated ({:.1f}s wall clock)".format(sim_time, wall_time))
+        else:
+            print("end of track not reached after {:.1f}s simulated, {:.0f}m of {:.0f}m".format(
+                sim_time, self.distance, self.track_length))
+
+        for node in NODES:
+            if node in cpu_end:
+                load = (cpu_end[node] - cpu_start.get(node, 0.)) / wall_time
+                print("  cpu {:20s} {:5.1f}%".format(node, 100 * load))
+
+        if self.latencies:
+            print("  command latency: n={} p50={:.1f}ms p90={:.1f}ms p99={:.1f}ms max={:.1f}ms".format(
+                len(self.latencies), 1000 * percentile(self.latencies, 50), 1000 * percentile(self.latencies, 90),
+                1000 * percentile(self.latencies, 99), 1000 * max(self.latencies)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='headless kinematic simulator for the styx bridge')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=4567)
+    parser.add_argument('--waypoints', default=DEFAULT_WAYPOINTS)
+    parser.add_argument('--lights', default=DEFAULT_LIGHTS, help='traffic light config with stop_line_positions')
+    parser.add_argument('--dt', type=float, default=0.01, help='integration step [s]')
+    parser.add_argument('--speedup', type=float, default=1.0, help='simulated time per wall time, 0 = max')
+    parser.add_argument('--duration', type=float, default=600., help='maximum simulated time [s]')
+    parser.add_argument('--telemetry-rate', type=float, default=30.)
+    parser.add_argument('--lights-rate', type=float, default=4.)
+    parser.add_argument('--image-rate', type=float, default=0., help='synthetic camera frames, 0 = off')
+    args, _ = parser.parse_known_args()
+
+    sim = KinematicSimulator(args)
+    sim.report(*sim.run())
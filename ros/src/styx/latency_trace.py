@@ -0,0 +1,56 @@
+'''
+Propagation of origin timestamps through the nodes for end-to-end latency tracing.
+
+A trace starts at a stamped origin message (/image_color of the bridge, /current_pose) and is
+extended by every node that turns it into a new output:
+
+    /image_color  -> tl_detector      -> /trace/traffic_waypoint
+    /current_pose -> waypoint_updater -> /trace/final_waypoints  (also extends the latest light trace)
+                  -> pure_pursuit     -> dbw_node -> /trace/actuation
+
+The payload topics (/traffic_waypoint, /final_waypoints, ...) keep their types, the traces are
+published next to them as styx_msgs/TraceContext. pure_pursuit (C++) does not propagate traces,
+the dbw_node bridges it by association: a trace is passed on with the first /twist_cmd stamped
+after the trace (hop 'pure_pursuit') and the actuator commands computed from it.
+trace_monitor.py collects the latency distributions.
+'''
+
+import rospy
+from styx_msgs.msg import TraceContext
+
+TRACE_TOPICS = ['/trace/traffic_waypoint', '/trace/final_waypoints', '/trace/actuation']
+
+
+def start_trace(header, origin, hop, stamp=None):
+    """ new trace of the origin message with the given header, the first hop published at stamp """
+    trace = TraceContext()
+    trace.origin = origin
+    trace.origin_seq = header.seq
+    trace.origin_stamp = header.stamp
+    return extend(trace, hop, stamp)
+
+
+def extend(trace, hop, stamp=None):
+    """ copy of the trace with one more hop, published at stamp (default now) """
+    stamp = rospy.Time.now() if stamp is None else stamp
+    extended = TraceContext()
+    extended.header.stamp = stamp
+    extended.origin = trace.origin
+    extended.origin_seq = trace.origin_seq
+    extended.origin_stamp = trace.origin_stamp
+    extended.hops = list(trace.hops) + [hop]
+    extended.hop_stamps = list(trace.hop_stamps) + [stamp]
+    return extended
+
+
+def hop_latencies(trace):
+    """ (hop, latency since the previous hop or the origin [s]) of every hop """
+    stamps = [trace.origin_stamp] + list(trace.hop_stamps)
+    return [(hop, (stamps[i + 1] - stamps[i]).to_sec()) for i, hop in enumerate(trace.hops)]
+
+
+def end_to_end(trace):
+    """ latency from the origin to the last hop [s] """
+    if not trace.hop_stamps:
+        return 0.
+    return (trace.hop_stamps[-1] - trace.origin_stamp).to_sec()
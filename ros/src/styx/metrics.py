@@ -0,0 +1,183 @@
+'''
+Low-overhead metrics of the styx bridge: rate and latency histogram per socket.io event and
+per ROS topic, depth of the outbound message queue.
+
+The metrics are published periodically as diagnostic_msgs/DiagnosticArray on /diagnostics
+and can be fetched as JSON from the /metrics endpoint of the server.
+'''
+
+import bisect
+import threading
+import time
+
+import rospy
+from diagnostic_msgs.msg import DiagnosticArray
+
+from diagnostics import diagnostic_array, diagnostic_status
+
+# upper bounds of the latency histogram buckets [s], the last bucket is open-ended
+LATENCY_BUCKETS = [0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0]
+
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """ upper bound of the bucket containing the p-th percentile """
+        if self.count == 0:
+            return 0.0
+        rank = p / 100. * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else 0.0,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'max': self.max,
+                'buckets': self.buckets,
+                'histogram': self.counts}
+
+
+class Series(object):
+    """ latency histogram and rate of one event type or topic """
+    def __init__(self):
+        self.latency = Histogram()
+        self.window_start = time.time()
+        self.window_count = 0
+        self.rate = 0.0
+
+    def observe(self, latency):
+        self.latency.observe(latency)
+        self.window_count += 1
+
+    def roll_window(self, now):
+        if now > self.window_start:
+            self.rate = self.window_count / (now - self.window_start)
+        self.window_start = now
+        self.window_count = 0
+
+    def summary(self):
+        summary = self.latency.summary()
+        summary['rate'] = self.rate
+        return summary
+
+
+class QueueDepth(object):
+    def __init__(self):
+        self.last = 0
+        self.max = 0
+        self.window_max = 0
+
+    def observe(self, depth):
+        self.last = depth
+        self.max = max(self.max, depth)
+        self.window_max = max(self.window_max, depth)
+
+    def roll_window(self, now):
+        self.window_max = self.last
+
+    def summary(self):
+        return {'last': self.last, 'max': self.max, 'window_max': self.window_max}
+
+
+class BridgeMetrics(object):
+    def __init__(self, name='styx_server'):
+        self.name = name
+        self.lock = threading.Lock()
+        self.groups = {'event': {}, 'topic': {}, 'queue': {}}
+        self.pub = None
+
+    def _get(self, group, key, factory):
+        entries = self.groups[group]
+        if key not in entries:
+            entries[key] = factory()
+        return entries[key]
+
+    def observe_event(self, event, latency):
+        with self.lock:
+            self._get('event', event, Series).observe(latency)
+
+    def observe_topic(self, topic, latency):
+        with self.lock:
+            self._get('topic', topic, Series).observe(latency)
+
+    def observe_queue(self, queue, depth):
+        with self.lock:
+            self._get('queue', queue, QueueDepth).observe(depth)
+
+    def timed(self, event):
+        """ decorator measuring the latency of a socket.io handler """
+        def decorator(handler):
+            def wrapper(*args, **kwargs):
+                start = time.time()
+                try:
+                    return handler(*args, **kwargs)
+                finally:
+                    self.observe_event(event, time.time() - start)
+            wrapper.__name__ = handler.__name__
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self.lock:
+            return {group: {key: entry.summary() for key, entry in entries.items()}
+                    for group, entries in self.groups.items()}
+
+    def start_publishing(self, period=1.0):
+        self.pub = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size=1)
+        rospy.Timer(rospy.Duration(period), self.publish)
+
+    def publish(self, event=None):
+        now = time.time()
+        statuses = []
+        with self.lock:
+            for group, entries in self.groups.items():
+                for key, entry in entries.items():
+                    entry.roll_window(now)
+                    statuses.append(diagnostic_status("{}: {} {}".format(self.name, group, key), self.name,
+                                                      entry.summary()))
+
+        self.pub.publish(diagnostic_array(statuses))
+
+
+class TimedPublisher(object):
+    """ wraps a rospy.Publisher and records the time spent in publish() per topic """
+    def __init__(self, publisher, metrics):
+        self.publisher = publisher
+        self.metrics = metrics
+        self.topic = publisher.name
+
+    def publish(self, msg):
+        start = time.time()
+        self.publisher.publish(msg)
+        self.metrics.observe_topic(self.topic, time.time() - start)
+
+    def get_num_connections(self):
+        return self.publisher.get_num_connections()
+
+
+def timed_callback(topic, callback, metrics):
+    """ wraps a rospy.Subscriber callback and records its duration per topic """
+    def wrapper(msg):
+        start = time.time()
+        callback(msg)
+        metrics.observe_topic(topic, time.time() - start)
+    return wrapper
@@ -0,0 +1,68 @@
+import numpy as np
+
+from sensor_msgs.msg import PointCloud2, PointField
+
+# x, y, z as little-endian float32, the same layout pcl2.create_cloud_xyz32 produces
+FIELDS_XYZ32 = [PointField('x', 0, PointField.FLOAT32, 1),
+                PointField('y', 4, PointField.FLOAT32, 1),
+                PointField('z', 8, PointField.FLOAT32, 1)]
+POINT_STEP_XYZ32 = 12
+
+
+def points_from_columns(x, y, z):
+    """ stack three coordinate lists into a (N, 3) float32 array """
+    points = np.empty((len(x), 3), dtype='<f4')
+    points[:, 0] = x
+    points[:, 1] = y
+    points[:, 2] = z
+    return points
+
+
+def voxel_downsample(points, voxel_size):
+    """ replace all points within a cubic voxel of edge length voxel_size by their centroid
+
+    Args:
+        points (np.ndarray): (N, 3) array of points
+        voxel_size (float): edge length of a voxel [m], values <= 0 disable the filter
+
+    Returns:
+        np.ndarray: (M, 3) float32 array with M <= N
+
+    """
+    if voxel_size <= 0. or len(points) < 2:
+        return points
+
+    keys = np.floor(points / voxel_size).astype(np.int64)
+    keys -= keys.min(axis=0)
+    dims = keys.max(axis=0) + 1
+
+    # one integer per voxel, np.unique on a 1d array is a lot faster than on rows
+    linear = np.ravel_multi_index(keys.T, dims)
+    _, inverse, counts = np.unique(linear, return_inverse=True, return_counts=True)
+
+    centroids = np.empty((len(counts), 3), dtype='<f4')
+    for axis in range(3):
+        centroids[:, axis] = np.bincount(inverse, weights=points[:, axis]) / counts
+
+    return centroids
+
+
+def create_cloud_xyz32(header, points):
+    """ pack a (N, 3) array into a PointCloud2 without iterating over the points
+
+    Drop-in replacement for sensor_msgs.point_cloud2.create_cloud_xyz32.
+    """
+    points = np.ascontiguousarray(points, dtype='<f4').reshape(-1, 3)
+
+    cloud = PointCloud2()
+    cloud.header = header
+    cloud.height = 1
+    cloud.width = len(points)
+    cloud.fields = FIELDS_XYZ32
+    cloud.is_bigendian = False
+    cloud.point_step = POINT_STEP_XYZ32
+    cloud.row_step = POINT_STEP_XYZ32 * len(points)
+    cloud.is_dense = False
+    cloud.data = points.tobytes()
+
+    return cloud
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+'''
+Replays a session recorded by the styx server (see session_log.py) against a running bridge.
+
+The tool takes the place of the Unity simulator: it connects as socket.io client to the
+server on port 4567 and sends the recorded events at 1x, Nx or as fast as possible.
+For every inbound event type it measures the time until the next steer/throttle/brake command
+arrives back from the bridge. Note that the server only forwards commands while handling a
+telemetry event, so telemetry has to be part of the replay.
+
+    rosrun styx replay_session.py session.styxlog --speed 4
+    rosrun styx replay_session.py session.styxlog --speed 0   # as fast as possible
+'''
+
+import argparse
+import time
+
+from socketIO_client import SocketIO
+
+from session_log import SessionLog, EVENTS
+
+COMMANDS = ['steer', 'throttle', 'brake']
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100. * len(values)))]
+
+
+class Replayer(object):
+    def __init__(self, log, host, port, speed, events):
+        self.log = log
+        self.speed = speed
+        self.events = events
+
+        # send time of the oldest inbound event per type still waiting for a command
+        self.pending = {}
+        self.latencies = {event: [] for event in EVENTS}
+        self.commands = {command: 0 for command in COMMANDS}
+
+        self.io = SocketIO(host, port)
+        for command in COMMANDS:
+            self.io.on(command, self.command_cb(command))
+
+    def command_cb(self, command):
+        def callback(*args):
+            now = time.time()
+            self.commands[command] += 1
+            for event, sent in self.pending.items():
+                self.latencies[event].append(now - sent)
+            self.pending = {}
+        return callback
+
+    def run(self):
+        t_log0 = None
+        t_wall0 = time.time()
+
+        for t, event, data in self.log:
+            if event not in self.events:
+                continue
+            if t_log0 is None:
+                t_log0 = t
+
+            if self.speed > 0:
+                # keep the recorded timing, scaled by the replay speed
+                target = t_wall0 + (t - t_log0) / self.speed
+                while True:
+                    remaining = target - time.time()
+                    if remaining <= 0:
+                        break
+                    self.io.wait(seconds=min(remaining, 0.01))
+            else:
+                self.io.wait(seconds=0)
+
+            self.io.emit(event, data)
+            self.pending.setdefault(event, time.time())
+
+        # collect the commands of the last events
+        self.io.wait(seconds=1.0)
+        return time.time() - t_wall0
+
+    def report(self, wall_time):
+        print("replayed {:.1f}s of recording in {:.1f}s".format(self.log.duration(), wall_time))
+        for command in COMMANDS:
+            print("  {:10s} {} commands received".format(command, self.commands[command]))
+        for event in EVENTS:
+            latencies = self.latencies[event]
+            if latencies:
+                print("  {:14s} command latency: n={} p50={:.1f}ms p90={:.1f}ms p99={:.1f}ms max={:.1f}ms".format(
+                    event, len(latencies),
+                    1000 * percentile(latencies, 50), 1000 * percentile(latencies, 90),
+                    1000 * percentile(latencies, 99), 1000 * max(latencies)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='replay a recorded simulator session against the styx bridge')
+    parser.add_argument('session', help='session log written by the styx server')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=4567)
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed factor, 0 = as fast as possible')
+    parser.add_argument('--events', nargs='+', default=EVENTS, choices=EVENTS, help='events to replay')
+    args = parser.parse_args()
+
+    log = SessionLog(args.session)
+    replayer = Replayer(log, args.host, args.port, args.speed, args.events)
+    replayer.report(replayer.run())
+    log.close()
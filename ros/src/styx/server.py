@@ -4,12 +4,16 @@ import eventlet
 eventlet.monkey_patch(socket=True, select=True, time=True)
 
 import eventlet.wsgi
+import json
+import rospy
 import socketio
 import time
-from flask import Flask, render_template
+from flask import Flask, Response, render_template
 
 from bridge import Bridge
 from conf import conf
+from metrics import BridgeMetrics
+from session_log import SessionRecorder
 
 sio = socketio.Server()
 app = Flask(__name__)
@@ -17,6 +21,13 @@ msgs = []
 
 dbw_enable = False
 
+metrics = BridgeMetrics()
+timed = metrics.timed
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(json.dumps(metrics.snapshot()), mimetype='application/json')
+
 @sio.on('connect')
 def connect(sid, environ):
     print("connect ", sid)
@@ -24,13 +35,27 @@ def connect(sid, environ):
 def send(topic, data):
     s = 1
     msgs.append((topic, data))
+    metrics.observe_queue('outbound', len(msgs))
     #sio.emit(topic, data=json.dumps(data), skip_sid=True)
 
-bridge = Bridge(conf, send)
+bridge = Bridge(conf, send, metrics)
+metrics.start_publishing(rospy.get_param('~metrics_period', 1.0))
+
+# optional recording of the inbound event stream for replay_session.py
+record_path = rospy.get_param('~record', '')
+recorder = SessionRecorder(record_path) if record_path else None
+if recorder is not None:
+    rospy.on_shutdown(recorder.close)
+
+def record(event, data):
+    if recorder is not None:
+        recorder.record(event, data)
 
 @sio.on('telemetry')
+@timed('telemetry')
 def telemetry(sid, data):
     global dbw_enable
+    record('telemetry', data)
     if data["dbw_enable"] != dbw_enable:
         dbw_enable = data["dbw_enable"]
         bridge.publish_dbw_status(dbw_enable)
@@ -40,23 +65,33 @@ def telemetry(sid, data):
         sio.emit(topic, data=data, skip_sid=True)
 
 @sio.on('control')
+@timed('control')
 def control(sid, data):
+    record('control', data)
     bridge.publish_controls(data)
 
 @sio.on('obstacle')
+@timed('obstacle')
 def obstacle(sid, data):
+    record('obstacle', data)
     bridge.publish_obstacles(data)
 
 @sio.on('lidar')
+@timed('lidar')
 def obstacle(sid, data):
+    record('lidar', data)
     bridge.publish_lidar(data)
 
 @sio.on('trafficlights')
+@timed('trafficlights')
 def trafficlights(sid, data):
+    record('trafficlights', data)
     bridge.publish_traffic(data)
 
 @sio.on('image')
+@timed('image')
 def image(sid, data):
+    record('image', data)
     bridge.publish_camera(data)
 
 if __name__ == '__main__':
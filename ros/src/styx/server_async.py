@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+'''
+Alternative simulator server built on asyncio (python-socketio AsyncServer + aiohttp).
+
+The event names are identical to server.py, so the simulator does not notice the difference.
+Unlike the eventlet server, the blocking bridge work (rospy publishing, PIL decoding of camera
+frames, ...) runs in executors. Every event type gets its own single-threaded executor: the
+order of e.g. two telemetry messages is preserved, but a slow camera frame no longer stalls
+the telemetry and control events.
+
+Requires Python >= 3.5 and aiohttp. Select it with `roslaunch styx server.launch async:=true`.
+'''
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import rospy
+import socketio
+from aiohttp import web
+
+from bridge import Bridge
+from conf import conf
+from metrics import BridgeMetrics
+from session_log import SessionRecorder, EVENTS
+
+sio = socketio.AsyncServer(async_mode='aiohttp')
+app = web.Application()
+sio.attach(app)
+
+# written from rospy callback threads, drained on the event loop
+msgs = deque()
+
+dbw_enable = False
+
+executors = {event: ThreadPoolExecutor(max_workers=1) for event in EVENTS}
+
+metrics = BridgeMetrics()
+
+
+async def metrics_endpoint(request):
+    return web.json_response(metrics.snapshot())
+
+app.router.add_get('/metrics', metrics_endpoint)
+
+
+def send(topic, data):
+    msgs.append((topic, data))
+    metrics.observe_queue('outbound', len(msgs))
+
+bridge = Bridge(conf, send, metrics)
+metrics.start_publishing(rospy.get_param('~metrics_period', 1.0))
+
+# optional recording of the inbound event stream for replay_session.py
+record_path = rospy.get_param('~record', '')
+recorder = SessionRecorder(record_path) if record_path else None
+if recorder is not None:
+    rospy.on_shutdown(recorder.close)
+
+
+def publish_telemetry(data):
+    global dbw_enable
+    if data["dbw_enable"] != dbw_enable:
+        dbw_enable = data["dbw_enable"]
+        bridge.publish_dbw_status(dbw_enable)
+    bridge.publish_odometry(data)
+
+
+handlers = {
+    'telemetry': publish_telemetry,
+    'control': bridge.publish_controls,
+    'obstacle': bridge.publish_obstacles,
+    'lidar': bridge.publish_lidar,
+    'trafficlights': bridge.publish_traffic,
+    'image': bridge.publish_camera,
+}
+
+
+async def dispatch(event, data):
+    """ run the blocking bridge handler of an event in its executor and measure the latency """
+    start = time.time()
+    if recorder is not None:
+        recorder.record(event, data, start)
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(executors[event], handlers[event], data)
+    metrics.observe_event(event, time.time() - start)
+
+
+@sio.on('connect')
+async def connect(sid, environ):
+    print("connect ", sid)
+
+
+@sio.on('telemetry')
+async def telemetry(sid, data):
+    await dispatch('telemetry', data)
+    for i in range(len(msgs)):
+        topic, data = msgs.popleft()
+        await sio.emit(topic, data=data, skip_sid=True)
+
+
+@sio.on('control')
+async def control(sid, data):
+    await dispatch('control', data)
+
+
+@sio.on('obstacle')
+async def obstacle(sid, data):
+    await dispatch('obstacle', data)
+
+
+@sio.on('lidar')
+async def lidar(sid, data):
+    await dispatch('lidar', data)
+
+
+@sio.on('trafficlights')
+async def trafficlights(sid, data):
+    await dispatch('trafficlights', data)
+
+
+@sio.on('image')
+async def image(sid, data):
+    await dispatch('image', data)
+
+
+if __name__ == '__main__':
+    web.run_app(app, host='0.0.0.0', port=4567)
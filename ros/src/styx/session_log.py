@@ -0,0 +1,122 @@
+'''
+Compact indexed log of the socket.io events the simulator sends to the bridge.
+
+File layout (little endian):
+    MAGIC
+    record*      struct RECORD (time, event, payload length) followed by the JSON payload
+    index        struct INDEX_ENTRY (offset, time, event) per record
+    footer       struct FOOTER (index offset, number of records, MAGIC)
+
+Payloads of all events but 'image' are zlib compressed (flagged by the highest bit of the
+event byte). Camera frames are JPEG already, compressing them again only costs CPU.
+If the footer is missing (e.g. the recording node was killed) the index is rebuilt by
+scanning the records sequentially.
+'''
+
+import json
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b'STYXLOG1'
+RECORD = struct.Struct('<dBI')
+INDEX_ENTRY = struct.Struct('<QdB')
+FOOTER = struct.Struct('<QI8s')
+COMPRESSED = 0x80
+
+EVENTS = ['telemetry', 'control', 'obstacle', 'lidar', 'trafficlights', 'image']
+UNCOMPRESSED_EVENTS = ['image']
+
+
+class SessionRecorder(object):
+    def __init__(self, path):
+        self.path = path
+        self.fid = open(path, 'wb')
+        self.fid.write(MAGIC)
+        self.index = []
+        self.lock = threading.Lock()
+
+    def record(self, event, data, t=None):
+        """ append one event, safe to call from several handler threads """
+        t = time.time() if t is None else t
+        event_id = EVENTS.index(event)
+        payload = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        if event not in UNCOMPRESSED_EVENTS:
+            payload = zlib.compress(payload, 1)
+            event_id |= COMPRESSED
+
+        with self.lock:
+            if self.fid is None:
+                return
+            self.index.append((self.fid.tell(), t, event_id))
+            self.fid.write(RECORD.pack(t, event_id, len(payload)))
+            self.fid.write(payload)
+
+    def close(self):
+        with self.lock:
+            if self.fid is None:
+                return
+            index_offset = self.fid.tell()
+            for entry in self.index:
+                self.fid.write(INDEX_ENTRY.pack(*entry))
+            self.fid.write(FOOTER.pack(index_offset, len(self.index), MAGIC))
+            self.fid.close()
+            self.fid = None
+
+
+class SessionLog(object):
+    """ random access reader of a recorded session """
+    def __init__(self, path):
+        self.path = path
+        self.fid = open(path, 'rb')
+        if self.fid.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a styx session log".format(path))
+        self.index = self._read_index()
+
+    def _read_index(self):
+        self.fid.seek(0, 2)
+        size = self.fid.tell()
+
+        if size >= len(MAGIC) + FOOTER.size:
+            self.fid.seek(size - FOOTER.size)
+            index_offset, count, magic = FOOTER.unpack(self.fid.read(FOOTER.size))
+            if magic == MAGIC:
+                self.fid.seek(index_offset)
+                raw = self.fid.read(count * INDEX_ENTRY.size)
+                return [INDEX_ENTRY.unpack_from(raw, i * INDEX_ENTRY.size) for i in range(count)]
+
+        # no footer: rebuild the index, a partially written last record is dropped
+        index = []
+        offset = len(MAGIC)
+        while offset + RECORD.size <= size:
+            self.fid.seek(offset)
+            t, event_id, length = RECORD.unpack(self.fid.read(RECORD.size))
+            if offset + RECORD.size + length > size:
+                break
+            index.append((offset, t, event_id))
+            offset += RECORD.size + length
+        return index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        """ returns (time, event, data) of the i-th record """
+        offset = self.index[i][0]
+        self.fid.seek(offset)
+        t, event_id, length = RECORD.unpack(self.fid.read(RECORD.size))
+        payload = self.fid.read(length)
+        if event_id & COMPRESSED:
+            payload = zlib.decompress(payload)
+        return t, EVENTS[event_id & ~COMPRESSED], json.loads(payload.decode('utf-8'))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def duration(self):
+        return self.index[-1][1] - self.index[0][1] if self.index else 0.0
+
+    def close(self):
+        self.fid.close()
@@ -0,0 +1,43 @@
+'''
+Locations and atomic writes of the files that nodes share or keep between runs: caches in
+$ROS_HOME (~/.ros by default) and shared memory files in /dev/shm.
+
+Files are written to a temporary file next to the target and renamed, readers in other
+processes never see a partially written file. Other packages import this module with
+
+    sys.path.append(rospkg.RosPack().get_path('styx'))
+    from storage import ros_home_dir, atomic_write
+'''
+
+import os
+
+import numpy as np
+
+ROS_HOME = os.environ.get('ROS_HOME', os.path.join(os.path.expanduser('~'), '.ros'))
+
+
+def ros_home_dir(name):
+    """ directory of persistent files (e.g. caches) in $ROS_HOME """
+    return os.path.join(ROS_HOME, name)
+
+
+def shared_memory_dir(name):
+    """ directory in /dev/shm if available, in $ROS_HOME otherwise """
+    return os.path.join('/dev/shm', name) if os.path.isdir('/dev/shm') else ros_home_dir(name)
+
+
+def atomic_write(path, write):
+    """ create or replace a file, write(fid) writes the content to a temporary file first """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, 'wb') as fid:
+        write(fid)
+    os.rename(tmp, path)
+    return path
+
+
+def save_array(path, array):
+    """ atomically write an array as .npy file """
+    return atomic_write(path, lambda fid: np.save(fid, array))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+'''
+Latency distributions of the traces of latency_trace.py.
+
+For every trace topic and origin (/image_color, /current_pose) the node keeps a histogram of the
+end-to-end latency and of the latency of every hop. They are published periodically as
+diagnostic_msgs/DiagnosticArray on /diagnostics and logged on shutdown. The end-to-end latency
+of /image_color on /trace/actuation is the time from a camera frame to the brake command.
+
+    rosrun styx trace_monitor.py _publish_period:=5.0
+'''
+
+import threading
+from collections import OrderedDict
+
+import rospy
+from diagnostic_msgs.msg import DiagnosticArray
+from styx_msgs.msg import TraceContext
+
+from diagnostics import diagnostic_array, diagnostic_status
+from latency_trace import TRACE_TOPICS, end_to_end, hop_latencies
+from metrics import Histogram
+
+# upper bounds of the latency histogram buckets [s], inference and planning take up to seconds
+TRACE_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0]
+
+
+class TraceStats(object):
+    """ end-to-end and per-hop latency of the traces of one origin on one topic """
+    def __init__(self):
+        self.end_to_end = Histogram(TRACE_BUCKETS)
+        self.hops = OrderedDict()
+
+    def observe(self, trace):
+        self.end_to_end.observe(end_to_end(trace))
+        for hop, latency in hop_latencies(trace):
+            if hop not in self.hops:
+                self.hops[hop] = Histogram(TRACE_BUCKETS)
+            self.hops[hop].observe(latency)
+
+    def values(self):
+        values = [('count', self.end_to_end.count)]
+        for key in ('mean', 'p50', 'p90', 'p99', 'max'):
+            values.append(('end_to_end ' + key, self.end_to_end.summary()[key]))
+        for hop, histogram in self.hops.items():
+            summary = histogram.summary()
+            for key in ('p50', 'p99', 'max'):
+                values.append(('{} {}'.format(hop, key), summary[key]))
+        return values
+
+
+class TraceMonitor(object):
+    def __init__(self):
+        rospy.init_node('trace_monitor')
+
+        self.lock = threading.Lock()
+        self.stats = OrderedDict()
+        self.diagnostics_pub = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size=1)
+
+        for topic in rospy.get_param('~topics', TRACE_TOPICS):
+            rospy.Subscriber(topic, TraceContext, self.trace_cb, callback_args=topic, queue_size=50)
+        rospy.Timer(rospy.Duration(rospy.get_param('~publish_period', 5.0)), self.publish)
+        rospy.on_shutdown(self.log_summary)
+
+        rospy.spin()
+
+    def trace_cb(self, trace, topic):
+        key = (topic, trace.origin)
+        with self.lock:
+            if key not in self.stats:
+                self.stats[key] = TraceStats()
+            self.stats[key].observe(trace)
+
+    def publish(self, event=None):
+        with self.lock:
+            statuses = [diagnostic_status("trace_monitor: {} from {}".format(topic, origin), 'trace_monitor',
+                                          stats.values(), message="end-to-end p99 {:.1f}ms".format(
+                                              1000. * stats.end_to_end.percentile(99)))
+                        for (topic, origin), stats in self.stats.items()]
+        self.diagnostics_pub.publish(diagnostic_array(statuses))
+
+    def log_summary(self):
+        with self.lock:
+            for (topic, origin), stats in self.stats.items():
+                rospy.loginfo("latency {} from {}: {}".format(topic, origin, ', '.join(
+                    "{}={}".format(key, round(value, 4)) for key, value in stats.values())))
+
+
+if __name__ == '__main__':
+    try:
+        TraceMonitor()
+    except rospy.ROSInterruptException:
+        rospy.logerr('Could not start trace monitor node.')
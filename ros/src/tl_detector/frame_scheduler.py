@@ -0,0 +1,164 @@
+'''
+Adaptive frame-rate controller of the traffic light classification.
+
+Instead of a fixed camera frame limit, the admitted frame rate follows the measured inference
+latency: with an EWMA of the latency and the CPU headroom (1 - load average per core) the
+interval between two admitted frames is chosen so that the classification takes about the
+target duty cycle of the time, scaled down on a loaded machine to leave cores to the control
+nodes. The rate is kept between a minimum state-refresh rate and a maximum rate, so the same
+build adapts to slow and fast hardware.
+
+Skipped frames are counted instead of logged; the achieved frame rate, skip counts and the
+controller state are published periodically as diagnostic_msgs/DiagnosticArray on /diagnostics.
+
+    scheduler = FrameScheduler('tl_detector')
+
+    def image_cb(self, msg):
+        if scheduler.admit():
+            ...  # classify
+            scheduler.finish()
+'''
+
+import os
+import sys
+import time
+
+import rospkg
+import rospy
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus
+
+sys.path.append(rospkg.RosPack().get_path('styx'))
+from diagnostics import diagnostic_array, diagnostic_status
+
+LOAD_PERIOD = 1.0  # time between two samples of the load average [s]
+HEADROOM_WEIGHT = 0.5  # share of the target duty cycle that is given up on a fully loaded machine
+
+
+def cpu_headroom():
+    """ idle share of the cores according to the 1 minute load average, 1.0 if it is unknown """
+    try:
+        return min(max(1. - os.getloadavg()[0] / max(os.sysconf('SC_NPROCESSORS_ONLN'), 1), 0.), 1.)
+    except (AttributeError, OSError, ValueError):
+        return 1.
+
+
+class FrameScheduler(object):
+    def __init__(self, name, target_duty=0.75, min_fps=1.0, max_fps=10.0, alpha=0.2, publish_period=5.0):
+        """
+        Args:
+            name (str): name of the node in the diagnostics
+            target_duty (float): share of the time spent in the classification on an idle machine
+            min_fps (float): minimum state-refresh rate, admitted even above the duty cycle [Hz]
+            max_fps (float): maximum classification rate [Hz]
+            alpha (float): weight of a new latency sample in the EWMA
+            publish_period (float): time between two diagnostics [s], 0 disables publishing
+
+        """
+        self.name = name
+        self.target_duty = target_duty
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.alpha = alpha
+        self.publish_period = publish_period
+
+        self.latency = None  # EWMA of the inference latency [s]
+        self.headroom = cpu_headroom()
+        self.last_load = time.time()
+        self.busy = False
+        self.last_start = None
+        self.last_finish = None
+
+        # totals since start
+        self.frames = 0
+        self.admitted = 0
+        self.skipped_busy = 0
+        self.skipped_rate = 0
+        self.overwritten = 0
+
+        # classified frames and inference time in the current diagnostics window
+        self.window_start = time.time()
+        self.window_frames = 0
+        self.window_busy_time = 0.
+        self.pub = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size=1) if publish_period > 0 else None
+
+    def interval(self):
+        """ time between the start of two classifications that meets the duty cycle [s] """
+        if self.latency is None:
+            return 1. / self.max_fps
+        duty = self.target_duty * (1. - HEADROOM_WEIGHT * (1. - self.headroom))
+        return min(max(self.latency / duty, 1. / self.max_fps), 1. / self.min_fps)
+
+    def admit(self):
+        """ True if the next camera frame shall be classified, finish() has to follow """
+        now = time.time()
+        self.frames += 1
+        if now - self.last_load >= LOAD_PERIOD:
+            self.headroom = cpu_headroom()
+            self.last_load = now
+
+        if self.busy:
+            self.skipped_busy += 1
+            return False
+        if self.last_start is not None:
+            interval = self.interval()
+            # the idle gap after a slow frame is kept as well, other nodes need the cores
+            if now - self.last_start < interval or \
+                    now - self.last_finish < interval - min(self.latency, interval):
+                self.skipped_rate += 1
+                return False
+
+        self.busy = True
+        self.last_start = now
+        self.admitted += 1
+        return True
+
+    def finish(self, overwritten=False):
+        """ end of the classification of an admitted frame, its result was discarded if overwritten """
+        if not self.busy:
+            return
+        now = time.time()
+        latency = now - self.last_start
+        self.latency = latency if self.latency is None else (1. - self.alpha) * self.latency + self.alpha * latency
+        self.busy = False
+        self.last_finish = now
+
+        self.window_busy_time += latency
+        if overwritten:
+            self.overwritten += 1
+        else:
+            self.window_frames += 1
+
+        if self.pub is not None and now - self.window_start >= self.publish_period:
+            self.publish()
+
+    def summary(self):
+        """ controller state, rates of the current window and the totals since start """
+        elapsed = max(time.time() - self.window_start, 1e-3)
+        return {'frames': self.frames,
+                'admitted': self.admitted,
+                'skipped_busy': self.skipped_busy,
+                'skipped_rate': self.skipped_rate,
+                'overwritten': self.overwritten,
+                'achieved_fps': self.window_frames / elapsed,
+                'achieved_duty': self.window_busy_time / elapsed,
+                'target_fps': 1. / self.interval(),
+                'latency_ewma': self.latency if self.latency is not None else 0.,
+                'cpu_headroom': self.headroom}
+
+    def publish(self):
+        summary = self.summary()
+
+        if summary['latency_ewma'] > 1. / self.min_fps:
+            level = DiagnosticStatus.WARN
+            message = "inference latency {:.0f}ms misses the minimum refresh rate of {:.1f}Hz".format(
+                1000. * summary['latency_ewma'], self.min_fps)
+        else:
+            level = DiagnosticStatus.OK
+            message = "{:.1f}fps classified".format(summary['achieved_fps'])
+
+        self.pub.publish(diagnostic_array([diagnostic_status("{}: frame scheduler".format(self.name), self.name,
+                                                             summary, level, message)]))
+
+        self.window_start = time.time()
+        self.window_frames = 0
+        self.window_busy_time = 0.
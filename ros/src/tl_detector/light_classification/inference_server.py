@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+'''
+Traffic light classification in a separate worker process.
+
+RemoteTLClassifier has the API of TLClassifier, but the tensorflow session runs in a worker
+process started from this file. Long sess.run calls do not hold the GIL of the tl_detector and
+a crash of tensorflow does not take the node down.
+
+- frames are passed as slots of a frame ring (see styx/frame_ring.py): frames of the bridge's
+  ring are classified in place, other frames are copied into a request ring of the client
+- requests and results are length-prefixed JSON messages over a Unix socket, a request can
+  carry several frames which the worker classifies as one batch (TLClassifier.classify_batch)
+- a request that is not answered within the timeout kills the worker, a worker that was killed
+  or died is restarted after RESTART_DELAY seconds, the frame is reported as UNKNOWN meanwhile
+
+The worker connects to the socket of the client once the model is loaded and a first (dummy)
+inference allocated the session, a new worker is classifying after its model load time. The
+first request of a worker gets FIRST_REQUEST_TIMEOUT, later ones the configured timeout.
+'''
+
+import argparse
+import json
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import rospkg
+import rospy
+from styx_msgs.msg import TrafficLight
+
+sys.path.append(rospkg.RosPack().get_path('styx'))
+from frame_ring import FrameRing, FRAME_SHAPE
+
+RESTART_DELAY = 5.0  # minimum time between two starts of the worker [s]
+FIRST_REQUEST_TIMEOUT = 10.0  # timeout of the first request of a new worker [s]
+HEADER = struct.Struct('>I')
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_message(sock):
+    """ next message, None if the peer closed the connection """
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, HEADER.unpack(header)[0])
+    return None if data is None else json.loads(data.decode('utf-8'))
+
+
+class RemoteTLClassifier(object):
+    def __init__(self, is_site, intra_op_threads=0, inter_op_threads=0, timeout=1.0):
+        self.args = ['--intra-op-threads', str(intra_op_threads), '--inter-op-threads', str(inter_op_threads)]
+        if is_site:
+            self.args.append('--site')
+        self.timeout = timeout
+
+        self.socket_path = os.path.join(tempfile.gettempdir(), "tl_inference.{}.sock".format(os.getpid()))
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        self.listener.listen(1)
+        self.listener.setblocking(False)
+
+        self.process = None
+        self.connection = None
+        self.last_start = None
+        self.restart_at = None
+        self.first_request = True
+        self.request_id = 0
+        self.request_ring = None
+        self.restarts = -1
+        self.timeouts = 0
+        self.start()
+
+    def start(self):
+        self.stop()
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--socket', self.socket_path] +
+                                        self.args)
+        self.last_start = time.time()
+        self.restart_at = self.last_start + RESTART_DELAY
+        self.restarts += 1
+        rospy.loginfo("inference worker started with pid {}".format(self.process.pid))
+
+    def stop(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def close(self):
+        self.stop()
+        self.listener.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def ready(self):
+        """ True if a worker is connected, (re)starts the worker if it died """
+        if self.process.poll() is not None:
+            if self.connection is not None:
+                rospy.logerr("inference worker died with exit code {}".format(self.process.returncode))
+                self.connection.close()
+                self.connection = None
+            if time.time() >= self.restart_at:
+                self.start()
+            return False
+
+        if self.connection is None:
+            try:
+                self.connection, _ = self.listener.accept()
+            except socket.error:
+                return False
+            self.connection.setblocking(True)
+            # the first sess.run of a session can be slower than the later ones
+            self.connection.settimeout(max(self.timeout, FIRST_REQUEST_TIMEOUT))
+            self.first_request = True
+            rospy.loginfo("inference worker ready after {:.1f}s".format(time.time() - self.last_start))
+        return True
+
+    def request(self, frames):
+        """ states of frames given as dicts with ring, slot and sequence, None for overwritten frames """
+        if not self.ready():
+            return [TrafficLight.UNKNOWN] * len(frames)
+
+        self.request_id += 1
+        try:
+            send_message(self.connection, {'id': self.request_id, 'frames': frames})
+            while True:
+                response = recv_message(self.connection)
+                if response is None:
+                    raise socket.error("connection closed by the worker")
+                if response['id'] == self.request_id:
+                    if self.first_request:
+                        self.connection.settimeout(self.timeout)
+                        self.first_request = False
+                    return response['states']
+        except socket.timeout:
+            self.timeouts += 1
+            rospy.logerr("inference worker did not answer within {}s, restarting it in {}s".format(
+                self.connection.gettimeout(), RESTART_DELAY))
+            self.stop()
+            self.restart_at = time.time() + RESTART_DELAY
+        except socket.error as e:
+            rospy.logerr("inference worker failed: {}".format(e))
+            self.stop()
+            self.restart_at = time.time() + RESTART_DELAY
+        return [TrafficLight.UNKNOWN] * len(frames)
+
+    def get_classifications(self, images):
+        """ states of several images, classified in one request """
+        if self.request_ring is None or len(images) > self.request_ring.slots or \
+                any(not self.request_ring.fits(image) for image in images):
+            shape = tuple(max(sizes) for sizes in zip(FRAME_SHAPE, *[image.shape for image in images]))
+            self.request_ring = FrameRing.create('tl_requests', max(2 * len(images), 4), shape)
+        frames = []
+        for image in images:
+            slot, sequence = self.request_ring.write(image)
+            frames.append({'ring': self.request_ring.path, 'slot': slot, 'sequence': sequence})
+        return [TrafficLight.UNKNOWN if state is None else state for state in self.request(frames)]
+
+    def get_classification(self, image):
+        """ state of an image, see TLClassifier.get_classification """
+        return self.get_classifications([image])[0]
+
+    def get_classification_slot(self, ring, slot, sequence):
+        """ state of a frame of a frame ring, classified in place, None if it was overwritten """
+        return self.request([{'ring': ring, 'slot': slot, 'sequence': sequence}])[0]
+
+
+def serve(socket_path, is_site, intra_op_threads, inter_op_threads):
+    """ worker: classify the frames of the requests until the client closes the connection """
+    from tl_classifier import TLClassifier
+    classifier = TLClassifier(is_site, intra_op_threads, inter_op_threads)
+    # warm-up, the first sess.run initializes the graph and allocates the memory
+    classifier.get_classification(np.zeros(FRAME_SHAPE, dtype=np.uint8))
+    rings = {}
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(socket_path)
+    while True:
+        request = recv_message(connection)
+        if request is None:
+            return
+
+        states = [None] * len(request['frames'])
+        views = []
+        for i, frame in enumerate(request['frames']):
+            if frame['ring'] not in rings:
+                if len(rings) >= 4:
+                    # rings of earlier bridges and request rings
+                    rings.clear()
+                try:
+                    rings[frame['ring']] = FrameRing(frame['ring'])
+                except (IOError, OSError, ValueError):
+                    continue
+            ring = rings[frame['ring']]
+            image = ring.view(frame['slot'], frame['sequence'])
+            if image is not None:
+                views.append((i, ring, image))
+
+        # all frames of the request in one forward pass
+        if views:
+            for (i, ring, _), state in zip(views, classifier.get_classifications([image for _, _, image in views])):
+                frame = request['frames'][i]
+                if ring.valid(frame['slot'], frame['sequence']):
+                    states[i] = state
+        send_message(connection, {'id': request['id'], 'states': states})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='traffic light inference worker of RemoteTLClassifier')
+    parser.add_argument('--socket', required=True, help='unix socket of the client')
+    parser.add_argument('--site', action='store_true')
+    parser.add_argument('--intra-op-threads', type=int, default=0)
+    parser.add_argument('--inter-op-threads', type=int, default=0)
+    args = parser.parse_args()
+    serve(args.socket, args.site, args.intra_op_threads, args.inter_op_threads)
@@ -1,13 +1,16 @@
 from styx_msgs.msg import TrafficLight
 import tensorflow as tf
 import numpy as np
+import cv2
 import rospy
 import time
 import os
 
+SCORE_THRESHOLD = 0.5  # minimum score of a detection that takes part in the vote
+
 
 class TLClassifier(object):
-    def __init__(self, is_site):
+    def __init__(self, is_site, intra_op_threads=0, inter_op_threads=0):
         # load classifier
         if is_site:
             model = 'models_frozen/frozen_srb_simon_tf1-3.pb'
@@ -25,6 +28,10 @@ class TLClassifier(object):
                             2: {'id': TrafficLight.RED, 'name': 'RED'},
                             3: {'id': TrafficLight.YELLOW, 'name': 'YELLOW'},
                             4: {'id': TrafficLight.UNKNOWN, 'name': 'UNKNOWN'}}
+        # state per class index of the detection model, for the vectorized vote
+        self.class_states = np.full(max(self.index2light) + 1, TrafficLight.UNKNOWN, dtype=np.int32)
+        for index, light in self.index2light.items():
+            self.class_states[index] = light['id']
 
         self.graph = tf.Graph()
 
@@ -37,7 +44,12 @@ class TLClassifier(object):
                 tf.import_graph_def(frozen, name='')
 
             # generate one session that we will keep open for performance reasons
-            self.sess = tf.Session(graph=self.graph)
+            # limited thread pools leave cores to the control nodes (0 = one thread per core)
+            config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                                    inter_op_parallelism_threads=inter_op_threads)
+            self.sess = tf.Session(graph=self.graph, config=config)
+            rospy.loginfo("tensorflow session with {} intra-op and {} inter-op threads (0 = default)".format(
+                intra_op_threads, inter_op_threads))
 
             # Definite input and output Tensors for detection_graph
             self.image_tensor = self.graph.get_tensor_by_name('image_tensor:0')
@@ -51,6 +63,9 @@ class TLClassifier(object):
             self.detection_classes = self.graph.get_tensor_by_name('detection_classes:0')
             self.num_detections = self.graph.get_tensor_by_name('num_detections:0')
 
+    def close(self):
+        self.sess.close()
+
     def get_classification(self, image):
         """Determines the color of the traffic light in the image
 
@@ -61,54 +76,91 @@ class TLClassifier(object):
             int: ID of traffic light color (specified in styx_msgs/TrafficLight)
 
         """
+        return self.get_classifications([image])[0]
 
-        time1 = time.time()
-
-        with self.graph.as_default():
-            # single frame processing == batch size 1
-            image_list = np.expand_dims(image, axis=0)
-
-            # inference forward pass
-            (boxes, scores, classes, num) = self.sess.run(
-                [self.detection_boxes, self.detection_scores, self.detection_classes, self.num_detections],
-                feed_dict={self.image_tensor: image_list})
-
-            time2 = time.time()
-
-            boxes = np.squeeze(boxes)
-            scores = np.squeeze(scores)
-            classes = np.squeeze(classes).astype(np.int32)
+    def get_classifications(self, images):
+        """ colors of the traffic lights in several images (frames or crops), classified in one batch """
+        return self.classify_batch(images)[0]
 
-            # we have lots of possible matches, decide which color wins
-            keep = scores > 0.5
+    def classify_batch(self, images):
+        """Detects traffic lights in a batch of images of any size with a single forward pass
 
-            if np.any(keep):
-                boxes = boxes[keep]
-                scores = scores[keep]
-                classes = classes[keep]
+        The images are letterboxed to a common shape: scaled to fit into the largest height and
+        width of the batch (keeping the aspect ratio) and centered with black borders.
 
-                members, index, counts = np.unique(classes, return_inverse=True, return_counts=True)
-                member_scores = np.zeros((len(members),))
+        Args:
+            images (list of cv::Mat): rgb8 images
 
-                for i in range(len(members)):
-                    member_scores[i] = np.sum(scores[index == i])
+        Returns:
+            list of int: ID of traffic light color per image (specified in styx_msgs/TrafficLight)
+            list of np.ndarray: scores of the detections above SCORE_THRESHOLD per image
+            list of np.ndarray: boxes [ymin, xmin, ymax, xmax] of these detections, normalized to each image
 
-                select = np.argmax(member_scores)
-                winner = members[select]
-                count = counts[select]
-                score = member_scores[select]
+        """
+        time1 = time.time()
 
+        batch, offsets, sizes = letterbox(images)
+        with self.graph.as_default():
+            # inference forward pass of the whole batch
+            (boxes, scores, classes, num) = self.sess.run(
+                [self.detection_boxes, self.detection_scores, self.detection_classes, self.num_detections],
+                feed_dict={self.image_tensor: batch})
+
+        time2 = time.time()
+
+        # we have lots of possible matches, decide which color wins: sum of the scores per class and image
+        classes = classes.astype(np.int32)
+        keep = scores > SCORE_THRESHOLD
+        rows = np.repeat(np.arange(len(images)), scores.shape[1]).reshape(scores.shape)
+        class_scores = np.zeros((len(images), len(self.class_states)))
+        class_counts = np.zeros((len(images), len(self.class_states)), dtype=np.int32)
+        np.add.at(class_scores, (rows[keep], classes[keep]), scores[keep])
+        np.add.at(class_counts, (rows[keep], classes[keep]), 1)
+
+        winners = np.argmax(class_scores, axis=1)
+        detected = np.any(keep, axis=1)
+        states = np.where(detected, self.class_states[winners], TrafficLight.UNKNOWN)
+
+        # boxes relative to the letterboxed batch -> relative to each image
+        height, width = batch.shape[1:3]
+        scale = np.array([height, width, height, width], dtype=np.float32)
+        origin = np.tile(offsets, 2).astype(np.float32)
+        extent = np.tile(sizes, 2).astype(np.float32)
+        boxes = (boxes * scale - origin[:, np.newaxis]) / extent[:, np.newaxis]
+
+        for i in range(len(images)):
+            if detected[i]:
                 rospy.loginfo("traffic lights: {} detections in {}ms: best match {} with {} matches and sum of scores {} ".format(
-                    len(scores),
-                    round(100*(time2-time1)),
-                    self.index2light[winner]['name'],
-                    count,
-                    score
+                    np.count_nonzero(keep[i]),
+                    round(1000 * (time2 - time1)),
+                    self.index2light[winners[i]]['name'],
+                    class_counts[i, winners[i]],
+                    class_scores[i, winners[i]]
                 ))
-
-                state = self.index2light[winner]['id']
             else:
-                rospy.loginfo("traffic lights: no detection in {}ms".format(round(100*(time2-time1))))
-                state = TrafficLight.UNKNOWN
-
-        return state
+                rospy.loginfo("traffic lights: no detection in {}ms".format(round(1000 * (time2 - time1))))
+
+        return [int(state) for state in states], [scores[i][keep[i]] for i in range(len(images))], \
+            [boxes[i][keep[i]] for i in range(len(images))]
+
+
+def letterbox(images):
+    """ batch of images of a common shape, offsets and sizes (height, width) of the images in the batch """
+    height = max(image.shape[0] for image in images)
+    width = max(image.shape[1] for image in images)
+    if len(images) == 1:
+        # no copy of a single frame
+        return np.expand_dims(images[0], axis=0), np.zeros((1, 2), np.int32), np.array([images[0].shape[:2]])
+
+    batch = np.zeros((len(images), height, width, 3), dtype=np.uint8)
+    offsets = np.zeros((len(images), 2), np.int32)
+    sizes = np.zeros((len(images), 2), np.int32)
+    for i, image in enumerate(images):
+        scale = min(float(height) / image.shape[0], float(width) / image.shape[1])
+        if scale != 1.:
+            size = (max(int(round(image.shape[1] * scale)), 1), max(int(round(image.shape[0] * scale)), 1))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+        sizes[i] = image.shape[:2]
+        offsets[i] = (height - sizes[i, 0]) // 2, (width - sizes[i, 1]) // 2
+        batch[i, offsets[i, 0]:offsets[i, 0] + sizes[i, 0], offsets[i, 1]:offsets[i, 1] + sizes[i, 1]] = image
+    return batch, offsets, sizes
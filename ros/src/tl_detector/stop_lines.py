@@ -0,0 +1,100 @@
+'''
+Stop-line waypoints of the traffic lights and lookup of the next light ahead.
+
+The waypoint of every stop line is found with one vectorized nearest-point query over the
+track and moved back along the arc length by CENTER_TO_BUMPER, so the car stops before and not
+on the line. The result is cached as binary .npy file keyed by a hash of the track geometry and
+the stop-line positions, warm starts of large site maps skip the query.
+
+The next light ahead is a bisect lookup in the sorted stop-line waypoints, after the last light
+of the track the lookup wraps around to the first one.
+'''
+
+import bisect
+import hashlib
+import os
+import sys
+
+import numpy as np
+import rospkg
+
+sys.path.append(rospkg.RosPack().get_path('styx'))
+from storage import ros_home_dir, save_array
+
+CENTER_TO_BUMPER = 2.5  # distance between the stop-line and the stop-waypoint [m]
+CACHE_DIR = ros_home_dir('stop_line_cache')
+
+
+def find_stop_waypoints(track, positions):
+    """ stop-waypoint of each stop-line position (x, y), considers the vehicle length """
+    positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+    if len(positions) == 0:
+        return np.zeros(0, dtype=np.int32)
+
+    # closest waypoint of every stop-line, (lines x waypoints) squared distances
+    d2 = (track['x'][np.newaxis, :] - positions[:, 0:1])**2 + (track['y'][np.newaxis, :] - positions[:, 1:2])**2
+    closest = np.argmin(d2, axis=1)
+
+    # last waypoint at least CENTER_TO_BUMPER behind the closest one, not before the start of the track
+    s = track['s']
+    index = np.searchsorted(s, s[closest] - CENTER_TO_BUMPER, side='right') - 1
+    return np.maximum(index, 0).astype(np.int32)
+
+
+def cache_file(track, positions, cache_dir=CACHE_DIR):
+    """ name of the cached stop-waypoints, changes with the track geometry and the light config """
+    key = hashlib.sha1(np.ascontiguousarray(track['x']).tobytes())
+    key.update(np.ascontiguousarray(track['y']).tobytes())
+    key.update(np.asarray(positions, dtype=np.float64).tobytes())
+    key.update(repr(CENTER_TO_BUMPER).encode('utf-8'))
+    return os.path.join(cache_dir, key.hexdigest() + '.npy')
+
+
+def load_stop_waypoints(track, positions, cache_dir=CACHE_DIR):
+    """ stop-waypoints of the stop-line positions, read from the cache if available
+
+    Returns:
+        (np.ndarray, bool): stop-waypoints and whether they were read from the cache
+
+    """
+    if not cache_dir:
+        return find_stop_waypoints(track, positions), False
+
+    cached = cache_file(track, positions, cache_dir)
+    if os.path.isfile(cached):
+        try:
+            waypoints = np.load(cached)
+            if waypoints.shape == (len(positions),) and np.all(waypoints < len(track)):
+                return waypoints, True
+        except (IOError, ValueError):
+            pass
+
+    waypoints = find_stop_waypoints(track, positions)
+
+    # nodes of another launch might read the cache at the same time
+    save_array(cached, waypoints)
+
+    return waypoints, False
+
+
+class StopLineIndex(object):
+    """ stop-waypoints sorted along the track for O(log n) lookups of the next light """
+    def __init__(self, waypoints):
+        # stable sort, of lights at the same waypoint the first one of the config wins
+        self.order = np.argsort(waypoints, kind='mergesort').tolist()
+        self.waypoints = np.asarray(waypoints)[self.order].tolist()
+
+    def __len__(self):
+        return len(self.waypoints)
+
+    def next_light(self, waypoint):
+        """ index (in the config) and stop-waypoint of the first light at or after a waypoint
+
+        Returns (-1, -1) without lights, wraps around to the first light after the last one.
+        """
+        if not self.waypoints:
+            return -1, -1
+        i = bisect.bisect_left(self.waypoints, waypoint)
+        if i == len(self.waypoints):
+            i = 0
+        return self.order[i], self.waypoints[i]
@@ -1,25 +1,33 @@
 #!/usr/bin/env python
 import rospy
+import rospkg
 from std_msgs.msg import Int32
 from geometry_msgs.msg import PoseStamped, Pose
 from styx_msgs.msg import TrafficLightArray, TrafficLight
-from styx_msgs.msg import Lane
+from styx_msgs.msg import Lane, TrackDescriptor, TraceContext, FrameSlot
 from sensor_msgs.msg import Image
 from cv_bridge import CvBridge
 from light_classification.tl_classifier import TLClassifier
+from light_classification.inference_server import RemoteTLClassifier
 import tf
 import cv2
 import yaml
 import PIL
 import os
-import math
+import sys
+import threading
+
+sys.path.append(rospkg.RosPack().get_path('waypoint_loader'))
+from track_store import open_track, track_from_waypoints
+sys.path.append(rospkg.RosPack().get_path('styx'))
+from latency_trace import start_trace
+from frame_ring import FrameRing
+from stop_lines import StopLineIndex, load_stop_waypoints
+from frame_scheduler import FrameScheduler
 
 STATE_COUNT_THRESHOLD = 2
 NUM_WP_STOP_AFTER_STOPLINE = 1
-LIMIT_CAMERA_FPS = 4
-MAX_DUTY_CYCLE = 0.75
 SAVE_CAMERA_IMAGES_TO = None  # '/home/USER/CarND-Capstone/data/tl_test_simulator'
-CENTER_TO_BUMPER = 2.5
 FORCE_RED_LIGHT_SECONDS = 0.0  # Force stop at every stop-line for at least XX seconds
 VERBOSE = False  # increased debug messages
 
@@ -29,7 +37,8 @@ class TLDetector(object):
         rospy.init_node('tl_detector')
 
         self.car_waypoint = None
-        self.waypoints = None
+        self.track = None
+        self.track_version = None
         self.lights = None
         self.config = None
 
@@ -47,9 +56,18 @@ class TLDetector(object):
         '''
 
         self.upcoming_red_light_pub = rospy.Publisher('/traffic_waypoint', Int32, queue_size=1)
+        # latency trace of the camera frames that led to a published state, see styx/latency_trace.py
+        self.trace_pub = rospy.Publisher('/trace/traffic_waypoint', TraceContext, queue_size=10)
 
         self.bridge = CvBridge()
-        self.light_classifier = TLClassifier(self.config['is_site'])
+        # thread pools of the tensorflow session, 0 = tensorflow default
+        self.tf_threads = (rospy.get_param('~tf_intra_op_threads', 0), rospy.get_param('~tf_inter_op_threads', 0))
+        # optional classification in a worker process (see light_classification/inference_server.py)
+        self.inference_server = rospy.get_param('~inference_server', False)
+        self.inference_timeout = rospy.get_param('~inference_timeout', 1.0)
+        self.light_classifier = self.create_classifier(self.config['is_site'])
+        # the classifier is replaced on map switches (track thread) while frames are classified (image thread)
+        self.classifier_lock = threading.Lock()
         self.listener = tf.TransformListener()
 
         # traffic light state change will only be accepted after multiple detections
@@ -58,11 +76,11 @@ class TLDetector(object):
         self.last_stop_wp = -1
         self.state_count = 0
 
-        # used for limiting the inference frame-rate
-        self.last_frame = rospy.get_time()
-        self.last_finish = rospy.get_time()
+        # inference frame-rate adapted to the latency and the cpu load (see frame_scheduler.py)
+        self.scheduler = FrameScheduler('tl_detector', rospy.get_param('~target_duty', 0.75),
+                                        rospy.get_param('~min_fps', 1.0), rospy.get_param('~max_fps', 10.0),
+                                        publish_period=rospy.get_param('~scheduler_period', 5.0))
         self.last_publish = rospy.get_time() - 1.0
-        self.busy = False
 
         # states used for the forced stopping at each stop-line (debug-option)
         self.time_forced_stop = rospy.get_time()
@@ -71,16 +89,26 @@ class TLDetector(object):
         # counter for saving camera images
         self.k = 0
 
+        # shared-memory frame ring of the bridge (see styx/frame_ring.py)
+        self.frame_ring = None
+
         # flag is True if initialization finished and all required topics have arrived
         self.is_ready = False
 
-        # list of waypoints ahead of each stop-line
+        # list of waypoints ahead of each stop-line and their sorted index
         self.stop_line_waypoints = None
+        self.stop_line_index = None
 
         # subscribe to required topics
-        rospy.Subscriber('/base_waypoints', Lane, self.waypoints_cb)
+        if rospy.get_param('~use_track_store', True):
+            rospy.Subscriber('/base_track', TrackDescriptor, self.track_cb)
+        else:
+            rospy.Subscriber('/base_waypoints', Lane, self.waypoints_cb)
         rospy.Subscriber('/vehicle/traffic_lights', TrafficLightArray, self.traffic_cb)
-        rospy.Subscriber('/image_color', Image, self.image_cb, queue_size=1)
+        if rospy.get_param('~use_frame_ring', False):
+            rospy.Subscriber('/image_color_slot', FrameSlot, self.frame_slot_cb, queue_size=1)
+        else:
+            rospy.Subscriber('/image_color', Image, self.image_cb, queue_size=1)
         rospy.Subscriber('/current_waypoint', Int32, self.current_waypoint_cb)
 
         if SAVE_CAMERA_IMAGES_TO is not None:
@@ -127,18 +155,62 @@ class TLDetector(object):
                                                                                       forced_stop_duration))
 
     def waypoints_cb(self, static_lane):
-        if self.waypoints is None:
-            self.waypoints = static_lane.waypoints
-            self.update_stopline_waypoints()
+        if self.track is not None:
+            # map switch, the light config of the new map is already on the parameter server
+            self.update_config()
+        self.track = track_from_waypoints(static_lane.waypoints)
+        self.update_stopline_waypoints()
+
+    def track_cb(self, descriptor):
+        """ map the shared track file of the waypoint_loader read-only, once per map version """
+        if descriptor.version == self.track_version:
+            return
+        track = open_track(descriptor.path)
+        if len(track) != descriptor.num_waypoints:
+            rospy.logerr("track file {} does not match its descriptor".format(descriptor.path))
+            return
+        if self.track is not None:
+            rospy.loginfo("map switched to {} version {}".format(descriptor.map_name, descriptor.version))
+            self.update_config()
+        self.track = track
+        self.track_version = descriptor.version
+        self.update_stopline_waypoints()
+
+    def update_config(self):
+        """ re-read the traffic light config and reset all map dependant state """
+        config = yaml.load(rospy.get_param("/traffic_light_config"))
+        if config['is_site'] != self.config['is_site']:
+            with self.classifier_lock:
+                self.light_classifier.close()
+                self.light_classifier = self.create_classifier(config['is_site'])
+        self.config = config
+
+        self.car_waypoint = None
+        self.state = TrafficLight.UNKNOWN
+        self.last_state = TrafficLight.UNKNOWN
+        self.last_stop_wp = -1
+        self.state_count = 0
+        self.forced_stop_wp = -1
+        self.stop_line_waypoints = None
+        self.stop_line_index = None
+        self.is_ready = False
+
+    def create_classifier(self, is_site):
+        if self.inference_server:
+            return RemoteTLClassifier(is_site, self.tf_threads[0], self.tf_threads[1], self.inference_timeout)
+        return TLClassifier(is_site, *self.tf_threads)
 
     def update_stopline_waypoints(self):
-        if self.waypoints is not None and self.config is not None:
-            self.stop_line_waypoints = []
+        if self.track is not None and self.config is not None:
+            positions = self.config['stop_line_positions']
+            stop_line_waypoints, cached = load_stop_waypoints(self.track, positions)
 
-            for xy in self.config['stop_line_positions']:
-                stop_wp = self.find_stop_waypoint(xy[0], xy[1])
-                self.stop_line_waypoints.append(stop_wp)
+            for xy, stop_wp in zip(positions, stop_line_waypoints):
                 rospy.loginfo("stop line waypoint xy = ({}, {}) at waypoint {}".format(xy[0], xy[1], stop_wp))
+            if cached:
+                rospy.loginfo("stop line waypoints read from the cache")
+            self.stop_line_index = StopLineIndex(stop_line_waypoints)
+            self.stop_line_waypoints = stop_line_waypoints.tolist()
 
     def traffic_cb(self, msg):
         # ground truth of traffic lights
@@ -152,27 +224,70 @@ class TLDetector(object):
             msg (Image): image from car-mounted camera
 
         """
-        now = rospy.get_time()
-
-        # limit inception frame rate and avoid very high duty cycles (otherwise the dbw might spin out of control)
-        if self.busy:
-            rospy.logwarn("traffic light detection: SKIP still busy with last frame")
-            self.publish(force=True)
-            return
-        elif now - self.last_frame < 1.0/LIMIT_CAMERA_FPS:
-            # limit camera frames to a reasonable level
-            self.publish(force=True)
+        if not self.admit_frame():
             return
-        elif now - self.last_finish < (1.0 - MAX_DUTY_CYCLE)/LIMIT_CAMERA_FPS:
-            rospy.logwarn("traffic light detection: SKIP duty above {}%".format(round(100*MAX_DUTY_CYCLE)))
-            self.publish(force=True)
+        try:
+            self.detect(self.process_camera_image(self.bridge.imgmsg_to_cv2(msg, "rgb8")), msg.header)
+        finally:
+            # also after a failed classification, otherwise no further frame would be admitted
+            self.scheduler.finish()
+
+    def frame_slot_cb(self, msg):
+        """ camera frame in the shared-memory frame ring of the bridge, classified without a copy
+
+        Args:
+            msg (FrameSlot): slot and sequence number of the frame in the ring
+
+        """
+        if not self.admit_frame():
             return
-        else:
-            self.busy = True
-            self.last_frame = now
+        try:
+            state = self.classify_slot(msg)
+            if state is None:
+                self.frame_overwritten()
+            else:
+                self.detect(state, msg.header)
+        finally:
+            # also after a failed classification, otherwise no further frame would be admitted
+            self.scheduler.finish()
+
+    def classify_slot(self, msg):
+        """ state of the frame of a FrameSlot, None if it was overwritten before or while it was classified """
+        if self.inference_server:
+            # the worker process maps the ring itself and classifies the frame in place
+            with self.classifier_lock:
+                return self.light_classifier.get_classification_slot(msg.ring, msg.slot, msg.sequence)
+
+        if self.frame_ring is None or self.frame_ring.path != msg.ring:
+            # first frame or the bridge was restarted with a new ring
+            self.frame_ring = FrameRing(msg.ring)
+
+        frame = self.frame_ring.view(msg.slot, msg.sequence)
+        state = None if frame is None else self.process_camera_image(frame)
+        return state if self.frame_ring.valid(msg.slot, msg.sequence) else None
+
+    def admit_frame(self):
+        """ True if the next camera frame shall be classified """
+        # limit inception frame rate and avoid very high duty cycles (otherwise the dbw might spin out of control)
+        if self.scheduler.admit():
+            return True
+        # skipped frame, keep publishing the last state
+        self.publish(force=True)
+        return False
+
+    def frame_overwritten(self):
+        """ the frame of the ring was overwritten by the bridge, its result is discarded """
+        self.scheduler.finish(overwritten=True)
+        self.publish(force=True)
+
+    def detect(self, state, header):
+        """ publish the stop waypoint of the next red light given the classified state of a camera image
 
-        # process camera image using tensorflow inference model
-        state = self.process_camera_image(msg)
+        Args:
+            state (int): traffic light state of the camera image
+            header (Header): header of the camera image, origin of the latency trace
+
+        """
         # get the next traffic light index and waypoint
         light_index, light_wp = self.next_traffic_light()
 
@@ -189,9 +304,7 @@ class TLDetector(object):
         else:
             self.publish(force=True)
         self.state_count += 1
-
-        self.last_finish = rospy.get_time()
-        self.busy = False
+        self.trace_pub.publish(start_trace(header, '/image_color', 'tl_detector'))
 
     def publish(self, force=False):
         stop_wp = max(self.forced_stop_wp, self.last_stop_wp)
@@ -205,39 +318,7 @@ class TLDetector(object):
         else:
             return False
 
-    def find_stop_waypoint(self, x, y):
-        """ find according stop-waypoint given stop-coordinates, considers vehicle length"""
-        # initialize search
-        d_min = 1e12
-        index = -1
-
-        def distance(i_wp1, i_wp2):
-            """ returns the distance between to waypoints"""
-            dx = self.waypoints[i_wp1].pose.pose.position.x - self.waypoints[i_wp2].pose.pose.position.x
-            dy = self.waypoints[i_wp1].pose.pose.position.y - self.waypoints[i_wp2].pose.pose.position.y
-            return math.sqrt(dx**2 + dy**2)
-
-        # simple linear search as in path-planning-project
-        for k, wp in enumerate(self.waypoints):
-            dx = wp.pose.pose.position.x - x
-            dy = wp.pose.pose.position.y - y
-            d2 = dx * dx + dy * dy
-
-            if d2 < d_min:
-                d_min = d2
-                index = k
-
-        # search backwards in order to stop before and not on the stop-line
-        delta = 0.0
-        while index >= 0 and delta < CENTER_TO_BUMPER:
-            delta += distance(index, index-1)
-            index -= 1
-
-        return index
-
-    def process_camera_image(self, camera_image):
-        cv_image = self.bridge.imgmsg_to_cv2(camera_image, "rgb8")
-
+    def process_camera_image(self, cv_image):
         if SAVE_CAMERA_IMAGES_TO is not None:
             img = PIL.Image.fromarray(cv_image)
             self.k += 1
@@ -246,7 +327,8 @@ class TLDetector(object):
             rospy.loginfo("saved camera frame to: " + jpg_file)
 
         # Get classification
-        return self.light_classifier.get_classification(cv_image)
+        with self.classifier_lock:
+            return self.light_classifier.get_classification(cv_image)
 
     def next_traffic_light(self):
         """ find the closest visible traffic light (if one exists) """
@@ -254,22 +336,14 @@ class TLDetector(object):
             # copy current waypoint to be safe in case of a waypoint interrupt/callback
             car_waypoint = self.car_waypoint
 
-            light_index = -1
-            light_wp = -1
-            numel_ahead = len(self.waypoints)
-            for index, wp in enumerate(self.stop_line_waypoints):
-                if wp >= car_waypoint-NUM_WP_STOP_AFTER_STOPLINE and wp-car_waypoint < numel_ahead:
-                    light_wp = wp
-                    light_index = index
-                    numel_ahead = wp - car_waypoint
-
-            return light_index, light_wp
+            # first stop-line not further behind than NUM_WP_STOP_AFTER_STOPLINE, wraps around at the end
+            return self.stop_line_index.next_light(car_waypoint - NUM_WP_STOP_AFTER_STOPLINE)
 
     def ready(self):
         """ signals True if initialization is complete """
         if not self.is_ready:
             # check if all callbacks arrived
-            waypoints_okay = self.waypoints is not None and self.stop_line_waypoints is not None
+            waypoints_okay = self.track is not None and self.stop_line_waypoints is not None
             lights_okay = self.lights is not None
             pose_okay = self.car_waypoint is not None
             self.is_ready = waypoints_okay and lights_okay and pose_okay
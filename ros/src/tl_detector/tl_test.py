@@ -8,9 +8,8 @@ from sensor_msgs.msg import Image
 from styx_msgs.msg import TrafficLightArray, TrafficLight
 from cv_bridge import CvBridge
 from light_classification.tl_classifier import TLClassifier
+from frame_scheduler import FrameScheduler
 
-LIMIT_CAMERA_FPS = 5
-MAX_DUTY_CYCLE = 0.75
 IS_SITE = True
 
 class TrafficLightTestNode(object):
@@ -22,9 +21,7 @@ class TrafficLightTestNode(object):
 
         self.state = TrafficLight.UNKNOWN
         self.last_state = TrafficLight.UNKNOWN
-        self.last_frame = rospy.get_time()
-        self.last_finish = rospy.get_time()
-        self.busy = False
+        self.scheduler = FrameScheduler('tl_test', max_fps=5.0)
 
         self.has_image = False
         self.camera_image = None
@@ -55,34 +52,24 @@ class TrafficLightTestNode(object):
             msg (Image): image from car-mounted camera
 
         """
-        now = rospy.get_time()
         self.camera_image = msg
         self.has_image = msg is not None
 
-        if self.busy:
-            rospy.logwarn("traffic light detection: SKIP still busy with last frame")
+        if not self.scheduler.admit():
             return
-        elif now - self.last_frame < 1.0/LIMIT_CAMERA_FPS:
-            # limit camera frames to a reasonable level
-            return
-        elif now - self.last_finish < (1.0 - MAX_DUTY_CYCLE)/LIMIT_CAMERA_FPS:
-            rospy.logwarn("traffic light detection: SKIP duty above {}%".format(round(100*MAX_DUTY_CYCLE)))
-            return
-        else:
-            self.busy = True
-            self.last_frame = now
 
-        cv_image = self.bridge.imgmsg_to_cv2(self.camera_image, "rgb8")
+        try:
+            cv_image = self.bridge.imgmsg_to_cv2(self.camera_image, "rgb8")
 
-        img = PIL.Image.fromarray(cv_image)
-        self.k += 1
-        jpg_file = os.path.join(self.img_dir, "site_{:05d}.jpg".format(self.k))
+            img = PIL.Image.fromarray(cv_image)
+            self.k += 1
+            jpg_file = os.path.join(self.img_dir, "site_{:05d}.jpg".format(self.k))
 
-        img.save(jpg_file)
+            img.save(jpg_file)
 
-        state = self.light_classifier.get_classification(cv_image)
-        self.last_finish = rospy.get_time()
-        self.busy = False
+            state = self.light_classifier.get_classification(cv_image)
+        finally:
+            self.scheduler.finish()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+'''
+Offline batch simulator for tuning the longitudinal control of the dbw_node.
+
+Thousands of controller parameter sets are stepped in parallel as numpy arrays (one array element
+per candidate) over recorded speed profiles. Each candidate runs the same logic as dbw_node.py:
+velocity/acceleration low-pass filters, the rate limiter and PID controllers of Controller
+(torque_ctl or the velocity_ctr/acceleration_ctr cascade) and the throttle/brake/creeping logic.
+The plant is the longitudinal model of dbw_node.py:
+    m * a = (P_THROTTLE * throttle - P_BRAKE * brake) / r - D_RESIST * v
+
+Speed profiles are the v_des column of driving_log.csv files recorded by the dbw_node
+(RECORD_CSV = True), without a profile a synthetic start/cruise/stop cycle is used. Candidates
+are ranked by a weighted sum of the tracking error, the jerk and the brake usage, each
+normalized by the median over all candidates.
+
+    python batch_sim.py --torque-kp 300 400 500 600 --torque-ki 0 25 50 --jerk-max 5 10 \
+        --profile ../../../data/records/driving_log.csv --jobs 4
+'''
+
+import argparse
+import csv
+import itertools
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from batched import BatchLowPassFilter, BatchPID
+from twist_controller import ACCEL_LIMIT_TOL, GAS_DENSITY, JERK_MAX, JERK_MIN, RATE
+
+# vehicle and drive-by-wire parameters of dbw_sim.launch and dbw_node.py
+VEHICLE_MASS = 1080.
+FUEL_CAPACITY = 0.
+WHEEL_RADIUS = 0.335
+DECEL_LIMIT = -5.
+ACCEL_LIMIT = 1.
+P_THROTTLE = 2000.
+P_BRAKE = 1.0
+D_RESIST = 110.
+CREEPING_TORQUE = 800.
+BRAKE_DEADBAND_TORQUE = -300.
+
+# tunable parameters of one candidate and their defaults in twist_controller.py and dbw_node.py
+PARAMS = [('torque_kp', 500.), ('torque_ki', 50.), ('torque_kd', 3.),
+          ('velocity_kp', 3.0), ('velocity_ki', 0.24), ('acceleration_kp', 670.),
+          ('jerk_max', JERK_MAX), ('velocity_tau', 0.1), ('acceleration_tau', 0.1),
+          ('cascade', 0.)]
+PARAM_DTYPE = np.dtype([(name, '<f8') for name, _ in PARAMS])
+
+METRICS = ['rmse', 'max_error', 'jerk', 'brake']
+
+
+def load_profile(path, dt=1.0 / RATE):
+    """ desired velocity of a driving_log.csv of the dbw_node, resampled to the controller rate """
+    with open(path) as fid:
+        reader = csv.DictReader(fid)
+        rows = [(float(row['time']), float(row['v_des'])) for row in reader if row['v_des']]
+    t, v_des = np.array(rows).T
+    # logs can contain duplicate time stamps, keep the first sample of each
+    t, unique = np.unique(t, return_index=True)
+    return np.interp(np.arange(t[0], t[-1], dt), t, v_des[unique])
+
+
+def synthetic_profile(v_max=40 / 3.6, dt=1.0 / RATE):
+    """ standstill, cruise with a speed step, stop and standstill again """
+    segments = [(2.0, 0.), (20.0, v_max), (10.0, 0.5 * v_max), (15.0, v_max), (15.0, 0.)]
+    return np.concatenate([np.full(int(duration / dt), v) for duration, v in segments])
+
+
+def feasible_reference(profile, dt=1.0 / RATE):
+    """ the profile limited to the acceleration and deceleration limits, the tracking error is measured
+    against this reference instead of the (infeasible) steps of the raw profile """
+    reference = np.empty(len(profile))
+    v = 0.
+    for k, desired in enumerate(profile.tolist()):
+        v += min(max(desired - v, DECEL_LIMIT * dt), ACCEL_LIMIT * dt)
+        reference[k] = v
+    return reference
+
+
+def candidate_grid(values):
+    """ cartesian product of parameter values, names without values keep their default """
+    names = [name for name, _ in PARAMS]
+    axes = [values.get(name) or [default] for name, default in PARAMS]
+    grid = np.array(list(itertools.product(*axes)), dtype=np.float64)
+    candidates = np.zeros(len(grid), dtype=PARAM_DTYPE)
+    for i, name in enumerate(names):
+        candidates[name] = grid[:, i]
+    return candidates
+
+
+def simulate(candidates, profile, dt=1.0 / RATE):
+    """ run all candidates over one speed profile
+
+    Returns:
+        dict: metric name -> array with one value per candidate
+
+    """
+    n = len(candidates)
+    mass = VEHICLE_MASS + FUEL_CAPACITY * GAS_DENSITY
+    r = WHEEL_RADIUS
+    cascade = candidates['cascade'] > 0
+
+    torque_ctl = BatchPID(candidates['torque_kp'], candidates['torque_ki'], candidates['torque_kd'],
+                          DECEL_LIMIT * r * mass * 1.5, P_THROTTLE)
+    velocity_ctr = BatchPID(candidates['velocity_kp'], candidates['velocity_ki'], 0., DECEL_LIMIT, ACCEL_LIMIT)
+    acceleration_ctr = BatchPID(candidates['acceleration_kp'], 0., 0., -5.0, 1.0)
+    velocity_filt = BatchLowPassFilter(candidates['velocity_tau'], 1.0 / 50.0)
+    acceleration_filt = BatchLowPassFilter(candidates['acceleration_tau'], 1.0 / 50.0)
+    jerk_max = candidates['jerk_max']
+    jerk_min = np.minimum(JERK_MIN / JERK_MAX * jerk_max, 0.)
+
+    reference = feasible_reference(profile, dt)
+
+    v = np.zeros(n)  # true vehicle velocity
+    v_meas = None
+    a_true_old = np.zeros(n)
+    v_des_old = np.zeros(n)
+    a_des_old = np.zeros(n)
+
+    sum_sq_error = np.zeros(n)
+    max_error = np.zeros(n)
+    sum_sq_jerk = np.zeros(n)
+    brake_work = np.zeros(n)
+
+    for k, desired in enumerate(profile):
+        # measured velocity and its derivative as in dbw_node.py
+        v_meas_old = v_meas if v_meas is not None else np.zeros(n)
+        v_meas = velocity_filt.filt(v)
+        accel = acceleration_filt.filt((v_meas - v_meas_old) / dt) if k > 0 else np.zeros(n)
+
+        # rate limiter of the desired velocity
+        v_delta = np.clip(desired - v_des_old, DECEL_LIMIT * dt * ACCEL_LIMIT_TOL, ACCEL_LIMIT * dt * ACCEL_LIMIT_TOL)
+        v_des = v_des_old + v_delta
+        v_des_old = v_des
+
+        # first stage of controller B with jerk limit and saturation
+        a_des = velocity_ctr.step(v_des - v_meas, dt)
+        a_des = a_des_old + np.clip(a_des - a_des_old, jerk_min, jerk_max)
+        a_des = np.clip(a_des, velocity_ctr.min * dt, velocity_ctr.max * dt)
+        a_des_old = a_des
+
+        torque_a = torque_ctl.step(v_des - v_meas, dt)
+        torque_b = r * (mass * a_des + D_RESIST * v_meas) + acceleration_ctr.step(a_des - accel, dt)
+        torque = np.where(cascade, torque_b, torque_a)
+
+        # throttle, coasting deadband, creeping and brake logic of DBWNode.loop
+        throttle = np.where(torque > 0, torque / P_THROTTLE, 0.)
+        coasting = (torque <= 0) & (torque > BRAKE_DEADBAND_TORQUE)
+        stop_coasting = coasting & (desired <= 1.0)
+        stop_braking = (torque <= BRAKE_DEADBAND_TORQUE) & (desired <= 0.1) & (v_meas <= 1.0)
+        brake = np.where(torque <= BRAKE_DEADBAND_TORQUE, -torque / P_BRAKE, 0.)
+        standing = stop_coasting | stop_braking
+        brake[standing] = CREEPING_TORQUE
+
+        # reset controller when standing
+        if standing.any():
+            for controller in (torque_ctl, velocity_ctr, acceleration_ctr):
+                controller.reset(standing)
+            v_des_old = np.where(standing, 0., v_des_old)
+            a_des_old = np.where(standing, 0., a_des_old)
+
+        # longitudinal plant
+        force = (P_THROTTLE * throttle - P_BRAKE * brake) / r - D_RESIST * v
+        v_new = np.maximum(0., v + force / mass * dt)
+        a_true = (v_new - v) / dt
+        v = v_new
+
+        error = np.abs(v - reference[k])
+        sum_sq_error += error ** 2
+        np.maximum(max_error, error, out=max_error)
+        if k > 0:
+            sum_sq_jerk += ((a_true - a_true_old) / dt) ** 2
+        a_true_old = a_true
+        # creeping torque at standstill does not count as brake usage
+        brake_work += np.where(v > 0.1, brake, 0.) * dt
+
+    duration = len(profile) * dt
+    return {'rmse': np.sqrt(sum_sq_error / len(profile)),
+            'max_error': max_error,
+            'jerk': np.sqrt(sum_sq_jerk / max(len(profile) - 1, 1)),
+            'brake': brake_work / duration}
+
+
+def simulate_profiles(job):
+    """ average metrics of a chunk of candidates over all profiles, runs in a worker process """
+    candidates, profiles = job
+    results = [simulate(candidates, profile) for profile in profiles]
+    return {name: np.mean([result[name] for result in results], axis=0) for name in METRICS}
+
+
+def run_sweep(candidates, profiles, jobs=1, chunk_size=1000):
+    """ metrics of all candidates, chunks of candidates are simulated in a process pool """
+    chunks = [chunk for chunk in np.array_split(candidates, max(1, int(np.ceil(len(candidates) / float(chunk_size)))))]
+    work = [(chunk, profiles) for chunk in chunks]
+    if jobs > 1 and len(chunks) > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(simulate_profiles, work)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [simulate_profiles(job) for job in work]
+    return {name: np.concatenate([result[name] for result in results]) for name in METRICS}
+
+
+def rank(metrics, weights):
+    """ indexes of the candidates ordered by score (best first) and the scores """
+    score = np.zeros(len(metrics['rmse']))
+    for name, weight in weights.items():
+        if weight:
+            scale = np.median(metrics[name])
+            score += weight * metrics[name] / (scale if scale > 0 else 1.)
+    return np.argsort(score, kind='mergesort'), score
+
+
+def write_results(path, candidates, metrics, score):
+    with open(path, 'w') as fid:
+        writer = csv.writer(fid)
+        writer.writerow(list(PARAM_DTYPE.names) + METRICS + ['score'])
+        for i in np.argsort(score, kind='mergesort'):
+            writer.writerow([candidates[name][i] for name in PARAM_DTYPE.names] +
+                            [metrics[name][i] for name in METRICS] + [score[i]])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='offline parameter sweep of the dbw_node controller')
+    for name, default in PARAMS:
+        parser.add_argument('--' + name.replace('_', '-'), type=float, nargs='+',
+                            help='values to sweep (default {})'.format(default))
+    parser.add_argument('--profile', action='append', default=[], help='driving_log.csv with a v_des column')
+    parser.add_argument('--jobs', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=1000, help='candidates per worker task')
+    parser.add_argument('--w-error', type=float, default=1.0, help='weight of the tracking error')
+    parser.add_argument('--w-jerk', type=float, default=0.5, help='weight of the jerk')
+    parser.add_argument('--w-brake', type=float, default=0.2, help='weight of the brake usage')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--output', help='csv file with all candidates, best first')
+    args = parser.parse_args()
+
+    candidates = candidate_grid({name: getattr(args, name) for name, _ in PARAMS})
+    profiles = [load_profile(path) for path in args.profile] or [synthetic_profile()]
+    num_steps = sum(len(profile) for profile in profiles)
+    print("{} candidates over {} profiles ({:.0f}s of driving)".format(len(candidates), len(profiles),
+                                                                        num_steps / RATE))
+
+    start = time.time()
+    metrics = run_sweep(candidates, profiles, args.jobs, args.chunk_size)
+    elapsed = time.time() - start
+    print("simulated in {:.2f}s ({:.0f} candidate-seconds of driving per second)".format(
+        elapsed, len(candidates) * num_steps / RATE / max(elapsed, 1e-9)))
+
+    order, score = rank(metrics, {'rmse': args.w_error, 'jerk': args.w_jerk, 'brake': args.w_brake})
+    # only the swept parameters are shown
+    swept = [name for name in PARAM_DTYPE.names if len(np.unique(candidates[name])) > 1]
+    sys.stdout.write("{:>5s}".format('rank') + ''.join("{:>17s}".format(name) for name in swept) +
+                     ''.join("{:>11s}".format(name) for name in METRICS + ['score']) + '\n')
+    for n, i in enumerate(order[:args.top]):
+        sys.stdout.write("{:5d}".format(n + 1) + ''.join("{:17.4g}".format(candidates[name][i]) for name in swept) +
+                         ''.join("{:11.4g}".format(metrics[name][i]) for name in METRICS) +
+                         "{:11.4g}".format(score[i]) + '\n')
+
+    if args.output:
+        write_results(args.output, candidates, metrics, score)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+'''
+Array-backed counterparts of PID, LowPassFilter and YawController.
+
+Each object advances N independent instances per call. Gains, limits and time constants may be
+scalars (shared by all instances) or arrays with one value per instance. The semantics are the
+ones of the scalar classes: integrator clamping of pid.py, the ready flag of lowpass.py and the
+yaw-rate limiting by max_lat_accel of yaw_controller.py. reset() takes an optional boolean mask to
+reset only some of the instances.
+
+Running this file checks the batched versions against the scalar ones:
+
+    python batched.py
+'''
+
+import numpy as np
+
+
+class BatchPID(object):
+    def __init__(self, kp, ki, kd, mn=-np.inf, mx=np.inf, n=None):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.min = mn
+        self.max = mx
+
+        shape = np.broadcast(kp, ki, kd, mn, mx).shape if n is None else (n,)
+        self.int_val = np.zeros(shape)
+        self.last_error = np.zeros(shape)
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = slice(None)
+        self.int_val[mask] = 0.0
+        self.last_error[mask] = 0.0
+
+    def step(self, error, sample_time):
+        integral = self.int_val + error * sample_time
+        derivative = (error - self.last_error) / sample_time
+
+        val = self.kp * error + self.ki * integral + self.kd * derivative
+
+        # clip output value to actor-bounds
+        val = np.minimum(self.max, np.maximum(self.min, val))
+
+        # proper saturation of integrator, stop integration if clamping is active
+        integrate = (self.ki > 0) & (val > self.min) & (val < self.max)
+        self.int_val = np.where(integrate, integral, self.int_val)
+
+        # update current error
+        self.last_error[...] = error
+
+        return val
+
+
+class BatchLowPassFilter(object):
+    def __init__(self, tau, ts, n=None):
+        self.a = 1. / (tau / ts + 1.)
+        self.b = tau / ts / (tau / ts + 1.)
+
+        shape = np.broadcast(tau, ts).shape if n is None else (n,)
+        self.last_val = np.zeros(shape)
+        self.ready = np.zeros(shape, dtype=bool)
+
+    def get(self):
+        return self.last_val
+
+    def filt(self, val):
+        val = np.where(self.ready, self.a * val + self.b * self.last_val, val)
+        self.ready[:] = True
+
+        self.last_val = val
+        return val
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = slice(None)
+        self.ready[mask] = False
+
+
+class BatchYawController(object):
+    def __init__(self, wheel_base, steer_ratio, min_speed, max_lat_accel, max_steer_angle):
+        self.wheel_base = wheel_base
+        self.steer_ratio = steer_ratio
+        self.min_speed = min_speed
+        self.max_lat_accel = max_lat_accel
+
+        self.min_angle = -max_steer_angle
+        self.max_angle = max_steer_angle
+
+    def get_angle(self, radius):
+        angle = np.arctan(self.wheel_base / radius) * self.steer_ratio
+        return np.maximum(self.min_angle, np.minimum(self.max_angle, angle))
+
+    def get_steering(self, linear_velocity, angular_velocity, current_velocity):
+        linear_velocity, angular_velocity, current_velocity = np.broadcast_arrays(
+            np.asarray(linear_velocity, dtype=np.float64), np.asarray(angular_velocity, dtype=np.float64),
+            np.asarray(current_velocity, dtype=np.float64))
+
+        # divisions are only evaluated where the scalar version evaluates them
+        moving = np.abs(linear_velocity) > 0.
+        angular_velocity = np.where(moving, current_velocity * angular_velocity /
+                                    np.where(moving, linear_velocity, 1.), 0.)
+
+        limited = np.abs(current_velocity) > 0.1
+        max_yaw_rate = np.abs(self.max_lat_accel / np.where(limited, current_velocity, 1.))
+        angular_velocity = np.where(limited, np.maximum(-max_yaw_rate, np.minimum(max_yaw_rate, angular_velocity)),
+                                    angular_velocity)
+
+        turning = np.abs(angular_velocity) > 0.
+        radius = np.maximum(current_velocity, self.min_speed) / np.where(turning, angular_velocity, 1.)
+        return np.where(turning, self.get_angle(radius), 0.0)
+
+
+def check_conformance(n=64, steps=500, seed=0):
+    """ step random instances of the scalar and the batched classes side by side """
+    from lowpass import LowPassFilter
+    from pid import PID
+    from yaw_controller import YawController
+
+    rng = np.random.RandomState(seed)
+    dt = 1.0 / 50.0
+
+    # PID with per-instance gains and limits, some without integral part
+    kp = rng.uniform(0., 5., n)
+    ki = np.where(rng.rand(n) < 0.3, 0., rng.uniform(0., 2., n))
+    kd = rng.uniform(0., 0.5, n)
+    mn = rng.uniform(-5., -0.5, n)
+    mx = rng.uniform(0.5, 5., n)
+    pids = [PID(kp[i], ki[i], kd[i], mn[i], mx[i]) for i in range(n)]
+    batch_pid = BatchPID(kp, ki, kd, mn, mx)
+
+    tau = rng.uniform(0.01, 1.0, n)
+    filters = [LowPassFilter(tau[i], dt) for i in range(n)]
+    batch_filter = BatchLowPassFilter(tau, dt)
+
+    for k in range(steps):
+        error = rng.normal(0., 3., n)
+        reset = rng.rand(n) < 0.02
+
+        expected = np.array([pid.step(error[i], dt) for i, pid in enumerate(pids)])
+        np.testing.assert_allclose(batch_pid.step(error, dt), expected, rtol=1e-12, atol=1e-12)
+        for i in np.flatnonzero(reset):
+            pids[i].reset()
+        batch_pid.reset(reset)
+
+        expected = np.array([lpf.filt(error[i]) for i, lpf in enumerate(filters)])
+        np.testing.assert_allclose(batch_filter.filt(error), expected, rtol=1e-12, atol=1e-12)
+        for i in np.flatnonzero(reset):
+            filters[i].reset()
+        batch_filter.reset(reset)
+        np.testing.assert_array_equal(batch_filter.ready, [lpf.ready for lpf in filters])
+
+    # yaw controller, including zero velocities and the yaw-rate limit
+    params = (2.8498, 14.8, 0.1, 3., 8.)
+    yaw = YawController(*params)
+    batch_yaw = BatchYawController(*params)
+    linear = np.where(rng.rand(steps) < 0.1, 0., rng.uniform(-2., 30., steps))
+    angular = np.where(rng.rand(steps) < 0.1, 0., rng.normal(0., 1., steps))
+    current = np.where(rng.rand(steps) < 0.1, 0., rng.uniform(-1., 30., steps))
+    expected = [yaw.get_steering(linear[i], angular[i], current[i]) for i in range(steps)]
+    np.testing.assert_allclose(batch_yaw.get_steering(linear, angular, current), expected, rtol=1e-12, atol=1e-12)
+
+
+if __name__ == '__main__':
+    check_conformance()
+    print("batched PID, LowPassFilter and YawController conform to the scalar versions")
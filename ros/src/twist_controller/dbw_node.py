@@ -1,15 +1,24 @@
 #!/usr/bin/env python
 
 import rospy
+import rospkg
 from std_msgs.msg import Bool, Float32
 from dbw_mkz_msgs.msg import ThrottleCmd, SteeringCmd, BrakeCmd, SteeringReport
 from geometry_msgs.msg import TwistStamped, PoseStamped
+from styx_msgs.msg import TraceContext
 from lowpass import LowPassFilter
+from loop_monitor import LoopMonitor
+from rt_config import configure_from_params
 import csv
 import os
+import sys
+import threading
 
 from twist_controller import Controller
 
+sys.path.append(rospkg.RosPack().get_path('styx'))
+from latency_trace import extend
+
 '''
 You can build this node only after you have built (or partially built) the `waypoint_updater` node.
 
@@ -40,11 +49,15 @@ CREEPING_TORQUE = 800  # minimum braking torque during standstill (avoid creepin
 P_THROTTLE = 2000  # engine power factor [Nm/1]: torque = P_THROTTLE * throttle
 D_RESIST = 110  # velocity dependant resistance [N/(m/s)]
 P_BRAKE = 1.0  # brake factor [Nm/Nm]
+MAX_PENDING_TRACES = 50  # latency traces waiting for a twist_cmd or an actuation, older ones are dropped
 
 class DBWNode(object):
     def __init__(self):
         rospy.init_node('dbw_node')
 
+        # cpu affinity and scheduling of the control loop, see rt_config.py
+        configure_from_params('dbw_node')
+
         vehicle_mass = rospy.get_param('~vehicle_mass', 1736.35)
         fuel_capacity = rospy.get_param('~fuel_capacity', 13.5)
         brake_deadband = rospy.get_param('~brake_deadband', .1)
@@ -56,6 +69,11 @@ class DBWNode(object):
         max_lat_accel = rospy.get_param('~max_lat_accel', 3.)
         max_steer_angle = rospy.get_param('~max_steer_angle', 8.)
 
+        # longitudinal vehicle model, identified with data/system_ident.py (vehicle_model launch arg)
+        self.p_throttle = rospy.get_param('~p_throttle', P_THROTTLE)
+        self.d_resist = rospy.get_param('~d_resist', D_RESIST)
+        self.p_brake = rospy.get_param('~p_brake', P_BRAKE)
+
         self.decel_limit = decel_limit
         self.accel_limit = accel_limit
 
@@ -73,11 +91,15 @@ class DBWNode(object):
         rospy.loginfo("DriveByWire with Feed Forward Control: mass={}kg and wheel_radius={}m".format(
             self.mass, self.wheel_radius
         ))
+        rospy.loginfo("vehicle model: p_throttle={}Nm, d_resist={}N/(m/s), p_brake={}".format(
+            self.p_throttle, self.d_resist, self.p_brake
+        ))
 
         # Create controller object
         min_speed = 0.1
         self.controller = Controller(wheel_base, steer_ratio, min_speed, max_lat_accel, max_steer_angle,
-                                     decel_limit, accel_limit, wheel_radius, self.mass, P_THROTTLE, P_BRAKE, D_RESIST)
+                                     decel_limit, accel_limit, wheel_radius, self.mass, self.p_throttle, self.p_brake,
+                                     self.d_resist)
 
         # optional logging to a csv-file
         self.csv_fields = ['time', 'x', 'y', 'v_raw', 'v', 'v_d', 'a', 'v_des', 'v_d_des', 'a_des', 'throttle',
@@ -108,6 +130,14 @@ class DBWNode(object):
         rospy.Subscriber('/current_velocity', TwistStamped, self.current_velocity_callback, queue_size=2)
         rospy.Subscriber('/vehicle/dbw_enabled', Bool, self.dbw_enabled_callback, queue_size=1)
 
+        # latency traces of the trajectories (see styx/latency_trace.py), pure_pursuit does not propagate
+        # them: a trace is associated with the first twist_cmd stamped after it and the next actuation
+        self.trace_lock = threading.Lock()
+        self.traces_to_twist = []
+        self.traces_to_actuation = []
+        self.trace_pub = rospy.Publisher('/trace/actuation', TraceContext, queue_size=10)
+        rospy.Subscriber('/trace/final_waypoints', TraceContext, self.trace_callback, queue_size=10)
+
         # lowpass filter
         self.velocity_filt = LowPassFilter(0.1, 1.0/50.0)
         self.acceleration_filt = LowPassFilter(0.1, 1.0 / 50.0)
@@ -128,6 +158,10 @@ class DBWNode(object):
         self.dbw_ready = False
         self.acc_ready = False
 
+        # timing of the control loop: compute time, wakeup jitter and missed deadlines
+        self.loop_monitor = LoopMonitor('dbw_node', 50., rospy.get_param('~jitter_warn_ms', 5.0) / 1000.,
+                                        rospy.get_param('~loop_monitor_period', 5.0), startup_cycles=250)
+
         self.loop()
 
     def pose_callback(self, msg):
@@ -156,6 +190,22 @@ class DBWNode(object):
         if RECORD_CSV:
             self.csv_data['a_des'] = self.desired_angular_velocity
 
+        with self.trace_lock:
+            # traces of the trajectories pure_pursuit had when computing this twist
+            waiting = []
+            for trace in self.traces_to_twist:
+                if trace.header.stamp <= data.header.stamp:
+                    self.traces_to_actuation.append(extend(trace, 'pure_pursuit', data.header.stamp))
+                else:
+                    waiting.append(trace)
+            self.traces_to_twist = waiting
+            del self.traces_to_actuation[:-MAX_PENDING_TRACES]
+
+    def trace_callback(self, trace):
+        with self.trace_lock:
+            self.traces_to_twist.append(trace)
+            del self.traces_to_twist[:-MAX_PENDING_TRACES]
+
     def current_velocity_callback(self, data):
         # callback of current vehicle velocities
         if self.current_linear_velocity is not None:
@@ -182,6 +232,7 @@ class DBWNode(object):
         rate = rospy.Rate(50)  # Carla wants 50Hz
 
         while not rospy.is_shutdown():
+            self.loop_monitor.begin()
             now = rospy.get_time()
 
             if self.acceleration_calc_ready():
@@ -202,7 +253,7 @@ class DBWNode(object):
                 if total_wheel_torque > 0:
                     # accelerate or coast along at constant speed
                     brake = 0.0
-                    throttle = total_wheel_torque/P_THROTTLE
+                    throttle = total_wheel_torque/self.p_throttle
 
                 elif total_wheel_torque > -300: # -self.brake_deadband*P_THROTTLE:
                     # a small deadband to avoid braking while coasting
@@ -225,7 +276,7 @@ class DBWNode(object):
                         self.controller.reset()
                     else:
                         # mass * acceleration = force | force = torque / radius
-                        brake = - total_wheel_torque/P_BRAKE
+                        brake = - total_wheel_torque/self.p_brake
 
                     throttle = 0.0
 
@@ -253,6 +304,7 @@ class DBWNode(object):
                     self.csv_writer.writerow(self.csv_data)
 
             self.last_loop = now
+            self.loop_monitor.end()
             rate.sleep()
 
         if RECORD_CSV:
@@ -297,6 +349,13 @@ class DBWNode(object):
         bcmd.pedal_cmd = brake
         self.brake_pub.publish(bcmd)
 
+        with self.trace_lock:
+            traces, self.traces_to_actuation = self.traces_to_actuation, []
+        if traces:
+            now = rospy.Time.now()
+            for trace in traces:
+                self.trace_pub.publish(extend(trace, 'dbw_node', now))
+
 
 if __name__ == '__main__':
     DBWNode()
@@ -2,10 +2,19 @@
 
 import os
 import csv
+import sys
+import threading
 
 import rospy
+import rospkg
 from std_msgs.msg import Bool
 from dbw_mkz_msgs.msg import ThrottleCmd, SteeringCmd, BrakeCmd, SteeringReport
+from diagnostic_msgs.msg import DiagnosticArray
+
+from stream_stats import ChannelStats
+
+sys.path.append(rospkg.RosPack().get_path('styx'))
+from diagnostics import diagnostic_array, diagnostic_status
 
 
 '''
@@ -16,8 +25,10 @@ To use the downloaded bag file, rename it to 'dbw_test.rosbag.bag' and place it
 Then with roscore running, you can then use roslaunch with the dbw_test.launch file found in 
 <project_repo>/ros/src/twist_controller/launch.
 
-This file will produce 3 csv files which you can process to figure out how your DBW node is
-performing on various commands.
+While the bag is playing, error statistics of each channel (RMSE, max error, error percentiles
+and the lag of the best cross-correlation) are published periodically on /diagnostics and logged.
+Optionally (~write_csv) the paired samples are appended to 3 csv files which you can process to
+figure out how your DBW node is performing on various commands.
 
 `/actual/*` are commands from the recorded bag while `/vehicle/*` are the output of your node.
 
@@ -40,39 +51,73 @@ class DBWTestNode(object):
 
         self.steer = self.throttle = self.brake = None
 
-        self.steer_data = []
-        self.throttle_data = []
-        self.brake_data = []
-
         self.dbw_enabled = False
 
-        base_path = os.path.dirname(os.path.abspath(__file__))
-        self.steerfile = os.path.join(base_path, 'steers.csv')
-        self.throttlefile = os.path.join(base_path, 'throttles.csv')
-        self.brakefile = os.path.join(base_path, 'brakes.csv')
+        # streaming statistics per channel, memory does not grow with the bag length
+        max_lag = rospy.get_param('~max_lag', 25)
+        self.channels = ['steer', 'throttle', 'brake']
+        self.stats = {channel: ChannelStats(max_lag) for channel in self.channels}
+        self.lock = threading.Lock()  # callbacks and the loop run in different threads
+        self.publish_period = rospy.get_param('~publish_period', 2.0)
+        self.stats_pub = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size=1)
+
+        # paired samples are appended to the csv files as they arrive
+        self.writers = {}
+        self.files = []
+        if rospy.get_param('~write_csv', True):
+            base_path = rospy.get_param('~output_dir', os.path.dirname(os.path.abspath(__file__)))
+            for channel in self.channels:
+                fid = open(os.path.join(base_path, channel + 's.csv'), 'w')
+                writer = csv.DictWriter(fid, fieldnames=['actual', 'proposed'])
+                writer.writeheader()
+                self.files.append(fid)
+                self.writers[channel] = writer
 
         self.loop()
 
     def loop(self):
         rate = rospy.Rate(10) # 10Hz
+        last_publish = rospy.get_time()
         while not rospy.is_shutdown():
             rate.sleep()
-        fieldnames = ['actual', 'proposed']
-
-        with open(self.steerfile, 'w') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(self.steer_data)
-
-        with open(self.throttlefile, 'w') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(self.throttle_data)
-
-        with open(self.brakefile, 'w') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(self.brake_data)
+            now = rospy.get_time()
+            if now - last_publish >= self.publish_period:
+                last_publish = now
+                self.publish_stats()
+                with self.lock:
+                    for fid in self.files:
+                        fid.flush()
+
+        with self.lock:
+            for fid in self.files:
+                fid.close()
+            self.writers = {}
+        self.log_stats(self.summaries())
+
+    def add_sample(self, channel, actual, proposed):
+        with self.lock:
+            self.stats[channel].add(actual, proposed)
+            if channel in self.writers:
+                self.writers[channel].writerow({'actual': actual, 'proposed': proposed})
+
+    def summaries(self):
+        with self.lock:
+            return {channel: self.stats[channel].summary() for channel in self.channels}
+
+    def publish_stats(self):
+        summaries = self.summaries()
+        self.stats_pub.publish(diagnostic_array([diagnostic_status("dbw_test: {}".format(channel), 'dbw_test',
+                                                                   summaries[channel])
+                                                 for channel in self.channels]))
+        self.log_stats(summaries)
+
+    def log_stats(self, summaries):
+        for channel in self.channels:
+            summary = summaries[channel]
+            rospy.loginfo("%-8s n=%d rmse=%.4f max=%.4f p50=%.4f p90=%.4f p99=%.4f lag=%d (r=%.3f)", channel,
+                          summary['count'], summary['rmse'], summary['max_error'], summary['p50_error'],
+                          summary['p90_error'], summary['p99_error'], summary['best_lag'],
+                          summary['best_lag_correlation'])
 
     def dbw_enabled_cb(self, msg):
         self.dbw_enabled = msg.data
@@ -88,20 +133,17 @@ class DBWTestNode(object):
 
     def actual_steer_cb(self, msg):
         if self.dbw_enabled and self.steer is not None:
-            self.steer_data.append({'actual': msg.steering_wheel_angle_cmd,
-                                    'proposed': self.steer})
+            self.add_sample('steer', msg.steering_wheel_angle_cmd, self.steer)
             self.steer = None
 
     def actual_throttle_cb(self, msg):
         if self.dbw_enabled and self.throttle is not None:
-            self.throttle_data.append({'actual': msg.pedal_cmd,
-                                       'proposed': self.throttle})
+            self.add_sample('throttle', msg.pedal_cmd, self.throttle)
             self.throttle = None
 
     def actual_brake_cb(self, msg):
         if self.dbw_enabled and self.brake is not None:
-            self.brake_data.append({'actual': msg.pedal_cmd,
-                                    'proposed': self.brake})
+            self.add_sample('brake', msg.pedal_cmd, self.brake)
             self.brake = None
 
 
@@ -0,0 +1,129 @@
+'''
+Timing monitor of a fixed-rate control loop.
+
+Per cycle the wakeup jitter (deviation of the time between two wakeups from the period), the
+compute time (wakeup to end of the cycle work) and missed deadlines (jitter + compute time beyond
+the period) are written to a preallocated ring buffer. A summary of the buffer is published
+periodically as diagnostic_msgs/DiagnosticArray on /diagnostics, with level WARN when the p99
+jitter exceeds the configured bound.
+
+    monitor = LoopMonitor('dbw_node', 50.)
+    while not rospy.is_shutdown():
+        monitor.begin()
+        ...
+        monitor.end()
+        rate.sleep()
+'''
+
+import sys
+import time
+
+import numpy as np
+import rospkg
+import rospy
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus
+
+sys.path.append(rospkg.RosPack().get_path('styx'))
+from diagnostics import diagnostic_array, diagnostic_status
+
+
+class LoopMonitor(object):
+    def __init__(self, name, rate, jitter_warn=0.005, publish_period=5.0, size=1000, startup_cycles=None):
+        """
+        Args:
+            name (str): name of the loop in the diagnostics
+            rate (float): nominal loop rate [Hz]
+            jitter_warn (float): bound of the p99 wakeup jitter [s], exceeding it is reported
+            publish_period (float): time between two summaries [s], 0 disables publishing
+            size (int): number of cycles kept in the ring buffer
+            startup_cycles (int): the achieved timing is logged once after this number of cycles
+
+        """
+        self.name = name
+        self.period = 1.0 / rate
+        self.jitter_warn = jitter_warn
+        self.publish_period = publish_period
+        self.startup_cycles = startup_cycles
+
+        self.jitter = np.zeros(size)
+        self.compute = np.zeros(size)
+        self.index = 0
+        self.count = 0
+
+        # totals since start
+        self.cycles = 0
+        self.overruns = 0  # compute time longer than the period
+        self.missed = 0  # cycle finished after its deadline
+
+        self.start = None
+        self.last_wakeup = None
+        self.last_publish = time.time()
+        self.pub = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size=1) if publish_period > 0 else None
+
+    def begin(self):
+        """ to be called right after waking up """
+        now = time.time()
+        self.start = now
+        self.jitter[self.index] = now - self.last_wakeup - self.period if self.last_wakeup is not None else 0.
+        self.last_wakeup = now
+
+    def end(self):
+        """ to be called when the work of the cycle is done, before going to sleep """
+        if self.start is None:
+            return
+        now = time.time()
+        compute = now - self.start
+        self.compute[self.index] = compute
+
+        self.cycles += 1
+        if compute > self.period:
+            self.overruns += 1
+        if max(self.jitter[self.index], 0.) + compute > self.period:
+            self.missed += 1
+
+        self.index = (self.index + 1) % len(self.compute)
+        self.count = min(self.count + 1, len(self.compute))
+        self.start = None
+
+        if self.cycles == self.startup_cycles:
+            summary = self.summary()
+            rospy.loginfo("%s: loop timing after %d cycles: jitter p50 %.2fms p99 %.2fms, compute p99 %.2fms, "
+                          "%d missed deadlines", self.name, self.cycles, 1000. * summary['jitter_p50'],
+                          1000. * summary['jitter_p99'], 1000. * summary['compute_p99'], summary['missed_deadlines'])
+
+        if self.pub is not None and now - self.last_publish >= self.publish_period:
+            self.last_publish = now
+            self.publish()
+
+    def summary(self):
+        """ statistics of the cycles in the ring buffer [s] and the totals since start """
+        jitter = np.abs(self.jitter[:self.count])
+        compute = self.compute[:self.count]
+        if self.count == 0:
+            jitter = compute = np.zeros(1)
+        jitter_p50, jitter_p99 = np.percentile(jitter, [50, 99])
+        compute_p50, compute_p99 = np.percentile(compute, [50, 99])
+        return {'cycles': self.cycles,
+                'overruns': self.overruns,
+                'missed_deadlines': self.missed,
+                'jitter_p50': jitter_p50,
+                'jitter_p99': jitter_p99,
+                'jitter_max': float(jitter.max()),
+                'compute_p50': compute_p50,
+                'compute_p99': compute_p99,
+                'compute_max': float(compute.max())}
+
+    def publish(self):
+        summary = self.summary()
+
+        if summary['jitter_p99'] > self.jitter_warn:
+            level = DiagnosticStatus.WARN
+            message = "p99 jitter {:.1f}ms exceeds {:.1f}ms".format(1000. * summary['jitter_p99'],
+                                                                    1000. * self.jitter_warn)
+            rospy.logwarn("%s: %s, %d missed deadlines", self.name, message, summary['missed_deadlines'])
+        else:
+            level = DiagnosticStatus.OK
+            message = "{:.0f}Hz loop met".format(1. / self.period)
+
+        self.pub.publish(diagnostic_array([diagnostic_status("{}: control loop".format(self.name), self.name,
+                                                             summary, level, message)]))
@@ -0,0 +1,119 @@
+'''
+CPU affinity, scheduling policy and nice level of a node process.
+
+The settings are read from private parameters of the node and applied to the whole process
+(all threads started afterwards inherit them):
+
+    ~cpu_affinity    cpus the node may run on, e.g. "2,3" or "2-3" (empty = no change)
+    ~sched_policy    "other", "batch", "idle", "fifo" or "rr" (empty = no change)
+    ~sched_priority  real-time priority 1..99 for "fifo" and "rr"
+    ~nice            nice increment (0 = no change)
+
+Real-time policies need CAP_SYS_NICE (or an rtprio limit), failures are reported and the node
+keeps running with its current settings. With Python 2 only the nice level can be changed from
+within the process, use the launch-prefix of the launch files instead (taskset, chrt).
+The applied settings are read back from /proc and reported at startup. Other packages import
+this module with
+
+    sys.path.append(rospkg.RosPack().get_path('twist_controller'))
+    from rt_config import configure_from_params
+'''
+
+import os
+
+import rospy
+
+POLICIES = {'other': 0, 'fifo': 1, 'rr': 2, 'batch': 3, 'idle': 5}
+POLICY_NAMES = {value: name for name, value in POLICIES.items()}
+
+
+def parse_cpus(value):
+    """ set of cpus of a list or a string like "0,2-3" """
+    if isinstance(value, (list, tuple)):
+        return set(int(cpu) for cpu in value)
+    cpus = set()
+    for part in str(value).replace(' ', '').split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def apply_rt_config(cpu_affinity=None, sched_policy=None, sched_priority=0, nice=0):
+    """ apply the settings to the current process
+
+    Returns:
+        list: error messages of the settings that could not be applied
+
+    """
+    errors = []
+
+    # cpu 0 is a valid affinity, only None, empty strings and empty lists mean no change
+    if cpu_affinity is not None and (len(cpu_affinity) if isinstance(cpu_affinity, (list, tuple))
+                                     else str(cpu_affinity).strip()):
+        if hasattr(os, 'sched_setaffinity'):
+            try:
+                os.sched_setaffinity(0, parse_cpus(cpu_affinity))
+            except (OSError, ValueError) as e:
+                errors.append("cpu affinity {}: {}".format(cpu_affinity, e))
+        else:
+            errors.append("cpu affinity is not supported by this python, use launch-prefix 'taskset -c'")
+
+    if sched_policy:
+        if sched_policy not in POLICIES:
+            errors.append("unknown scheduling policy {}".format(sched_policy))
+        elif hasattr(os, 'sched_setscheduler'):
+            priority = sched_priority if sched_policy in ('fifo', 'rr') else 0
+            try:
+                os.sched_setscheduler(0, POLICIES[sched_policy], os.sched_param(priority))
+            except (OSError, ValueError) as e:
+                errors.append("scheduling policy {} priority {}: {}".format(sched_policy, priority, e))
+        else:
+            errors.append("scheduling policies are not supported by this python, use launch-prefix 'chrt'")
+
+    if nice:
+        try:
+            os.nice(nice)
+        except OSError as e:
+            errors.append("nice {}: {}".format(nice, e))
+
+    return errors
+
+
+def current_rt_config():
+    """ affinity, policy, real-time priority and nice level of the current process as seen by the kernel """
+    config = {}
+    try:
+        with open('/proc/self/status') as fid:
+            for line in fid:
+                if line.startswith('Cpus_allowed_list:'):
+                    config['cpus'] = line.split(':', 1)[1].strip()
+                elif line.startswith('Threads:'):
+                    config['threads'] = int(line.split(':', 1)[1])
+        with open('/proc/self/stat') as fid:
+            stat = fid.read()
+        # fields after the command name, nice is field 19, rt_priority 40 and policy 41 of stat
+        fields = stat[stat.rfind(')') + 2:].split()
+        config['nice'] = int(fields[16])
+        config['rt_priority'] = int(fields[37])
+        config['policy'] = POLICY_NAMES.get(int(fields[38]), fields[38])
+    except (IOError, IndexError, ValueError):
+        pass
+    return config
+
+
+def configure_from_params(name):
+    """ apply the settings of the private parameters of the node and report the result """
+    errors = apply_rt_config(rospy.get_param('~cpu_affinity', ''), rospy.get_param('~sched_policy', ''),
+                             rospy.get_param('~sched_priority', 0), rospy.get_param('~nice', 0))
+    for error in errors:
+        rospy.logwarn("%s: %s", name, error)
+
+    config = current_rt_config()
+    rospy.loginfo("%s: cpus %s, policy %s, rt priority %s, nice %s", name, config.get('cpus', '?'),
+                  config.get('policy', '?'), config.get('rt_priority', '?'), config.get('nice', '?'))
+    return config
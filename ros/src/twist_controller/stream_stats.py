@@ -0,0 +1,133 @@
+'''
+Constant-memory statistics of the error between a proposed and a reference signal.
+
+ChannelStats keeps running sums for the RMSE and the mean error, the maximum error, a
+logarithmic sketch of the absolute error for percentiles (relative accuracy ALPHA) and the
+cross-correlation of both signals for lags of up to max_lag samples. Memory does not grow with
+the number of samples.
+'''
+
+import math
+
+import numpy as np
+
+ALPHA = 0.01  # relative accuracy of the percentiles
+MIN_ERROR = 1e-9  # smaller absolute errors count as zero
+
+
+class ErrorSketch(object):
+    """ logarithmic histogram of non-negative values, percentiles within a relative error of alpha """
+    def __init__(self, alpha=ALPHA):
+        self.gamma = (1. + alpha) / (1. - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value < MIN_ERROR:
+            self.zeros += 1
+        else:
+            key = int(math.ceil(math.log(value) / self.log_gamma))
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.
+        rank = p / 100. * (self.count - 1)
+        cumulative = self.zeros
+        if cumulative > rank:
+            return 0.
+        for key in sorted(self.buckets):
+            cumulative += self.buckets[key]
+            if cumulative > rank:
+                # center of the bucket (gamma^(key-1), gamma^key]
+                return 2. * self.gamma ** key / (self.gamma + 1.)
+        return 2. * self.gamma ** max(self.buckets) / (self.gamma + 1.)
+
+
+class LagCorrelation(object):
+    """ running cross-correlation of reference[t] and proposed[t - lag] for lag in -max_lag..max_lag """
+    def __init__(self, max_lag=25):
+        self.max_lag = max_lag
+        # most recent samples first
+        self.reference = np.zeros(max_lag + 1)
+        self.proposed = np.zeros(max_lag + 1)
+        # products reference[t] * proposed[t - k] and proposed[t] * reference[t - k] for k = 0..max_lag
+        self.sum_rp = np.zeros(max_lag + 1)
+        self.sum_pr = np.zeros(max_lag + 1)
+        self.count = 0
+        self.sum_r = self.sum_p = self.sum_rr = self.sum_pp = 0.
+
+    def add(self, reference, proposed):
+        self.reference[1:] = self.reference[:-1]
+        self.reference[0] = reference
+        self.proposed[1:] = self.proposed[:-1]
+        self.proposed[0] = proposed
+        self.count += 1
+
+        # only lags with a full history contribute
+        valid = min(self.count, self.max_lag + 1)
+        self.sum_rp[:valid] += reference * self.proposed[:valid]
+        self.sum_pr[:valid] += proposed * self.reference[:valid]
+
+        self.sum_r += reference
+        self.sum_p += proposed
+        self.sum_rr += reference * reference
+        self.sum_pp += proposed * proposed
+
+    def correlation(self):
+        """ lags (positive = proposed lags behind the reference) and correlation coefficients """
+        lags = np.arange(-self.max_lag, self.max_lag + 1)
+        if self.count < 2:
+            return lags, np.zeros(len(lags))
+
+        n = self.count
+        mean_r, mean_p = self.sum_r / n, self.sum_p / n
+        std = math.sqrt(max(self.sum_rr / n - mean_r ** 2, 0.) * max(self.sum_pp / n - mean_p ** 2, 0.))
+        if std == 0.:
+            return lags, np.zeros(len(lags))
+
+        pairs = np.maximum(n - np.arange(self.max_lag + 1), 1)
+        # positive lag k: reference[t - k] matches proposed[t]
+        positive = (self.sum_pr / pairs - mean_r * mean_p) / std
+        negative = (self.sum_rp / pairs - mean_r * mean_p) / std
+        return lags, np.concatenate((negative[:0:-1], positive))
+
+    def best_lag(self):
+        lags, corr = self.correlation()
+        i = int(np.argmax(corr))
+        return int(lags[i]), float(corr[i])
+
+
+class ChannelStats(object):
+    def __init__(self, max_lag=25, alpha=ALPHA):
+        self.count = 0
+        self.sum_error = 0.
+        self.sum_sq_error = 0.
+        self.max_error = 0.
+        self.sketch = ErrorSketch(alpha)
+        self.lag = LagCorrelation(max_lag)
+
+    def add(self, reference, proposed):
+        error = proposed - reference
+        self.count += 1
+        self.sum_error += error
+        self.sum_sq_error += error * error
+        self.max_error = max(self.max_error, abs(error))
+        self.sketch.add(abs(error))
+        self.lag.add(reference, proposed)
+
+    def summary(self):
+        n = max(self.count, 1)
+        lag, corr = self.lag.best_lag()
+        return {'count': self.count,
+                'mean_error': self.sum_error / n,
+                'rmse': math.sqrt(self.sum_sq_error / n),
+                'max_error': self.max_error,
+                'p50_error': self.sketch.percentile(50),
+                'p90_error': self.sketch.percentile(90),
+                'p99_error': self.sketch.percentile(99),
+                'best_lag': lag,
+                'best_lag_correlation': corr}
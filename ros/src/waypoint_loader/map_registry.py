@@ -0,0 +1,58 @@
+'''
+Registry of the maps known to the waypoint_loader with a bounded LRU cache of preprocessed tracks.
+
+A map is configured by name with the waypoint csv, the target velocity [km/h] and the traffic
+light config of the map, e.g. in the private ~maps parameter of the waypoint_loader:
+
+    maps:
+      sim:
+        path: /path/to/wp_yaw_const.csv
+        velocity: 40
+        light_config: /path/to/sim_traffic_light_config.yaml
+
+Switching back to a recently used map takes the preprocessed track from the cache instead of
+loading, resampling and shaping it again.
+'''
+
+from collections import OrderedDict
+
+
+class MapRegistry(object):
+    def __init__(self, maps, load, capacity=3):
+        """
+        Args:
+            maps (dict): map configuration by name, each with at least a 'path'
+            load (callable): load(name, config) -> preprocessed track
+            capacity (int): maximum number of preprocessed tracks kept in memory
+
+        """
+        for name, config in maps.items():
+            if 'path' not in config:
+                raise ValueError("map {} has no path".format(name))
+        self.maps = maps
+        self.load = load
+        self.capacity = max(1, capacity)
+        self.cache = OrderedDict()
+
+    def names(self):
+        return sorted(self.maps.keys())
+
+    def config(self, name):
+        if name not in self.maps:
+            raise KeyError("unknown map {}, known maps are {}".format(name, ', '.join(self.names())))
+        return self.maps[name]
+
+    def get(self, name):
+        """ preprocessed track of a map and whether it was taken from the cache """
+        config = self.config(name)
+
+        if name in self.cache:
+            track = self.cache.pop(name)
+            self.cache[name] = track  # most recently used
+            return track, True
+
+        track = self.load(name, config)
+        self.cache[name] = track
+        while len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+        return track, False
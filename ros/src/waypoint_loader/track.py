@@ -0,0 +1,184 @@
+'''
+Vectorized track processing for the waypoint_loader.
+
+A track is a numpy structured array with one row per waypoint. Parsing a csv file is done in
+one pass with numpy, the result is cached as binary .npy file keyed by the source path, its size
+and mtime, so warm starts memory-map the cached file instead of parsing the csv again.
+'''
+
+import hashlib
+import os
+import sys
+
+import numpy as np
+import rospkg
+from scipy.interpolate import splev, splprep
+
+sys.path.append(rospkg.RosPack().get_path('styx'))
+from storage import ros_home_dir, save_array
+
+TRACK_DTYPE = np.dtype([('x', '<f8'), ('y', '<f8'), ('z', '<f8'), ('yaw', '<f8')])
+CSV_COLUMNS = ['x', 'y', 'z', 'yaw']
+CACHE_DIR = ros_home_dir('waypoint_cache')
+
+
+def parse_csv(fname):
+    """ parse a waypoint csv (x, y, z[, yaw, ...]) into a track, rows without yaw get yaw = 0 """
+    with open(fname) as wfile:
+        lines = wfile.read().split()
+
+    # rows may have different numbers of columns, pad the short ones with zeros
+    commas = [line.count(',') for line in lines]
+    num_columns = max(commas) + 1
+    if min(commas) + 1 != num_columns:
+        lines = [line + ',0' * (num_columns - 1 - n) for line, n in zip(lines, commas)]
+
+    values = np.fromstring(','.join(lines), dtype=np.float64, sep=',').reshape(len(lines), num_columns)
+
+    track = np.zeros(len(lines), dtype=TRACK_DTYPE)
+    for i, name in enumerate(CSV_COLUMNS[:num_columns]):
+        track[name] = values[:, i]
+    return track
+
+
+def quaternions_from_yaw(yaw):
+    """ (N, 4) quaternions (x, y, z, w) of rotations about z, same as quaternion_from_euler(0, 0, yaw) """
+    q = np.zeros((len(yaw), 4))
+    q[:, 2] = np.sin(0.5 * yaw)
+    q[:, 3] = np.cos(0.5 * yaw)
+    return q
+
+
+def cache_file(fname, cache_dir=CACHE_DIR):
+    """ name of the binary cache of a csv file, changes whenever the csv is modified """
+    stat = os.stat(fname)
+    key = "{}:{}:{}".format(os.path.abspath(fname), stat.st_size, stat.st_mtime)
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npy')
+
+
+def load_track(fname, cache_dir=CACHE_DIR):
+    """ load a track from csv, memory-mapped from the binary cache if available
+
+    Returns:
+        (np.ndarray, bool): track and whether it was read from the cache
+
+    """
+    if not cache_dir:
+        return parse_csv(fname), False
+
+    cached = cache_file(fname, cache_dir)
+    if os.path.isfile(cached):
+        try:
+            track = np.load(cached, mmap_mode='r')
+            if track.dtype == TRACK_DTYPE:
+                return track, True
+        except (IOError, ValueError):
+            pass
+
+    track = parse_csv(fname)
+
+    # other nodes might read the cache at the same time
+    save_array(cached, track)
+
+    return track, False
+
+
+def arc_length(track):
+    """ cumulative distance along the track in the x/y plane, starting at 0 """
+    s = np.zeros(len(track))
+    np.cumsum(np.hypot(np.diff(track['x']), np.diff(track['y'])), out=s[1:])
+    return s
+
+
+def resample(track, spacing, smoothing=0.):
+    """ resample the track at a uniform arc-length spacing
+
+    x, y, z and the unwrapped yaw are fitted with one parametric smoothing spline over the arc
+    length, which is then evaluated every `spacing` meters.
+
+    Args:
+        track (np.ndarray): track to resample
+        spacing (float): distance between two resampled waypoints [m]
+        smoothing (float): allowed mean squared deviation per waypoint, 0 interpolates
+
+    Returns:
+        (np.ndarray, np.ndarray): resampled track and the index of the closest original
+            waypoint for every resampled waypoint
+
+    """
+    s = arc_length(track)
+
+    # the spline parameter has to be strictly increasing, drop duplicate waypoints
+    keep = np.concatenate(([True], np.diff(s) > 1e-6))
+    s_keep = s[keep]
+    coords = [track['x'][keep], track['y'][keep], track['z'][keep], np.unwrap(track['yaw'][keep])]
+
+    tck, _ = splprep(coords, u=s_keep, s=smoothing * len(s_keep), k=min(3, len(s_keep) - 1))
+
+    s_new = np.arange(0., s_keep[-1], spacing)
+    if s_keep[-1] - s_new[-1] > 0.5 * spacing:
+        # keep the end of the track
+        s_new = np.append(s_new, s_keep[-1])
+    x, y, z, yaw = splev(s_new, tck)
+
+    resampled = np.zeros(len(s_new), dtype=TRACK_DTYPE)
+    resampled['x'] = x
+    resampled['y'] = y
+    resampled['z'] = z
+    resampled['yaw'] = np.arctan2(np.sin(yaw), np.cos(yaw))
+
+    # closest original waypoint along the track
+    upper = np.clip(np.searchsorted(s, s_new), 1, len(s) - 1)
+    lower = upper - 1
+    index_map = np.where(s_new - s[lower] <= s[upper] - s_new, lower, upper)
+
+    return resampled, index_map
+
+
+def curvature(track, s, window=5.0):
+    """ signed curvature [1/m] of the path, heading change over +-window meters of arc length """
+    dx = np.diff(track['x'])
+    dy = np.diff(track['y'])
+    valid = np.hypot(dx, dy) > 1e-3
+
+    # heading of each segment, located at the middle of the segment
+    s_mid = 0.5 * (s[:-1] + s[1:])[valid]
+    heading = np.unwrap(np.arctan2(dy[valid], dx[valid]))
+    if len(heading) < 2:
+        return np.zeros(len(s))
+
+    ahead = np.minimum(s + window, s_mid[-1])
+    behind = np.maximum(s - window, s_mid[0])
+    span = np.maximum(ahead - behind, 1e-3)
+    return (np.interp(ahead, s_mid, heading) - np.interp(behind, s_mid, heading)) / span
+
+
+def speed_profile(track, s, max_velocity, max_decel, max_lat_accel, stop_at_end=True, min_velocity=1.0):
+    """ per-waypoint speed caps of the track in one array pass
+
+    The caps are the minimum of the configured velocity, the lateral acceleration limit in
+    curves and (optionally) a stop at the end of the track. The result is made consistent with
+    max_decel, i.e. every cap can be reached from the caps before it by braking with max_decel,
+    so a planner only has to take element-wise minima.
+
+    Returns:
+        np.ndarray: speed cap [m/s] of each waypoint
+
+    """
+    caps = np.full(len(s), float(max_velocity))
+
+    kappa = np.abs(curvature(track, s))
+    np.minimum(caps, np.sqrt(max_lat_accel / np.maximum(kappa, 1e-6)), out=caps)
+
+    if stop_at_end:
+        caps[-1] = 0.
+
+    # backward pass v[i]^2 <= v[j]^2 + 2 * max_decel * (s[j] - s[i]) for all j >= i,
+    # as reversed cumulative minimum
+    reach = caps**2 + 2. * max_decel * s
+    reach = np.minimum.accumulate(reach[::-1])[::-1]
+    caps = np.sqrt(np.maximum(reach - 2. * max_decel * s, 0.))
+
+    # the controller can not follow very small velocities, stop instead
+    caps[caps < min_velocity] = 0.
+    return caps
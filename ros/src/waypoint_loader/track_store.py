@@ -0,0 +1,70 @@
+'''
+Versioned, memory-mapped track file shared by all nodes.
+
+The waypoint_loader writes the processed track once as .npy file (in /dev/shm if available) and
+only publishes a small styx_msgs/TrackDescriptor with the path and version on /base_track.
+Consumers map the file read-only, all nodes share the same physical pages and see exactly the
+same geometry. Other packages import this module with
+
+    sys.path.append(rospkg.RosPack().get_path('waypoint_loader'))
+    from track_store import open_track
+'''
+
+import glob
+import os
+import sys
+
+import numpy as np
+import rospkg
+
+sys.path.append(rospkg.RosPack().get_path('styx'))
+from storage import save_array, shared_memory_dir
+
+STORE_DTYPE = np.dtype([('x', '<f8'), ('y', '<f8'), ('z', '<f8'), ('yaw', '<f8'),
+                        ('speed', '<f8'), ('s', '<f8'), ('wp_id', '<i4')])
+STORE_DIR = shared_memory_dir('styx_tracks')
+
+
+def track_file(name, version, directory=STORE_DIR):
+    return os.path.join(directory, "{}.v{:06d}.npy".format(name, version))
+
+
+def write_track(track, name, version, directory=STORE_DIR):
+    """ atomically write a track of STORE_DTYPE, older versions of the same name are removed
+
+    Nodes that still map an old version keep their pages until they switch, unlinking a
+    mapped file is safe.
+    """
+    if track.dtype != STORE_DTYPE:
+        raise ValueError("track has to be of dtype STORE_DTYPE")
+
+    path = save_array(track_file(name, version, directory), track)
+
+    for old in glob.glob(os.path.join(directory, "{}.v*.npy".format(name))):
+        if old != path:
+            os.remove(old)
+
+    return path
+
+
+def open_track(path):
+    """ map a track file read-only, no copy of the data is made """
+    track = np.load(path, mmap_mode='r')
+    if track.dtype != STORE_DTYPE:
+        raise ValueError("{} is not a track file".format(path))
+    return track
+
+
+def track_from_waypoints(waypoints):
+    """ convert a list of styx_msgs/Waypoint (e.g. of a /base_waypoints Lane) to a track """
+    track = np.zeros(len(waypoints), dtype=STORE_DTYPE)
+    track['x'] = [wp.pose.pose.position.x for wp in waypoints]
+    track['y'] = [wp.pose.pose.position.y for wp in waypoints]
+    track['z'] = [wp.pose.pose.position.z for wp in waypoints]
+    qz = np.array([wp.pose.pose.orientation.z for wp in waypoints])
+    qw = np.array([wp.pose.pose.orientation.w for wp in waypoints])
+    track['yaw'] = 2. * np.arctan2(qz, qw)
+    track['speed'] = [wp.twist.twist.linear.x for wp in waypoints]
+    track['s'][1:] = np.cumsum(np.hypot(np.diff(track['x']), np.diff(track['y'])))
+    track['wp_id'] = np.arange(len(waypoints))
+    return track
@@ -1,18 +1,23 @@
 #!/usr/bin/env python
 
 import os
-import csv
-import math
+import threading
+import time
 
 from geometry_msgs.msg import Quaternion
 
-from styx_msgs.msg import Lane, Waypoint
+from styx_msgs.msg import Lane, Waypoint, TrackDescriptor
+from styx_msgs.srv import SwitchMap, SwitchMapResponse
 
-import tf
+import numpy as np
 import rospy
 
-CSV_HEADER = ['x', 'y', 'z', 'yaw']
+from map_registry import MapRegistry
+from track import CACHE_DIR, arc_length, load_track, quaternions_from_yaw, resample, speed_profile
+from track_store import STORE_DIR, STORE_DTYPE, write_track
+
 MAX_DECEL = 1.0
+MAX_LAT_ACCEL = 3.0
 
 
 class WaypointLoader(object):
@@ -21,59 +26,161 @@ class WaypointLoader(object):
         rospy.init_node('waypoint_loader', log_level=rospy.DEBUG)
 
         self.pub = rospy.Publisher('/base_waypoints', Lane, queue_size=1, latch=True)
-
-        # self.velocity = self.kmph2mps(rospy.get_param('~velocity'))
-        # initial condition
-        self.velocity = 0.0
-
-        self.new_waypoint_loader(rospy.get_param('~path'))
+        self.track_pub = rospy.Publisher('/base_track', TrackDescriptor, queue_size=1, latch=True)
+
+        self.velocity = self.kmph2mps(rospy.get_param('~velocity', 40))
+
+        # map-level speed shaping, see track.speed_profile
+        self.max_decel = rospy.get_param('~max_decel', MAX_DECEL)
+        self.max_lat_accel = rospy.get_param('~max_lat_accel', MAX_LAT_ACCEL)
+        self.stop_at_end = rospy.get_param('~stop_at_end', True)
+
+        # binary cache of parsed csv files, an empty string disables the cache
+        self.cache_dir = rospy.get_param('~cache_dir', CACHE_DIR)
+
+        # optional resampling of the track to a uniform spacing in meters (0 = disabled)
+        self.resample_spacing = rospy.get_param('~resample_spacing', 0.0)
+        self.resample_smoothing = rospy.get_param('~resample_smoothing', 0.0)
+
+        # the track is shared with the other nodes as memory-mapped file, see track_store.py
+        self.store_dir = rospy.get_param('~track_store_dir', STORE_DIR)
+        self.track_version = int(time.time())
+        # the /base_waypoints Lane is still published for tools like rviz
+        self.publish_lane = rospy.get_param('~publish_lane', True)
+
+        # maps that can be switched at runtime with the ~switch_map service, see map_registry.py
+        maps = rospy.get_param('~maps', {})
+        self.lock = threading.Lock()
+        self.active_map = None
+        if maps:
+            self.registry = MapRegistry(maps, self.load_map, rospy.get_param('~map_cache_size', 3))
+            self.switch_map(rospy.get_param('~map', self.registry.names()[0]))
+            rospy.Service('~switch_map', SwitchMap, self.switch_map_cb)
+        else:
+            self.registry = None
+            self.new_waypoint_loader(rospy.get_param('~path'))
         rospy.spin()
 
     def new_waypoint_loader(self, path):
         if os.path.isfile(path):
-            waypoints = self.load_waypoints(path)
-            self.publish(waypoints)
+            track = self.load_track(path, self.velocity)
+            # target velocity of the active map for the waypoint_updater, set before the track is published
+            rospy.set_param('~map_velocity', rospy.get_param('~velocity', 40))
+            self.publish_track(track, os.path.splitext(os.path.basename(path))[0], path)
+            if self.publish_lane:
+                self.publish(self.create_waypoints(track))
             rospy.loginfo('Waypoint Loded')
         else:
             rospy.logerr('%s is not a file', path)
 
-    def quaternion_from_yaw(self, yaw):
-        return tf.transformations.quaternion_from_euler(0., 0., yaw)
+    def load_map(self, name, config):
+        """ preprocessed track of a registered map, called by the registry on a cache miss """
+        if not os.path.isfile(config['path']):
+            raise IOError("{} is not a file".format(config['path']))
+        return self.load_track(config['path'], self.kmph2mps(self.map_velocity(config)))
+
+    def map_velocity(self, config):
+        """ target velocity of a registered map [km/h], ~velocity if the map does not set one """
+        return config.get('velocity', rospy.get_param('~velocity', 40))
+
+    def switch_map(self, name):
+        """ make a registered map the active one and notify the other nodes """
+        with self.lock:
+            start = time.time()
+            track, cached = self.registry.get(name)
+            config = self.registry.config(name)
+
+            # the light config has to be in place before the nodes rebuild on the new descriptor
+            if config.get('light_config'):
+                with open(config['light_config']) as fid:
+                    rospy.set_param('/traffic_light_config', fid.read())
+            rospy.set_param('~map_velocity', self.map_velocity(config))
+
+            self.publish_track(track, name, config['path'])
+            if self.publish_lane:
+                self.publish(self.create_waypoints(track))
+            self.active_map = name
+            rospy.loginfo("switched to map %s (%s) in %.1fms", name, 'cached' if cached else 'loaded',
+                          1000. * (time.time() - start))
+            return self.track_version
+
+    def switch_map_cb(self, request):
+        try:
+            version = self.switch_map(request.map_name)
+        except (KeyError, IOError, ValueError) as e:
+            rospy.logerr("could not switch to map %s: %s", request.map_name, e)
+            return SwitchMapResponse(False, str(e), self.track_version)
+        return SwitchMapResponse(True, "active map {}".format(request.map_name), version)
 
     def kmph2mps(self, velocity_kmph):
         return (velocity_kmph * 1000.) / (60. * 60.)
 
-    def load_waypoints(self, fname):
+    def load_track(self, fname, velocity):
+        """ load, preprocess and return the track as array of track_store.STORE_DTYPE
+
+        Args:
+            fname (str): csv file of the track
+            velocity (float): target velocity of the map [m/s], the upper bound of the speed caps
+
+        """
+        start = time.time()
+        track, cached = load_track(fname, self.cache_dir)
+        rospy.loginfo("%d waypoints %s in %.1fms", len(track), 'read from cache' if cached else 'parsed',
+                      1000. * (time.time() - start))
+
+        if self.resample_spacing > 0:
+            num_original = len(track)
+            track, index_map = resample(track, self.resample_spacing, self.resample_smoothing)
+            rospy.loginfo("resampled %d waypoints to %d with a spacing of %.2fm", num_original, len(track),
+                          self.resample_spacing)
+        else:
+            index_map = np.arange(len(track))
+
+        processed = np.zeros(len(track), dtype=STORE_DTYPE)
+        for name in ['x', 'y', 'z', 'yaw']:
+            processed[name] = track[name]
+        processed['s'] = arc_length(track)
+        # speed cap of each waypoint: configured velocity, curvature and stop at the end of the track
+        processed['speed'] = speed_profile(track, processed['s'], velocity, self.max_decel,
+                                           self.max_lat_accel, self.stop_at_end)
+        # index of the original waypoint (csv row) of each published waypoint
+        processed['wp_id'] = index_map
+        return processed
+
+    def create_waypoints(self, track):
+        # convert to python floats once, element access of numpy arrays is slow
+        x = track['x'].tolist()
+        y = track['y'].tolist()
+        z = track['z'].tolist()
+        q = quaternions_from_yaw(track['yaw']).tolist()
+        speed = track['speed'].tolist()
+
         waypoints = []
-        with open(fname) as wfile:
-            reader = csv.DictReader(wfile, CSV_HEADER)
-            for wp in reader:
-                p = Waypoint()
-                p.pose.pose.position.x = float(wp['x'])
-                p.pose.pose.position.y = float(wp['y'])
-                p.pose.pose.position.z = float(wp['z'])
-                q = self.quaternion_from_yaw(float(wp['yaw']))
-                p.pose.pose.orientation = Quaternion(*q)
-                p.twist.twist.linear.x = float(self.velocity)
-
-                waypoints.append(p)
-        # return self.decelerate(waypoints)
+        for i in range(len(track)):
+            p = Waypoint()
+            p.pose.pose.position.x = x[i]
+            p.pose.pose.position.y = y[i]
+            p.pose.pose.position.z = z[i]
+            p.pose.pose.orientation = Quaternion(*q[i])
+            p.twist.twist.linear.x = speed[i]
+
+            waypoints.append(p)
         return waypoints
 
-    def distance(self, p1, p2):
-        x, y, z = p1.x - p2.x, p1.y - p2.y, p1.z - p2.z
-        return math.sqrt(x*x + y*y + z*z)
-
-    def decelerate(self, waypoints):
-        last = waypoints[-1]
-        last.twist.twist.linear.x = 0.
-        for wp in waypoints[:-1][::-1]:
-            dist = self.distance(wp.pose.pose.position, last.pose.pose.position)
-            vel = math.sqrt(2 * MAX_DECEL * dist)
-            if vel < 1.:
-                vel = 0.
-            wp.twist.twist.linear.x = min(vel, wp.twist.twist.linear.x)
-        return waypoints
+    def publish_track(self, track, name, source):
+        self.track_version += 1
+        path = write_track(track, name, self.track_version, self.store_dir)
+
+        descriptor = TrackDescriptor()
+        descriptor.header.frame_id = '/world'
+        descriptor.header.stamp = rospy.Time.now()
+        descriptor.path = path
+        descriptor.map_name = name
+        descriptor.source = source
+        descriptor.version = self.track_version
+        descriptor.num_waypoints = len(track)
+        self.track_pub.publish(descriptor)
+        rospy.loginfo("track %s version %d with %d waypoints shared at %s", name, self.track_version, len(track), path)
 
     def publish(self, waypoints):
         lane = Lane()
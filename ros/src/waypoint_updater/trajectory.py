@@ -0,0 +1,63 @@
+'''
+Compact trajectory message (styx_msgs/Trajectory) of the waypoint_updater and its adapters.
+
+The waypoint_updater publishes every trajectory twice: as legacy styx_msgs/Lane on
+/final_waypoints (pure_pursuit) and as parallel float32 arrays on /final_trajectory, which are
+serialized and decoded in one struct call per array instead of one nested Waypoint message with
+two headers per waypoint. Python consumers subscribe to /final_trajectory and import this
+module with
+
+    sys.path.append(rospkg.RosPack().get_path('waypoint_updater'))
+    from trajectory import trajectory_arrays
+'''
+
+import math
+
+import numpy as np
+from styx_msgs.msg import Lane, Trajectory, Waypoint
+
+FIELDS = ['x', 'y', 'z', 'yaw', 'v', 's']
+
+
+def make_trajectory(header, start_index, x, y, z, yaw, v, s):
+    """ Trajectory of sequences (lists or arrays) of equal length """
+    trajectory = Trajectory()
+    trajectory.header.stamp = header.stamp
+    trajectory.header.frame_id = header.frame_id
+    trajectory.start_index = start_index
+    for name, values in zip(FIELDS, (x, y, z, yaw, v, s)):
+        setattr(trajectory, name, values.tolist() if isinstance(values, np.ndarray) else list(values))
+    return trajectory
+
+
+def trajectory_arrays(trajectory):
+    """ dict of field name -> float64 array """
+    return {name: np.asarray(getattr(trajectory, name), dtype=np.float64) for name in FIELDS}
+
+
+def trajectory_from_lane(lane, start_index=0, s0=0.):
+    """ adapter of a legacy Lane, s starts at s0 at the first waypoint """
+    x = [wp.pose.pose.position.x for wp in lane.waypoints]
+    y = [wp.pose.pose.position.y for wp in lane.waypoints]
+    z = [wp.pose.pose.position.z for wp in lane.waypoints]
+    yaw = [2. * math.atan2(wp.pose.pose.orientation.z, wp.pose.pose.orientation.w) for wp in lane.waypoints]
+    v = [wp.twist.twist.linear.x for wp in lane.waypoints]
+    s = s0 + np.concatenate(([0.], np.cumsum(np.hypot(np.diff(x), np.diff(y))))) if x else []
+    return make_trajectory(lane.header, start_index, x, y, z, yaw, v, s)
+
+
+def lane_from_trajectory(trajectory):
+    """ adapter for consumers of the legacy Lane """
+    lane = Lane()
+    lane.header.stamp = trajectory.header.stamp
+    lane.header.frame_id = trajectory.header.frame_id
+    for x, y, z, yaw, v in zip(trajectory.x, trajectory.y, trajectory.z, trajectory.yaw, trajectory.v):
+        wp = Waypoint()
+        wp.pose.pose.position.x = x
+        wp.pose.pose.position.y = y
+        wp.pose.pose.position.z = z
+        wp.pose.pose.orientation.z = math.sin(0.5 * yaw)
+        wp.pose.pose.orientation.w = math.cos(0.5 * yaw)
+        wp.twist.twist.linear.x = v
+        lane.waypoints.append(wp)
+    return lane
@@ -1,13 +1,26 @@
 #!/usr/bin/env python
 
 import rospy
+import rospkg
 from std_msgs.msg import Int32, Bool
 from geometry_msgs.msg import PoseStamped, TwistStamped
-from styx_msgs.msg import Lane, Waypoint
+from styx_msgs.msg import Lane, Waypoint, TrackDescriptor, TraceContext, Trajectory
 
 import math
 import csv
 import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.append(rospkg.RosPack().get_path('waypoint_loader'))
+sys.path.append(rospkg.RosPack().get_path('twist_controller'))
+sys.path.append(rospkg.RosPack().get_path('styx'))
+from track_store import open_track, track_from_waypoints
+from rt_config import configure_from_params
+from latency_trace import start_trace, extend
+from trajectory import make_trajectory
 
 '''
 This node will publish waypoints from the car's current position to some `x` distance ahead.
@@ -44,13 +57,22 @@ class WaypointUpdater(object):
         # Initialize client node and register it with the master
         rospy.init_node('waypoint_updater')
 
+        # cpu affinity and scheduling of the planning node (see twist_controller/rt_config.py)
+        configure_from_params('waypoint_updater')
+
         # Define subscribers to enable the client node to read messages from topics
         # rospy.Subscriber("/topic_name", message_type, callback_function)
         # Each time a message of message_type on topic /topic_name is received,
         # it is passed as an argument to callback_function.
         rospy.Subscriber('/current_pose', PoseStamped, self.pose_cb)
-        rospy.Subscriber('/base_waypoints', Lane, self.waypoints_cb)
+        # the global map is either read from the memory-mapped track file of the waypoint_loader
+        # or from the /base_waypoints Lane
+        if rospy.get_param('~use_track_store', True):
+            rospy.Subscriber('/base_track', TrackDescriptor, self.track_cb)
+        else:
+            rospy.Subscriber('/base_waypoints', Lane, self.waypoints_cb)
         rospy.Subscriber('/traffic_waypoint', Int32, self.traffic_cb)
+        rospy.Subscriber('/trace/traffic_waypoint', TraceContext, self.traffic_trace_cb, queue_size=1)
         rospy.Subscriber('/obstacle_waypoint', Int32, self.obstacle_cb)
 
         # Subscription for trajectory planning (start value) and debugging
@@ -62,14 +84,24 @@ class WaypointUpdater(object):
         # publish message of message_type on topic /topic_name with a given queue_size
         # (maximum number messages that may be stored in the publisher queue before messages are dropped)
         self.final_waypoints_pub = rospy.Publisher('final_waypoints', Lane, queue_size=1)
+        # the same trajectory as compact arrays for python consumers, see trajectory.py
+        self.final_trajectory_pub = rospy.Publisher('final_trajectory', Trajectory, queue_size=1)
         self.current_waypoint_pub = rospy.Publisher('/current_waypoint', Int32, queue_size=1)
+        # latency traces of the poses and traffic light states that went into final_waypoints
+        self.trace_pub = rospy.Publisher('/trace/final_waypoints', TraceContext, queue_size=10)
 
         # Member variables of the WaypointUpdater class
-        self.waypoints = None  # global map waypoints initially loaded and stored
+        self.track = None  # global map waypoints initially loaded and stored (see track_store.py)
+        self.track_version = None  # version of the shared track file, changes on a map switch
+        self.track_lock = threading.Lock()  # the track is replaced on a map switch
         self.waypoint_distances = None  # initially pre calculated distances between global waypoints
+        self.planned_velocity = None  # velocity of each global waypoint planned in the last cycles
+        self.speed_cap = None  # map-level speed limit of each global waypoint (see track.speed_profile)
         self.last_closest_wp = None  # index of closest waypoint to car position from last cycle
         self.last_next_wp = None  # index of next waypoint from last cycle (first waypoint of last trajectory)
         self.car_pose = None  # car position (in m) and orientation data (in rad)
+        self.car_pose_header = None  # stamp and seq of the pose, origin of the trajectory
+        self.traffic_trace = None  # trace of the latest traffic light state, not yet in a trajectory
         self.linear_velocity = None  # car longitudinal velocity in m/s
         self.angular_velocity = None  # car yaw rate in rad/s
         self.red_light_wp = -1  # index of the waypoint for nearest upcoming red light's stop line
@@ -85,10 +117,7 @@ class WaypointUpdater(object):
             # is within this node's private namespace
             # The second parameter is the default value to be returned, in the case that rospy.get_param()
             # was unable to get the parameter from the param server
-            self.velocity = rospy.get_param('/waypoint_loader/velocity')
-            # Convert target velocity value to SI units (m/s)
-            # velocity parameter given in km/h (see waypoint_loader.py)
-            self.velocity = (self.velocity * 1000.) / (60. * 60.)
+            self.velocity = self.map_velocity()
         else:
             # Set target velocity according to own velocity parameter
             self.velocity = OVERRIDE_VELOCITY
@@ -149,12 +178,14 @@ class WaypointUpdater(object):
         # car_pose.position.x/y/z
         # car_pose.orientation.x/y/z/w
         self.car_pose = msg.pose
+        self.car_pose_header = msg.header
 
         # Start publishing relevant waypoints when global map data is available
         # (initial subscription successful)
-        if self.waypoints is not None:
+        if self.track is not None:
             # map data available
-            self.publish_final_waypoints()
+            with self.track_lock:
+                self.publish_final_waypoints()
 
     # Callback to set current self.linear_velocity and self.angular_velocity variable
     # for incoming message msg on subscribed topic
@@ -167,19 +198,64 @@ class WaypointUpdater(object):
         self.dbw_enabled = tf
         self.force_update |= not self.dbw_enabled
 
-    # Callback to set current self.waypoints variable for incoming message static_lane on subscribed topic
+    # Callback to set current self.track variable for incoming message static_lane on subscribed topic
     # (rospy.Subscriber('/base_waypoints', Lane, self.waypoints_cb))
     def waypoints_cb(self, static_lane):
-        # Initially called once to set the static waypoint variable self.waypoints for the track (len = 10902)
-        if self.waypoints is None:
-            # waypoints.pose.pose.position.x/y/z
-            # waypoints.pose.pose.orientation.x/y/z/w
-            # waypoints.twist.twist.linear.x/y/z
-            # waypoints.twist.twist.angular.x/y/z
-            self.waypoints = static_lane.waypoints  # initialize global waypoints
-            self.update_distances()  # initialize waypoint distances
-            self.last_closest_wp = None  # initialize closest waypoint to car position
-            self.last_next_wp = None
+        # Called once per map to set the static waypoint variable self.track for the track (len = 10902)
+        # waypoints.pose.pose.position.x/y/z
+        # waypoints.pose.pose.orientation.x/y/z/w
+        # waypoints.twist.twist.linear.x/y/z
+        # waypoints.twist.twist.angular.x/y/z
+        self.set_track(track_from_waypoints(static_lane.waypoints))
+
+    # Callback to map the shared track file of the waypoint_loader
+    # (rospy.Subscriber('/base_track', TrackDescriptor, self.track_cb))
+    def track_cb(self, descriptor):
+        # Called once per map version, the track file is mapped read-only without copying the data
+        if descriptor.version == self.track_version:
+            return
+        track = open_track(descriptor.path)
+        if len(track) != descriptor.num_waypoints:
+            rospy.logerr("track file {} does not match its descriptor".format(descriptor.path))
+            return
+        rospy.loginfo("map {} version {} with {} waypoints".format(descriptor.map_name, descriptor.version,
+                                                                   len(track)))
+        self.set_track(track)
+        self.track_version = descriptor.version
+
+    # Helper function to get the target velocity of the active map in m/s
+    def map_velocity(self):
+        # set by the waypoint_loader before it publishes a track, given in km/h (see waypoint_loader.py)
+        velocity = rospy.get_param('/waypoint_loader/map_velocity', rospy.get_param('/waypoint_loader/velocity'))
+        # Convert target velocity value to SI units (m/s)
+        return (velocity * 1000.) / (60. * 60.)
+
+    # Helper function to initialize all map dependant variables
+    def set_track(self, track):
+        with self.track_lock:
+            self._set_track(track)
+
+    def _set_track(self, track):
+        # fields x, y, z, yaw, speed, s, wp_id (one entry per global waypoint)
+        self.wp_x = track['x']
+        self.wp_y = track['y']
+        self.wp_z = track['z']
+        self.wp_yaw = track['yaw']
+        self.planned_velocity = np.zeros(len(track))
+        # speed caps shaped by the waypoint_loader, tracks without caps are only limited by self.velocity
+        self.speed_cap = np.array(track['speed'], dtype=np.float64)
+        if not np.any(self.speed_cap > 0):
+            self.speed_cap[:] = np.inf
+        if OVERRIDE_VELOCITY is None:
+            # every map can have its own target velocity (see waypoint_loader.py)
+            self.velocity = self.map_velocity()
+        self.update_distances(track)  # initialize waypoint distances
+        self.last_closest_wp = None  # initialize closest waypoint to car position
+        self.last_next_wp = None
+        self.red_light_wp = -1  # indexes of the previous map are invalid
+        self.object_wp = -1
+        self.force_update = True
+        self.track = track  # initialize global waypoints
 
     # Callback to set current self.red_light_wp variable
     # for incoming message msg on subscribed topic
@@ -188,14 +264,19 @@ class WaypointUpdater(object):
         # Iteratively called to set the waypoint for a red traffic light's stop line
         if msg.data != self.red_light_wp:
             # changed traffic light detection
-            change_in_lookahead = self.red_light_wp - self.last_next_wp < LOOKAHEAD_WPS or \
-                                  msg.data - self.last_next_wp < LOOKAHEAD_WPS
+            change_in_lookahead = self.last_next_wp is not None and \
+                (self.red_light_wp - self.last_next_wp < LOOKAHEAD_WPS or msg.data - self.last_next_wp < LOOKAHEAD_WPS)
 
             # traffic light is within our lookahead horizon, force update of trajectory
             self.force_update |= change_in_lookahead
             # update internal traffic-light state
             self.red_light_wp = msg.data
 
+    # Callback to keep the latency trace of the latest traffic light state
+    # (rospy.Subscriber('/trace/traffic_waypoint', TraceContext, self.traffic_trace_cb))
+    def traffic_trace_cb(self, trace):
+        self.traffic_trace = trace
+
     # Callback to set current self.object_wp variable
     # for incoming message msg on subscribed topic
     # (rospy.Subscriber('/obstacle_waypoint', Int32, self.obstacle_cb))
@@ -226,14 +307,29 @@ class WaypointUpdater(object):
         return math.sqrt((a.x-b.x)**2 + (a.y-b.y)**2 + (a.z-b.z)**2)
 
     # Helper function to calculate the waypoint_distances between points in the waypoints vector
-    def update_distances(self):
-        self.waypoint_distances = []
+    def update_distances(self, track):
+        self.waypoint_distances = np.sqrt(np.diff(track['x'])**2 + np.diff(track['y'])**2 + np.diff(track['z'])**2)
+
+    # Helper function to create the waypoint messages of the global waypoints [start, end)
+    def create_waypoints(self, start, end):
+        x = self.wp_x[start:end].tolist()
+        y = self.wp_y[start:end].tolist()
+        z = self.wp_z[start:end].tolist()
+        yaw = self.wp_yaw[start:end].tolist()
+        velocity = self.planned_velocity[start:end].tolist()
+
+        waypoints = []
+        for i in range(len(x)):
+            wp = Waypoint()
+            wp.pose.pose.position.x = x[i]
+            wp.pose.pose.position.y = y[i]
+            wp.pose.pose.position.z = z[i]
+            wp.pose.pose.orientation.z = math.sin(0.5 * yaw[i])
+            wp.pose.pose.orientation.w = math.cos(0.5 * yaw[i])
+            wp.twist.twist.linear.x = velocity[i]
+            waypoints.append(wp)
 
-        for i in range(1, len(self.waypoints)):
-            a = self.waypoints[i-1].pose.pose.position
-            b = self.waypoints[i].pose.pose.position
-            delta = self.distance(a, b)
-            self.waypoint_distances.append(delta)
+        return waypoints
 
     # Helper function to find the closest waypoint to the current vehicle position in the global waypoints vector
     def closest_waypoint(self):
@@ -248,7 +344,7 @@ class WaypointUpdater(object):
         car_y = self.car_pose.position.y
 
         # Initialize search
-        num_waypoints = len(self.waypoints)
+        num_waypoints = len(self.wp_x)
         # The waypoint the ego vehicle was closest to in the last cycle
         if self.last_closest_wp is None:
             # last waypoint not known, start in the middle of the track
@@ -261,8 +357,8 @@ class WaypointUpdater(object):
 
         def dist_squared(i_wp):
             """ returns the squared distance to waypoint[i]"""
-            dx = self.waypoints[i_wp].pose.pose.position.x - car_x
-            dy = self.waypoints[i_wp].pose.pose.position.y - car_y
+            dx = self.wp_x[i_wp] - car_x
+            dy = self.wp_y[i_wp] - car_y
             return dx**2 + dy**2
 
         # Initialize minimum distance with distance to last_car_waypoint
@@ -272,6 +368,12 @@ class WaypointUpdater(object):
         # Force check of all waypoints in case we are way off our last known position
         test_all = test_all or d_min > 10**2
 
+        if test_all:
+            # vectorized search over all waypoints
+            index = int(np.argmin((self.wp_x - car_x)**2 + (self.wp_y - car_y)**2))
+            self.last_closest_wp = index
+            return index
+
         # Search waypoints ahead
         for k in range(self.last_closest_wp + 1, num_waypoints):
             d_k = dist_squared(k)
@@ -308,8 +410,8 @@ class WaypointUpdater(object):
         i_closest_wp = self.closest_waypoint()
 
         # Global map position of the closest waypoint to the ego vehicle
-        map_x = self.waypoints[i_closest_wp].pose.pose.position.x
-        map_y = self.waypoints[i_closest_wp].pose.pose.position.y
+        map_x = self.wp_x[i_closest_wp]
+        map_y = self.wp_y[i_closest_wp]
 
         # Ego vehicle position in global map coordinates
         car_x = self.car_pose.position.x
@@ -333,7 +435,7 @@ class WaypointUpdater(object):
         i_next_wp = i_closest_wp
         if angle > math.pi / 4.0:
             i_next_wp = i_closest_wp + 1
-            if i_next_wp == len(self.waypoints):
+            if i_next_wp == len(self.wp_x):
                 i_next_wp = 0
 
         return i_next_wp
@@ -342,10 +444,10 @@ class WaypointUpdater(object):
     # (publisher called in callback pose_cb when relevant ego pose data is available)
     def publish_final_waypoints(self):
 
-        if self.waypoints is None or self.car_pose is None:
+        if self.track is None or self.car_pose is None:
             # Early exit due to missing data
             if DEBUG_WAYPOINTS_LOG:
-                rospy.loginfo("Early exit due to missing data: self.waypoints = {}, self.car_pose = {}".format(self.waypoints, self.car_pose))
+                rospy.loginfo("Early exit due to missing data: self.track = {}, self.car_pose = {}".format(self.track, self.car_pose))
             return
 
         # Get next waypoint ID with helper function
@@ -367,7 +469,7 @@ class WaypointUpdater(object):
         lookahead_wp = next_wp + LOOKAHEAD_WPS
 
         # Get next stop waypoint, either end of track or red-light
-        num_waypoints = len(self.waypoints)  # total number of given global waypoints for track
+        num_waypoints = len(self.wp_x)  # total number of given global waypoints for track
         if lookahead_wp >= num_waypoints - 1:
             # End of track in lookahead horizon
             lookahead_wp = num_waypoints  # lookahead waypoint set to end of track
@@ -391,7 +493,7 @@ class WaypointUpdater(object):
                 stop_wp = -1
 
         # Generate trajectory waypoint vector
-        traj_waypoints = self.waypoints[next_wp:lookahead_wp]
+        traj_waypoints = self.create_waypoints(next_wp, lookahead_wp)
 
         # Generate stop waypoint index in reference to trajectory vector
         traj_stop_wp = stop_wp - next_wp
@@ -400,12 +502,14 @@ class WaypointUpdater(object):
         dist_next = self.distance(self.car_pose.position, traj_waypoints[0].pose.pose.position)
 
         # Generate distance vector for trajectory
-        traj_distances = self.waypoint_distances[next_wp:lookahead_wp-1]
+        traj_distances = self.waypoint_distances[next_wp:lookahead_wp-1].tolist()
         traj_distances.insert(0, dist_next)
 
         if self.dbw_enabled:
             # Convert path to trajectory (plan ahead with constant acceleration/deceleration)
-            traj_waypoints = self.path_to_trajectory(traj_waypoints, traj_distances, traj_stop_wp, self.force_update)
+            traj_caps = self.speed_cap[next_wp:lookahead_wp].tolist()
+            traj_waypoints = self.path_to_trajectory(traj_waypoints, traj_distances, traj_caps, traj_stop_wp,
+                                                     self.force_update)
             self.force_update = False
         else:
             # Manual driving, set current velocity as planned velocity
@@ -416,16 +520,25 @@ class WaypointUpdater(object):
                     current_velocity = self.linear_velocity
                 self.set_waypoint_velocity(traj_waypoints, i, current_velocity)
 
+        # Remember the planned velocities, the next cycle continues the trajectory from there
+        self.planned_velocity[next_wp:lookahead_wp] = [self.get_waypoint_velocity(wp) for wp in traj_waypoints]
+
         # Generate Lane message to publish
         if traj_waypoints is not None:
             lane = Lane()
             lane.header.frame_id = '/trajectory'
+            # Time(0) as before, the pose the trajectory was planned from is carried by /trace/final_waypoints
             lane.header.stamp = rospy.Time(0)
             lane.waypoints = traj_waypoints
 
             # Update waypoints
 
             self.final_waypoints_pub.publish(lane)
+            self.final_trajectory_pub.publish(make_trajectory(
+                lane.header, next_wp, self.wp_x[next_wp:lookahead_wp], self.wp_y[next_wp:lookahead_wp],
+                self.wp_z[next_wp:lookahead_wp], self.wp_yaw[next_wp:lookahead_wp],
+                self.planned_velocity[next_wp:lookahead_wp], np.cumsum(traj_distances)))
+            self.publish_traces()
 
         # **********************************************************
         # Debug output (csv and console)
@@ -467,12 +580,22 @@ class WaypointUpdater(object):
             print("---> self.linear_velocity    : {}".format(self.linear_velocity))
             print("---> traj_waypoints_velx[0]  : {}".format(traj_waypoints_velx_debug[0]))
             print("---> traj_waypoints_velx[{}] : {}".format(len(traj_waypoints_velx_debug)-1, traj_waypoints_velx_debug[len(traj_waypoints_velx_debug)-1]))
-            print("---> len(self.waypoints)     : {}".format(len(self.waypoints)))
+            print("---> len(self.wp_x)          : {}".format(len(self.wp_x)))
             print('***********************************************************')
 
+    # Helper function that publishes the latency traces of a published trajectory: the pose it was
+    # planned from and the traffic light state that arrived since the last trajectory (see styx/latency_trace.py)
+    def publish_traces(self):
+        now = rospy.Time.now()
+        self.trace_pub.publish(start_trace(self.car_pose_header, '/current_pose', 'waypoint_updater', now))
+        traffic_trace, self.traffic_trace = self.traffic_trace, None
+        if traffic_trace is not None:
+            self.trace_pub.publish(extend(traffic_trace, 'waypoint_updater', now))
+
     # Helper function that generates a trajectory from the planned local waypoints
     # using given acceleration and deceleration values and taking into account the target speed
-    def path_to_trajectory(self, waypoints, distances, stop_index=-1, force_update=False):
+    # and the map-level speed cap of each waypoint
+    def path_to_trajectory(self, waypoints, distances, caps, stop_index=-1, force_update=False):
 
         # Number of path waypoints to associate a target velocity with (trajectory)
         num_waypoints = len(waypoints)
@@ -509,7 +632,7 @@ class WaypointUpdater(object):
                 v_traj = math.sqrt(current_velocity ** 2 + 2 * self.plan_acceleration * x_traj)
                 # ensure minimum waypoint speed during acceleration to avoid deadlocks in standstill
                 v_traj = max(v_traj, MIN_WAYPOINT_SPEED_ACC)
-                self.set_waypoint_velocity(waypoints, i, min(self.velocity, v_traj))
+                self.set_waypoint_velocity(waypoints, i, min(self.velocity, v_traj, caps[i]))
         else:
             # Stop at stop-line with self.plan_deceleration
             dist_rem = sum(distances[0:stop_index])
@@ -526,8 +649,8 @@ class WaypointUpdater(object):
                 else:
                     v_traj = 0.0
 
-                # Limit trajectory velocity value by global waypoint velocity (target speed)
-                v_traj = min(self.velocity, v_traj, v_traj_acc)
+                # Limit trajectory velocity value by target speed and speed cap of the waypoint
+                v_traj = min(self.velocity, v_traj, v_traj_acc, caps[i])
 
                 # Set waypoint velocity values to generate trajectory as waypoints return value
                 self.set_waypoint_velocity(waypoints, i, v_traj)